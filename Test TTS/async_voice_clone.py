@@ -3,18 +3,29 @@ import time
 import sys
 import os
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.health import HealthMonitor, shared_state_file
+from common.transport import get_session
+
+session = get_session()
+
 # 🔐 Nhập API key
 API_KEY = ""
 
 # === KIỂM TRA SERVER TRƯỚC KHI UPLOAD ===
 print("🔍 Kiểm tra trạng thái server...")
-try:
+def probe_ausync():
     test_url = "https://api.ausynclab.org/api/v1/voices/list"
-    test_res = requests.get(test_url, headers={"X-API-Key": API_KEY, "accept": "application/json"}, timeout=30)
+    test_res = session.get(test_url, headers={"X-API-Key": API_KEY, "accept": "application/json"})
     test_res.raise_for_status()
+    return True
+
+# Kết quả kiểm tra được cache và dùng chung với các script khác trên máy
+ausync_health = HealthMonitor("ausync", probe_ausync, ttl=300, state_file=shared_state_file("ausync"))
+if ausync_health.is_available():
     print("✅ Server hoạt động bình thường")
-except requests.exceptions.RequestException as e:
-    print("❌ Không thể kết nối đến server:", e)
+else:
+    print("❌ Không thể kết nối đến server (hoặc server đang lỗi liên tục, thử lại sau)")
     sys.exit(1)
 
 # === BƯỚC 1: Clone giọng giáo viên ===
@@ -44,12 +55,11 @@ if os.path.getsize(audio_file_path) > 10 * 1024 * 1024:  # Kiểm tra file > 10M
 try:
     with open(audio_file_path, "rb") as f:
         files = {"audio_file": (audio_file_path, f, "audio/mpeg")}
-        res = requests.post(
+        res = session.post(
             voice_register_url,
             headers=headers,
             params=query_params,
-            files=files,
-            timeout=60  # Tăng timeout lên 60 giây
+            files=files
         )
         res.raise_for_status()
 except requests.exceptions.ReadTimeout:
@@ -90,8 +100,9 @@ headers_tts = {
 }
 
 try:
-    res_tts = requests.post(tts_url, headers=headers_tts, json=data, timeout=30)
+    res_tts = session.post(tts_url, headers=headers_tts, json=data)
     res_tts.raise_for_status()
+    ausync_health.record_success()
 except requests.exceptions.ConnectionError as e:
     print("❌ Lỗi kết nối mạng:", e)
     sys.exit(1)
@@ -111,7 +122,7 @@ max_attempts = 15
 for attempt in range(max_attempts):
     try:
         audio_info_url = f"https://api.ausynclab.org/api/v1/speech/{audio_id}"
-        res_info = requests.get(audio_info_url, headers={"X-API-Key": API_KEY, "accept": "application/json"}, timeout=30)
+        res_info = session.get(audio_info_url, headers={"X-API-Key": API_KEY, "accept": "application/json"})
         res_info.raise_for_status()
         audio_data = res_info.json().get("result", {})
         if audio_data.get("state") == "SUCCEED" and audio_data.get("audio_url"):
@@ -133,7 +144,7 @@ else:
 # === BƯỚC 4: Tải file audio về ===
 print("⬇️ Đang tải file bài giảng về...")
 try:
-    audio_file = requests.get(audio_url, timeout=30).content
+    audio_file = session.get(audio_url).content
     with open("bai_giang_ausync.mp3", "wb") as f:
         f.write(audio_file)
     print("🎉 Đã lưu bài giảng tại: bai_giang_ausync.mp3")
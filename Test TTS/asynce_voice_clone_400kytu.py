@@ -4,31 +4,20 @@ import sys
 import os
 from pydub import AudioSegment
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.audio_stream import StreamingEncoder
+from common.health import HealthMonitor, shared_state_file
+from common.segmenter import split_text
+from common.transport import get_session
+
+session = get_session()
+
 # 🔐 Nhập API key
 API_KEY = ""
 
 # Giới hạn ký tự cho tài khoản miễn phí
 MAX_CHAR_LIMIT = 500
 
-# Hàm chia văn bản thành các đoạn < 500 ký tự
-def split_text(text, max_length=MAX_CHAR_LIMIT):
-    sentences = text.split(". ")
-    chunks = []
-    current_chunk = ""
-    
-    for sentence in sentences:
-        sentence = sentence.strip() + ". " if sentence.strip() else ""
-        if len(current_chunk) + len(sentence) <= max_length:
-            current_chunk += sentence
-        else:
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-            current_chunk = sentence
-    if current_chunk:
-        chunks.append(current_chunk.strip())
-    
-    return chunks
-
 # Hàm đọc văn bản từ file .txt
 def read_text_from_file(file_path):
     try:
@@ -46,15 +35,10 @@ def read_text_from_file(file_path):
 # Hàm ghép các file audio và xóa file tạm
 def merge_audio_files(file_paths, output_file):
     try:
-        combined = AudioSegment.empty()
-        for file_path in file_paths:
-            # Dùng from_file để nhận diện định dạng tự động
-            audio = AudioSegment.from_file(file_path)
-            # Chuẩn hóa: stereo, 24000 Hz (khớp với file đầu vào)
-            audio = audio.set_channels(2).set_frame_rate(24000)
-            combined += audio
-        # Xuất MP3 với bitrate 128k
-        combined.export(output_file, format="mp3", bitrate="128k")
+        # Stereo, 24000 Hz (khớp với file đầu vào), MP3 128k; từng file được giải mã và ghi thẳng vào encoder
+        with StreamingEncoder(output_file, frame_rate=24000, channels=2, bitrate="128k") as encoder:
+            for file_path in file_paths:
+                encoder.write_file(file_path)
         print(f"🎉 Đã ghép các file thành: {output_file}")
         # Xóa file tạm
         for file_path in file_paths:
@@ -66,13 +50,18 @@ def merge_audio_files(file_paths, output_file):
 
 # === KIỂM TRA SERVER ===
 print("🔍 Kiểm tra trạng thái server...")
-try:
+def probe_ausync():
     test_url = "https://api.ausynclab.org/api/v1/voices/list"
-    test_res = requests.get(test_url, headers={"X-API-Key": API_KEY, "accept": "application/json"}, timeout=30)
+    test_res = session.get(test_url, headers={"X-API-Key": API_KEY, "accept": "application/json"})
     test_res.raise_for_status()
+    return True
+
+# Kết quả kiểm tra được cache và dùng chung với các script khác trên máy
+ausync_health = HealthMonitor("ausync", probe_ausync, ttl=300, state_file=shared_state_file("ausync"))
+if ausync_health.is_available():
     print("✅ Server hoạt động bình thường")
-except requests.exceptions.RequestException as e:
-    print("❌ Không thể kết nối đến server:", e)
+else:
+    print("❌ Không thể kết nối đến server (hoặc server đang lỗi liên tục, thử lại sau)")
     sys.exit(1)
 
 # === BƯỚC 1: Dùng voice_id có sẵn ===
@@ -81,7 +70,7 @@ print("✅ Sử dụng Voice ID:", voice_id)
 
 # === BƯỚC 2: Đọc văn bản từ file ===
 text = read_text_from_file("input_text.txt")
-text_chunks = split_text(text, MAX_CHAR_LIMIT)
+text_chunks = split_text(text, MAX_CHAR_LIMIT, keep_paragraphs=False)
 print(f"🎤 Chuẩn bị tạo bài giảng với {len(text_chunks)} đoạn văn bản...")
 
 audio_urls = []
@@ -109,8 +98,9 @@ for i, chunk in enumerate(text_chunks):
     }
 
     try:
-        res_tts = requests.post(tts_url, headers=headers_tts, json=data, timeout=30)
+        res_tts = session.post(tts_url, headers=headers_tts, json=data)
         res_tts.raise_for_status()
+        ausync_health.record_success()
     except requests.exceptions.ConnectionError as e:
         print(f"❌ Lỗi kết nối mạng (đoạn {i+1}):", e)
         sys.exit(1)
@@ -130,7 +120,7 @@ for i, chunk in enumerate(text_chunks):
     for attempt in range(max_attempts):
         try:
             audio_info_url = f"https://api.ausynclab.org/api/v1/speech/{audio_id}"
-            res_info = requests.get(audio_info_url, headers={"X-API-Key": API_KEY, "accept": "application/json"}, timeout=30)
+            res_info = session.get(audio_info_url, headers={"X-API-Key": API_KEY, "accept": "application/json"})
             res_info.raise_for_status()
             audio_data = res_info.json().get("result", {})
             if audio_data.get("state") == "SUCCEED" and audio_data.get("audio_url"):
@@ -154,7 +144,7 @@ for i, chunk in enumerate(text_chunks):
 for i, audio_url in enumerate(audio_urls):
     print(f"⬇️ Đang tải file bài giảng (đoạn {i+1})...")
     try:
-        response = requests.get(audio_url, timeout=60)
+        response = session.get(audio_url)
         response.raise_for_status()
         wav_file = f"bai_giang_ausync_part_{i+1}.wav"
         with open(wav_file, "wb") as f:
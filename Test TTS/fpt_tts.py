@@ -1,6 +1,12 @@
-import requests
 import time # Thêm thư viện time để chờ
 import json
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.transport import get_session
+
+session = get_session()
 
 # --- Cấu hình ---
 API_KEY = ""  # Thay bằng API key MỚI của bạn
@@ -23,7 +29,7 @@ try:
     }
     
     # Bước 1: Gửi yêu cầu và nhận link async
-    response = requests.post(TTS_URL, data=payload.encode('utf-8'), headers=headers)
+    response = session.post(TTS_URL, data=payload.encode('utf-8'), headers=headers)
 
     if response.status_code == 200:
         # Lấy dữ liệu JSON từ phản hồi
@@ -38,7 +44,7 @@ try:
 
             # Bước 2: Tải file âm thanh từ link async
             print("Đang tải file âm thanh...")
-            audio_response = requests.get(async_url)
+            audio_response = session.get(async_url)
 
             if audio_response.status_code == 200:
                 with open(OUTPUT_FILE, 'wb') as f:
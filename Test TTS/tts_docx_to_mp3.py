@@ -1,21 +1,33 @@
-import requests
 import time
 import docx
 import re
 import os
-from pydub import AudioSegment
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.audio_stream import StreamingEncoder
+from common.providers import base_url
+from common.rate_limiter import RateLimiter
+from common.segmenter import split_text
+from common.tracing import current_span, span
+from common.transport import get_session
+
+session = get_session()
+fpt_limiter = RateLimiter.from_env("fpt")
 
 # --- Cấu hình ---
 API_KEY = "" # ⚠️ Thay bằng API key MỚI của bạn
-TTS_URL = 'https://api.fpt.ai/hmi/tts/v5'
+TTS_URL = f"{base_url('fpt')}/hmi/tts/v5"
 DOCX_INPUT_FILE = "bai_giang_dai.docx"
 MP3_OUTPUT_FILE = "bai_giang_hoan_chinh.mp3"
 TEMP_FOLDER = "temp_audio"
 VOICE = 'lannhi'
 SPEED = '0'
 MAX_CHARS_PER_CHUNK = 4000
+POLL_INTERVAL = 3  # Giây giữa hai lần hỏi link async
+MAX_RENDER_WAIT = 180  # Giây tối đa chờ FPT.AI tạo file
 
-# (Các hàm read_text_from_docx, clean_text, chunk_text giữ nguyên như cũ)
+# (Các hàm read_text_from_docx, clean_text giữ nguyên như cũ; chia đoạn dùng common/segmenter.py)
 def read_text_from_docx(file_path):
     try:
         doc = docx.Document(file_path)
@@ -28,26 +40,26 @@ def clean_text(text):
     text = re.sub(r'\s+', ' ', text).strip()
     return text
 
-def chunk_text(text, max_length):
-    chunks = []
-    sentences = re.findall(r'.*?[.?!]', text)
-    current_chunk = ""
-    for sentence in sentences:
-        if len(current_chunk) + len(sentence) <= max_length:
-            current_chunk += sentence + " "
-        else:
-            chunks.append(current_chunk.strip())
-            current_chunk = sentence + " "
-    if current_chunk:
-        chunks.append(current_chunk.strip())
-    return chunks
+def wait_for_async_file(async_url):
+    """Hỏi link async tới khi FPT.AI tạo xong file (404 = chưa xong) thay vì chờ cố định 30 giây."""
+    deadline = time.monotonic() + MAX_RENDER_WAIT
+    while True:
+        response = session.get(async_url)
+        current_span().add("polls")
+        if response.status_code != 404 or time.monotonic() >= deadline:
+            return response
+        time.sleep(POLL_INTERVAL)
 
 # --- HÀM TTS ĐÃ NÂNG CẤP LOGGING ---
 def text_to_speech_for_chunk(chunk_text, chunk_index):
     print(f"  Gửi yêu cầu cho mẩu {chunk_index}...")
     try:
         headers = {'api-key': API_KEY, 'speed': SPEED, 'voice': VOICE}
-        response = requests.post(TTS_URL, data=chunk_text.encode('utf-8'), headers=headers)
+        with span("tts_submit", provider="fpt") as submit_span:
+            fpt_limiter.acquire(API_KEY)
+            response = session.post(TTS_URL, data=chunk_text.encode('utf-8'), headers=headers)
+            fpt_limiter.record(API_KEY, response)
+            submit_span.record_response(response)
         
         print(f"  Phản hồi từ FPT.AI (Status Code: {response.status_code}):")
         # In ra toàn bộ nội dung JSON để chẩn đoán
@@ -58,8 +70,10 @@ def text_to_speech_for_chunk(chunk_text, chunk_index):
             if response_data.get('error') == 0 and response_data.get('async'):
                 async_url = response_data['async']
                 print(f"  >> Nhận được link async: {async_url}")
-                time.sleep(30)
-                audio_response = requests.get(async_url)
+                with span("tts_render", provider="fpt") as render_span:
+                    audio_response = wait_for_async_file(async_url)
+                    render_span.record_response(audio_response)
+                    render_span.set(bytes=len(audio_response.content))
                 if audio_response.status_code == 200:
                     temp_file_path = os.path.join(TEMP_FOLDER, f"chunk_{chunk_index}.mp3")
                     with open(temp_file_path, 'wb') as f:
@@ -74,19 +88,18 @@ def text_to_speech_for_chunk(chunk_text, chunk_index):
             print("  >> LỖI: Yêu cầu POST thất bại.")
     except Exception as e:
         print(f"  >> LỖI NGOẠI LỆ: {e}")
+    current_span().fail("Không tạo được audio cho mẩu")
     return None
 
 def merge_audio_files(chunk_files, output_file):
-    # (Hàm này giữ nguyên)
+    # Giải mã từng mẩu và đẩy thẳng vào một encoder MP3, không giữ cả bài trong bộ nhớ
     print("Bắt đầu ghép các file audio...")
-    combined = AudioSegment.empty()
-    for file_path in chunk_files:
-        try:
-            segment = AudioSegment.from_file(file_path, format="mp3")
-            combined += segment
-        except Exception as e:
-            print(f"Lỗi khi đọc file {file_path}: {e}")
-    combined.export(output_file, format="mp3")
+    with StreamingEncoder(output_file) as encoder:
+        for file_path in chunk_files:
+            try:
+                encoder.write_file(file_path)
+            except ValueError as e:
+                print(f"Lỗi khi đọc file {file_path}: {e}")
     print(f"✅ Đã ghép và lưu file hoàn chỉnh tại: {output_file}")
 
 
@@ -97,18 +110,20 @@ if __name__ == "__main__":
     raw_text = read_text_from_docx(DOCX_INPUT_FILE)
     if raw_text:
         cleaned_text = clean_text(raw_text)
-        text_chunks = chunk_text(cleaned_text, MAX_CHARS_PER_CHUNK)
+        text_chunks = split_text(cleaned_text, MAX_CHARS_PER_CHUNK, keep_paragraphs=False)
         audio_chunk_files = []
         for i, chunk in enumerate(text_chunks):
             print(f"--- Đang xử lý mẩu {i+1}/{len(text_chunks)} ---")
-            file_path = text_to_speech_for_chunk(chunk, i)
+            with span("tts_segment", chunk=i + 1, chars=len(chunk)):
+                file_path = text_to_speech_for_chunk(chunk, i)
             if file_path:
                 audio_chunk_files.append(file_path)
             else:
                 print(f"!!! Không thể tạo audio cho mẩu {i}, bỏ qua.")
         
         if audio_chunk_files:
-            merge_audio_files(audio_chunk_files, MP3_OUTPUT_FILE)
+            with span("merge", chunks=len(audio_chunk_files)):
+                merge_audio_files(audio_chunk_files, MP3_OUTPUT_FILE)
             print("Đang dọn dẹp các file tạm...")
             for file in audio_chunk_files: os.remove(file)
             os.rmdir(TEMP_FOLDER)
@@ -1,15 +1,22 @@
 import os
 import json
-import time
 import csv
-import requests
 import argparse
+import sys
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.key_pool import KeyPool
+from common.providers import base_url
+from common.tracing import current_span, span
+from common.transport import get_session
+
 # === CONFIG ===
 load_dotenv()
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-GEMINI_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-lite:generateContent?key={GEMINI_API_KEY}"  # Sửa model thành gemini-1.5-flash (model hợp lệ)
+# Nhiều key (GEMINI_API_KEYS=key1,key2) để chia tải; GEMINI_KEY_RPM giới hạn mỗi key
+gemini_keys = KeyPool.from_env("gemini", "GEMINI_API_KEY")
+session = get_session()
+GEMINI_URL = f"{base_url('gemini')}/v1beta/models/gemini-2.0-flash-lite:generateContent"  # Sửa model thành gemini-1.5-flash (model hợp lệ)
 
 def parse_args():
     """Parse command-line arguments."""
@@ -23,7 +30,7 @@ def generate_storyboard_elements_with_ai(lecture_text):
     """
     Sử dụng Gemini để tạo ra các yếu tố storyboard một cách sáng tạo.
     """
-    if not GEMINI_API_KEY:
+    if not gemini_keys:
         print("⚠️  Không tìm thấy GEMINI_API_KEY, sử dụng logic mặc định.")
         return {"action": "Giảng viên trình bày", "graphics": "Hiển thị slide", "camera_angle": "Trung cảnh"}
 
@@ -52,7 +59,8 @@ def generate_storyboard_elements_with_ai(lecture_text):
     }
     
     try:
-        res = requests.post(GEMINI_URL, headers=headers, json=body, timeout=60)
+        _, res = gemini_keys.send(lambda key: session.post(GEMINI_URL, params={"key": key}, headers=headers, json=body))
+        current_span().record_response(res)
         res.raise_for_status()
         storyboard_data = res.json()["candidates"][0]["content"]["parts"][0]["text"]
         ai_elements = json.loads(storyboard_data)
@@ -67,6 +75,7 @@ def generate_storyboard_elements_with_ai(lecture_text):
         return ai_elements
     except Exception as e:
         print(f"❌ Lỗi khi gọi Gemini cho storyboard: {e}. Sử dụng logic mặc định.")
+        current_span().fail(e)
         return {"action": "Giảng viên trình bày", "graphics": "Hiển thị slide", "camera_angle": "Trung cảnh"}
 
 
@@ -101,11 +110,11 @@ def generateStoryboard(json_path, output_json_path, output_csv_path):
         # NÂNG CẤP: Gọi AI để tạo storyboard
         if lecture:
             print("    - 🤖 Calling AI Director for creative ideas...")
-            ai_elements = generate_storyboard_elements_with_ai(lecture)
+            with span("gemini_storyboard", provider="gemini", slide=slide_num, chars=len(lecture)):
+                ai_elements = generate_storyboard_elements_with_ai(lecture)
             slide["action"] = ai_elements.get("action", "Giảng viên trình bày")
             slide["graphics"] = ai_elements.get("graphics", "Hiển thị slide")
             slide["camera_angle"] = ai_elements.get("camera_angle", "Trung cảnh")
-            time.sleep(10) # Thêm độ trễ để tránh lỗi rate limit của Gemini
         else:
             slide["action"] = "N/A"
             slide["graphics"] = "N/A"
@@ -1,106 +1,131 @@
 import os
+import sys
 import json
 import time
 import requests
 import argparse
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from dotenv import load_dotenv
-from pydub import AudioSegment
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.audio_stream import StreamingEncoder, wav_format
+from common.health import HealthMonitor, is_provider_failure, shared_state_file
+from common.key_pool import KeyPool, fingerprint
+from common.providers import base_url
+from common.segment_store import SegmentState, SegmentStore
+from common.segmenter import split_sentences, split_stable
+from common.tracing import current_span, span
+from common.transport import get_session
+from common.tts_cache import cache_from_env
 
 # === CONFIG ===
 load_dotenv()
 
-AUSYNC_API_KEY = os.getenv("AUSYNC_API_KEY")
+# Nhiều key (AUSYNC_API_KEYS=key1,key2) để chia tải; AUSYNC_KEY_RPM giới hạn mỗi key
+ausync_keys = KeyPool.from_env("ausync", "AUSYNC_API_KEY")
 VOICE_ID = int(os.getenv("VOICE_ID", "0"))
 MODEL_NAME = "myna-2"
 LANGUAGE = "vi"
-TTS_ENDPOINT = "https://api.ausynclab.org/api/v1/speech/text-to-speech"
-GET_AUDIO_ENDPOINT = "https://api.ausynclab.org/api/v1/speech/{audio_id}"
-HEADERS = {
-    "Content-Type": "application/json",
-    "X-API-Key": AUSYNC_API_KEY
-}
+SPEED = 1.0
+AUSYNC_API_URL = f"{base_url('ausync')}/api/v1"
+TTS_ENDPOINT = f"{AUSYNC_API_URL}/speech/text-to-speech"
+GET_AUDIO_ENDPOINT = AUSYNC_API_URL + "/speech/{audio_id}"
 MAX_TEXT_LENGTH = 500
-SLIDE_DELAY = 2 # FIX: Thêm độ trễ 2 giây giữa các slide
+# Số đoạn gửi AusyncLab cùng lúc, tính chung cho mọi slide (thay cho việc nghỉ cố định giữa các slide)
+MAX_CONCURRENT_SEGMENTS = int(os.getenv("AUDIO_CONCURRENCY", "8"))
+STATE_DB_NAME = "audio_state.sqlite"  # Trạng thái từng đoạn, nằm trong thư mục audio
+# packed (mặc định): gom nguyên câu tới MAX_TEXT_LENGTH với ranh giới theo nội dung câu (split_stable),
+# nên sửa một câu chỉ tạo lại đoạn chứa nó, các đoạn khác vẫn lấy từ cache; ít request hơn nhiều so với
+# sentence và giữ ngữ điệu liền giữa các câu trong đoạn (xem tools/bench_segmenter.py);
+# sentence: mỗi câu một request, cache theo câu (câu lặp lại như "Các con ơi" thành clip riêng)
+SEGMENT_MODE = os.getenv("AUDIO_SEGMENT_MODE", "packed")
+
+# Session dùng chung (giữ kết nối, timeout và retry thống nhất, xem common/transport.py)
+session = get_session()
+
+# Cache audio theo nội dung đoạn văn bản, dùng chung với tts-web-app
+synthesis_cache = cache_from_env()
+
+class SegmentAudioError(Exception):
+    """File audio của một đoạn bị thiếu hoặc không giải mã được; index là thứ tự đoạn (từ 0)."""
 
-# Tạo session với cơ chế retry tự động, kiên nhẫn hơn
-session = requests.Session()
-retries = Retry(
-    total=5,          # Tổng số lần thử lại
-    backoff_factor=1, # Thời gian chờ giữa các lần thử sẽ là {1s, 2s, 4s, 8s, 16s}
-    status_forcelist=[429, 500, 502, 503, 504] # Các mã lỗi sẽ được retry
-)
-session.mount('https://', HTTPAdapter(max_retries=retries))
+    def __init__(self, index, message):
+        super().__init__(message)
+        self.index = index
 
 def parse_args():
     """Parse command-line arguments."""
     parser = argparse.ArgumentParser(description="Generate audios from JSON")
     parser.add_argument("--json", default="slides_with_text.json", help="Path to input JSON")
     parser.add_argument("--output-dir", default="audios", help="Output directory for audios")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENT_SEGMENTS,
+                        help="Số đoạn gửi đồng thời cho mọi slide (1 = lần lượt từng đoạn)")
     return parser.parse_args()
 
+def ausync_headers(api_key):
+    return {"Content-Type": "application/json", "X-API-Key": api_key}
+
+def probe_ausync():
+    """Gọi thử API AusyncLab (chỉ chạy khi kết quả kiểm tra đã cache hết hạn)."""
+    test_url = f"{AUSYNC_API_URL}/voices/list"
+    api_key = ausync_keys.acquire()
+    response = session.get(test_url, headers=ausync_headers(api_key), timeout=15)
+    ausync_keys.record(api_key, response)
+    response.raise_for_status()
+    return True
+
+# Dùng chung file trạng thái với các lần chạy khác trên cùng máy
+ausync_health = HealthMonitor("ausync", probe_ausync, ttl=300, state_file=shared_state_file("ausync"))
+
 def check_server_status():
     """Kiểm tra trạng thái server AusyncLab."""
-    try:
-        test_url = "https://api.ausynclab.org/api/v1/voices/list"
-        response = session.get(test_url, headers=HEADERS, timeout=15)
-        response.raise_for_status()
+    if ausync_health.is_available():
         print("✅ Server AusyncLab: OK")
         return True
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Server AusyncLab không khả dụng: {e}")
-        return False
-
-def split_text(text, max_length=MAX_TEXT_LENGTH):
-    """Chia văn bản thành các đoạn nhỏ hơn max_length một cách thông minh."""
-    if not text or not text.strip(): return []
-    text = text.strip()
-    if len(text) <= max_length: return [text]
-    
-    parts = []
-    while len(text) > max_length:
-        cut_pos = -1
-        for delimiter in ['. ', '? ', '! ', ', ', ' ']:
-            pos = text.rfind(delimiter, 0, max_length)
-            if pos != -1:
-                cut_pos = pos + len(delimiter)
-                break
-        if cut_pos == -1: cut_pos = max_length
-        parts.append(text[:cut_pos].strip())
-        text = text[cut_pos:].strip()
-    
-    if text: parts.append(text)
-    return [p for p in parts if p]
+    print("❌ Server AusyncLab không khả dụng, thử lại sau.")
+    return False
 
 def request_tts(text, audio_name):
     """Gửi yêu cầu tạo audio (đã có retry tự động từ session)."""
+    if not ausync_health.is_available():
+        print("❌ Server AusyncLab đang lỗi liên tục, bỏ qua yêu cầu.")
+        return None
     payload = {
         "audio_name": audio_name, "text": text, "voice_id": VOICE_ID,
-        "speed": 1.0, "model_name": MODEL_NAME, "language": LANGUAGE
+        "speed": SPEED, "model_name": MODEL_NAME, "language": LANGUAGE
     }
     try:
-        res = session.post(TTS_ENDPOINT, json=payload, headers=HEADERS, timeout=90)
+        api_key, res = ausync_keys.send(lambda key: session.post(TTS_ENDPOINT, json=payload, headers=ausync_headers(key)))
+        current_span().record_response(res)
         res.raise_for_status()
+        ausync_health.record_success()
         data = res.json()
         audio_id = data.get("result", {}).get("audio_id")
         if not audio_id:
             print(f"❌ Lỗi: API không trả về audio_id. Phản hồi: {data}")
+            current_span().fail("API không trả về audio_id")
             return None
+        ausync_keys.remember(audio_id, api_key)  # Hỏi trạng thái bằng đúng key đã tạo audio
         return audio_id
     except requests.exceptions.RequestException as e:
+        if is_provider_failure(e):
+            ausync_health.record_failure()
         print(f"❌ Lỗi khi yêu cầu TTS (sau khi đã thử lại): {e}")
+        current_span().fail(e)
         return None
 
 def wait_for_audio_url(audio_id, max_tries=30, delay=5):
     """Chờ và lấy URL audio."""
     if not audio_id: return None
     print("    - Bắt đầu chờ audio sẵn sàng...")
+    headers = ausync_headers(ausync_keys.key_for(audio_id, forget=True))
     for attempt in range(max_tries):
         try:
             url = GET_AUDIO_ENDPOINT.format(audio_id=audio_id)
-            res = session.get(url, headers=HEADERS, timeout=30)
+            res = session.get(url, headers=headers)
+            current_span().add("polls")
             if res.status_code == 200:
                 data = res.json()
                 if data and data.get("result", {}).get("audio_url"):
@@ -109,68 +134,206 @@ def wait_for_audio_url(audio_id, max_tries=30, delay=5):
             # Nếu gặp lỗi client (không phải lỗi server), dừng lại
             elif 400 <= res.status_code < 500:
                  print(f"    - ❌ Gặp lỗi không thể thử lại ({res.status_code}): {res.text}. Dừng chờ.")
+                 current_span().fail(f"HTTP {res.status_code}")
                  return None
             
             print(f"    - Chờ lần {attempt + 1}/{max_tries}...")
             time.sleep(delay)
         except requests.exceptions.RequestException as e:
             print(f"    - ❌ Lỗi kết nối khi chờ: {e}. Dừng chờ.")
+            current_span().fail(e)
             return None
     print("    - ⏰ Hết thời gian chờ.")
+    current_span().fail("Hết thời gian chờ")
     return None
 
 def save_audio(audio_url, save_path):
     """Tải và lưu file audio."""
     if not audio_url: return False
     try:
-        response = session.get(audio_url, timeout=60, stream=True)
+        response = session.get(audio_url, stream=True)
+        current_span().record_response(response)
         response.raise_for_status()
         content_type = response.headers.get('Content-Type', '')
         if 'audio' not in content_type and 'application/octet-stream' not in content_type:
             print(f"    - ❌ Lỗi: URL không trả về file audio. Content-Type: {content_type}")
+            current_span().fail(f"Content-Type: {content_type}")
             return False
         os.makedirs(os.path.dirname(save_path), exist_ok=True)
         with open(save_path, "wb") as f:
             for chunk in response.iter_content(chunk_size=8192):
                 f.write(chunk)
+        current_span().set(bytes=os.path.getsize(save_path))
         if os.path.getsize(save_path) > 100:
             return True
         else:
             print("    - ❌ Lỗi: File audio tải về bị rỗng.")
+            current_span().fail("File audio rỗng")
             try: os.remove(save_path)
             except OSError: pass
             return False
     except requests.exceptions.RequestException as e:
         print(f"    - ❌ Lỗi khi tải file audio: {e}")
+        current_span().fail(e)
         return False
 
+def audio_hash(text):
+    """Mã băm (lời giảng, giọng, model, tốc độ, ngôn ngữ): đổi bất kỳ thứ nào thì phải tạo lại audio."""
+    return synthesis_cache.make_key(text, VOICE_ID, MODEL_NAME, SPEED, LANGUAGE)[:16]
+
+def synthesize_segment(text, audio_name, save_path, state=None):
+    """
+    Lấy audio của một đoạn từ cache, hoặc gọi API rồi lưu vào cache.
+    `state` (common/segment_store.py) ghi lại từng bước để lần chạy sau tiếp tục đúng chỗ:
+    đã có audio_id thì chỉ hỏi lại trạng thái, đã có URL thì chỉ tải lại.
+    """
+    cache_key = synthesis_cache.make_key(text, VOICE_ID, MODEL_NAME, SPEED, LANGUAGE)
+    state = state or SegmentState(None, audio_name, 0, cache_key[:16])
+    os.makedirs(os.path.dirname(save_path) or ".", exist_ok=True)
+    if state.status == "done" and state.path == save_path and os.path.exists(save_path):
+        print("    - ♻️ Đoạn đã tải xong ở lần chạy trước.")
+        current_span().set(cache="resume")
+        return True
+    if synthesis_cache.copy_to(cache_key, save_path):
+        print("    - ⚡ Lấy audio từ cache.")
+        current_span().set(cache="hit")
+        state.update(status="done", path=save_path, error=None)
+        return True
+    current_span().set(cache="miss")
+
+    resumed = bool(state.audio_id)
+    if resumed:
+        print(f"    - ♻️ Hỏi lại audio_id {state.audio_id} của lần chạy trước thay vì gửi lại.")
+        current_span().set(resumed=True)
+        api_key = ausync_keys.find(state.key_ref)
+        if api_key:
+            ausync_keys.remember(state.audio_id, api_key)
+    else:
+        with span("tts_submit", provider="ausync"):
+            audio_id = request_tts(text, audio_name)
+        if not audio_id:
+            state.update(status="failed", error="Gửi yêu cầu TTS thất bại")
+            return False
+        state.update(status="submitted", audio_id=audio_id, key_ref=fingerprint(ausync_keys.key_for(audio_id)),
+                     audio_url=None, path=None, error=None)
+
+    audio_url = state.audio_url if state.status == "rendered" else None
+    if not audio_url:
+        with span("tts_render", provider="ausync"):
+            audio_url = wait_for_audio_url(state.audio_id)
+        if not audio_url:
+            if resumed:
+                # audio_id cũ hỏi lại vẫn không ra: lần sau gửi TTS mới
+                state.update(status="failed", audio_id=None, key_ref=None, error="audio_id cũ không còn dùng được")
+            else:
+                state.update(error="Chưa lấy được URL audio")
+            return False
+        state.update(status="rendered", audio_url=audio_url)
+    with span("audio_download", provider="ausync"):
+        if not save_audio(audio_url, save_path):
+            # URL có thể đã hết hạn: lần sau hỏi lại audio_id để lấy URL mới
+            state.update(status="submitted", audio_url=None, error="Tải file audio thất bại")
+            return False
+    state.update(status="done", path=save_path, error=None)
+    synthesis_cache.put(cache_key, save_path)
+    return True
+
 def merge_audio_files(audio_paths, output_path):
-    """Gộp các file audio, bỏ qua các file lỗi."""
+    """
+    Gộp các file audio theo luồng vào một bộ mã hóa MP3 (bộ nhớ không tăng theo độ dài slide).
+    Trả về thời lượng (giây) của file đã gộp, hoặc False khi gộp lỗi.
+    Đoạn nào thiếu file hoặc không giải mã được thì ném SegmentAudioError và không tạo file gộp:
+    slide thiếu một đoạn mà vẫn được ghi nhận là xong thì sẽ không bao giờ được tạo lại.
+    """
     if not audio_paths: return False
-    valid_segments = []
-    for path in audio_paths:
-        if not os.path.exists(path): continue
-        try:
-            segment = AudioSegment.from_file(path)
-            valid_segments.append(segment)
-        except Exception as e:
-            print(f"    - ❌ Lỗi khi đọc file tạm '{path}': {e}. Bỏ qua file này.")
-            continue
-    if not valid_segments:
-        print("❌ Không có đoạn audio hợp lệ nào để gộp.")
-        return False
+    for idx, path in enumerate(audio_paths):
+        if not os.path.exists(path):
+            raise SegmentAudioError(idx, f"Không tìm thấy file tạm '{path}'")
+    frame_rate, channels = wav_format(audio_paths[0])
     try:
-        combined = AudioSegment.empty()
-        for segment in valid_segments:
-            combined += segment
-        combined.export(output_path, format="mp3", bitrate="128k")
-        return True
+        with StreamingEncoder(output_path, frame_rate, channels, bitrate="128k") as encoder:
+            for idx, path in enumerate(audio_paths):
+                try:
+                    seconds = encoder.write_file(path)
+                except ValueError as e:
+                    raise SegmentAudioError(idx, f"Lỗi khi đọc file tạm '{path}': {e}")
+                if not seconds:
+                    raise SegmentAudioError(idx, f"File tạm '{path}' không có audio")
+        return encoder.duration
+    except SegmentAudioError:
+        raise
     except Exception as e:
         print(f"❌ Lỗi trong quá trình gộp audio cuối cùng: {e}")
         return False
 
-def generate_audios_from_json(json_path, output_dir):
-    """Quy trình chính: Tạo audio từ file JSON."""
+def synthesize_slide_segment(slide_num, idx, segment_text, output_dir, state=None):
+    """Tạo audio một đoạn của slide (chạy trong luồng của pool), trả về đường dẫn hoặc None."""
+    segment_audio_name = f"slide_{slide_num}_part_{idx+1}"
+    segment_save_path = os.path.join(output_dir, f"{segment_audio_name}.wav")
+    print(f"  - Slide {slide_num}: bắt đầu đoạn {idx + 1}...")
+    with span("tts_segment", slide=slide_num, chunk=idx + 1, chars=len(segment_text)) as segment_span:
+        if synthesize_segment(segment_text, segment_audio_name, segment_save_path, state):
+            return segment_save_path
+        segment_span.fail("Không tạo được audio cho đoạn")
+    print(f"  - ❌ Slide {slide_num}: đoạn {idx + 1} thất bại.")
+    return None
+
+def discard_segment(state, cache_key, path, error):
+    """Bỏ audio hỏng của một đoạn (file tạm, mục cache, trạng thái) để lần chạy sau tạo lại từ đầu."""
+    try: os.remove(path)
+    except OSError: pass
+    synthesis_cache.remove(cache_key)
+    state.update(status="failed", audio_id=None, key_ref=None, audio_url=None, path=None, error=error)
+
+def finish_slide(slide, slide_num, segment_audio_paths, output_dir, store, content_hash, states, cache_keys):
+    """
+    Gộp các đoạn của một slide (theo đúng thứ tự) ngay khi đoạn cuối cùng của slide xong.
+    Thiếu đoạn nào thì không gộp (tránh audio bị hụt), giữ file tạm để lần chạy sau làm tiếp.
+    Đoạn có file hỏng bị đánh dấu thất bại và xóa khỏi cache, lần chạy sau gửi TTS lại.
+    """
+    missing = [idx + 1 for idx, path in enumerate(segment_audio_paths) if not path]
+    if missing:
+        print(f"❌ Slide {slide_num}: thiếu đoạn {missing}/{len(segment_audio_paths)}, chưa gộp. "
+              f"Chạy lại để tiếp tục các đoạn còn thiếu.")
+        slide["audio_path"] = ""
+        return
+    final_save_path = os.path.join(output_dir, f"slide_{slide_num}.mp3")
+    with span("merge", slide=slide_num, chunks=len(segment_audio_paths)) as merge_span:
+        try:
+            merged = merge_audio_files(segment_audio_paths, final_save_path)
+        except SegmentAudioError as e:
+            print(f"❌ Slide {slide_num}: đoạn {e.index + 1} hỏng ({e}), chưa gộp. "
+                  f"Chạy lại để tạo lại đoạn này.")
+            discard_segment(states[e.index], cache_keys[e.index], segment_audio_paths[e.index], str(e))
+            merged = False
+        if not merged:
+            merge_span.fail("Gộp audio thất bại")
+    if not merged:
+        print(f"❌ Gộp audio thất bại cho slide {slide_num}.")
+        slide["audio_path"] = ""
+        return
+    print(f"✅ Đã gộp thành công: {final_save_path}")
+    slide["audio_path"] = final_save_path
+    slide["audio_hash"] = content_hash
+    # ✅ THỜI GIAN AUDIO: encoder đã đếm số frame khi ghép, không cần giải mã lại file MP3
+    slide["duration"] = round(merged, 2)
+    print(f"    - ⏱ Thời lượng: {slide['duration']} giây")
+    store.finish_slide(slide_num, content_hash, final_save_path, slide["duration"])
+
+    for p in segment_audio_paths:
+        try: os.remove(p)
+        except OSError: pass
+
+def generate_audios_from_json(json_path, output_dir, concurrency=MAX_CONCURRENT_SEGMENTS):
+    """
+    Quy trình chính: Tạo audio từ file JSON.
+    Mọi đoạn của mọi slide được gửi song song (tối đa `concurrency` đoạn cùng lúc);
+    slide nào đủ đoạn thì gộp ngay, không chờ các slide khác.
+    Slide chỉ được bỏ qua khi audio còn trên đĩa và audio_hash trong JSON khớp nội dung hiện tại,
+    nên sửa lời giảng (hoặc đổi giọng/model/tốc độ) chỉ tạo lại đúng các slide bị đổi.
+    Trạng thái từng đoạn nằm trong <output_dir>/audio_state.sqlite: chạy lại sau khi bị ngắt
+    sẽ bỏ qua đoạn/slide đã xong và hỏi lại các audio_id đang render thay vì gửi TTS lại.
+    """
     if not check_server_status(): return
     try:
         with open(json_path, "r", encoding="utf-8") as f:
@@ -180,79 +343,88 @@ def generate_audios_from_json(json_path, output_dir):
         return
 
     total_slides = len(slides)
-    for i, slide in enumerate(slides):
-        slide_num = slide.get("slide_number", i + 1)
-        title = slide.get("title", "Không có tiêu đề")
-        lecture_text = slide.get("generated_lecture", "").strip()
-        
-        print(f"\n--- Đang xử lý Slide {slide_num}/{total_slides}: {title} ---")
-        if not lecture_text:
-            print("⚠️  Slide không có nội dung, bỏ qua.")
-            slide["audio_path"] = ""
-        elif slide.get("audio_path") and os.path.exists(slide.get("audio_path")):
-            print("✅ Audio đã tồn tại, bỏ qua.")
-        else:
-            text_segments = split_text(lecture_text)
+    store = SegmentStore(os.path.join(output_dir, STATE_DB_NAME))
+    pending = {}  # vị trí slide -> {"segments": [đường dẫn hoặc None], "remaining": số đoạn chưa xong, "hash"}
+    with span("audio", slides=total_slides), ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {}
+        for i, slide in enumerate(slides):
+            slide_num = slide.get("slide_number", i + 1)
+            title = slide.get("title", "Không có tiêu đề")
+            lecture_text = slide.get("generated_lecture", "").strip()
+
+            print(f"\n--- Slide {slide_num}/{total_slides}: {title} ---")
+            if not lecture_text:
+                print("⚠️  Slide không có nội dung, bỏ qua.")
+                slide["audio_path"] = ""
+                continue
+            content_hash = audio_hash(lecture_text)
+            if slide.get("audio_path") and os.path.exists(slide.get("audio_path")):
+                if slide.get("audio_hash") == content_hash:
+                    print("✅ Audio đã tồn tại và nội dung không đổi, bỏ qua.")
+                    continue
+                if "audio_hash" not in slide:
+                    # JSON từ phiên bản cũ: coi audio hiện có là đúng thay vì tạo lại (tốn phí) mọi slide
+                    print("✅ Audio đã tồn tại (chưa có audio_hash, ghi nhận nội dung hiện tại), bỏ qua.")
+                    slide["audio_hash"] = content_hash
+                    continue
+                print("🔄 Lời giảng hoặc cấu hình giọng đã đổi, tạo lại audio.")
+            finished = store.finished_slide(slide_num, content_hash)
+            if finished:
+                print("✅ Slide đã gộp xong ở lần chạy trước, bỏ qua.")
+                slide["audio_path"], slide["duration"] = finished
+                slide["audio_hash"] = content_hash
+                continue
+            with span("split", slide=slide_num, chars=len(lecture_text)):
+                if SEGMENT_MODE == "sentence":
+                    text_segments = split_sentences(lecture_text, MAX_TEXT_LENGTH)
+                else:
+                    text_segments = split_stable(lecture_text, MAX_TEXT_LENGTH)
             if not text_segments:
                 print("⚠️  Không thể chia nhỏ văn bản, bỏ qua.")
                 continue
-            print(f"  - Văn bản được chia thành {len(text_segments)} đoạn.")
-            segment_audio_paths = []
+            print(f"  - Văn bản được chia thành {len(text_segments)} đoạn, đưa vào hàng đợi.")
+            cache_keys = [synthesis_cache.make_key(text, VOICE_ID, MODEL_NAME, SPEED, LANGUAGE)
+                          for text in text_segments]
+            states = [store.segment(slide_num, idx, key[:16]) for idx, key in enumerate(cache_keys)]
+            pending[i] = {"segments": [None] * len(text_segments), "remaining": len(text_segments),
+                          "hash": content_hash, "states": states, "keys": cache_keys}
             for idx, segment_text in enumerate(text_segments):
-                print(f"  - Đang xử lý đoạn {idx + 1}/{len(text_segments)}...")
-                segment_audio_name = f"slide_{slide_num}_part_{idx+1}"
-                segment_save_path = os.path.join(output_dir, f"{segment_audio_name}.wav")
-                audio_id = request_tts(segment_text, segment_audio_name)
-                if not audio_id: continue
-                audio_url = wait_for_audio_url(audio_id)
-                if not audio_url: continue
-                if save_audio(audio_url, segment_save_path):
-                    segment_audio_paths.append(segment_save_path)
-            
-            if segment_audio_paths:
-                final_save_path = os.path.join(output_dir, f"slide_{slide_num}.mp3")
-                if merge_audio_files(segment_audio_paths, final_save_path):
-                    print(f"✅ Đã gộp thành công: {final_save_path}")
-                    slide["audio_path"] = final_save_path
-                        # ✅ TÍNH THỜI GIAN AUDIO
-                    try:
-                        audio = AudioSegment.from_file(final_save_path)
-                        duration_sec = round(len(audio) / 1000, 2)
-                        slide["duration"] = duration_sec
-                        print(f"    - ⏱ Thời lượng: {duration_sec} giây")
-                    except Exception as e:
-                        print(f"    - ⚠️ Không tính được duration: {e}")
-                        slide["duration"] = 0
+                # Chạy trong context hiện tại để span của đoạn nằm dưới span "audio"
+                future = executor.submit(contextvars.copy_context().run, synthesize_slide_segment,
+                                         slide_num, idx, segment_text, output_dir, states[idx])
+                futures[future] = (i, idx)
 
-                    for p in segment_audio_paths:
-                        try: os.remove(p)
-                        except OSError: pass
-                else:
-                    print(f"❌ Gộp audio thất bại cho slide {slide_num}.")
-                    slide["audio_path"] = ""
-            else:
-                print(f"❌ Không tạo được audio nào cho slide {slide_num}.")
-                slide["audio_path"] = ""
-        
-        with open("slides_with_text_temp.json", "w", encoding="utf-8") as f:
-            json.dump(slides, f, ensure_ascii=False, indent=2)
-        
-        # FIX: Thêm độ trễ giữa các slide để tránh bị giới hạn
-        print(f"--- Tạm nghỉ {SLIDE_DELAY} giây ---")
-        time.sleep(SLIDE_DELAY)
+        for future in as_completed(futures):
+            i, idx = futures[future]
+            try:
+                pending[i]["segments"][idx] = future.result()
+            except Exception as e:
+                print(f"  - ❌ Lỗi không mong đợi ở đoạn {idx + 1}: {e}")
+            pending[i]["remaining"] -= 1
+            if pending[i]["remaining"]:
+                continue
+            slide = slides[i]
+            slide_num = slide.get("slide_number", i + 1)
+            done = pending.pop(i)
+            finish_slide(slide, slide_num, done["segments"], output_dir, store, done["hash"],
+                         done["states"], done["keys"])
 
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(slides, f, ensure_ascii=False, indent=2)
+    # slides_with_text_temp.json là đầu vào mặc định của generateStoryBoard.py, ghi một lần khi xong
+    for path in (json_path, "slides_with_text_temp.json"):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(slides, f, ensure_ascii=False, indent=2)
+    stats = synthesis_cache.stats()
+    print(f"📦 Cache: {stats['hits']} hit / {stats['misses']} miss")
+    unfinished = store.counts()
+    if unfinished:
+        print(f"💾 Đoạn chưa gộp (sẽ tiếp tục ở lần chạy sau): {unfinished}")
+    store.close()
     print(f"\n🎉 Hoàn tất! Dữ liệu đã được cập nhật vào: {json_path}")
 
 if __name__ == "__main__":
-    if not os.getenv("AUSYNC_API_KEY"):
-        print("Lỗi: Biến môi trường AUSYNC_API_KEY chưa được thiết lập trong file .env")
+    if not ausync_keys:
+        print("Lỗi: Biến môi trường AUSYNC_API_KEY (hoặc AUSYNC_API_KEYS) chưa được thiết lập trong file .env")
     else:
         args = parse_args()
-        # Cho phép tiếp tục từ file tạm
-        temp_json_path = "slides_with_text_temp.json"
-        if os.path.exists(temp_json_path):
-            print(f"💡 Tìm thấy file tạm '{temp_json_path}', sẽ tiếp tục từ đây.")
-            args.json = temp_json_path
-        generate_audios_from_json(args.json, args.output_dir)
\ No newline at end of file
+        # Chạy lại cùng lệnh sau khi bị ngắt: trạng thái trong audio_state.sqlite giúp tiếp tục đúng chỗ
+        generate_audios_from_json(args.json, args.output_dir, args.concurrency)
\ No newline at end of file
@@ -1,28 +1,38 @@
-import requests
 import os
 import json
 import time
 from dotenv import load_dotenv
 import base64
+import sys
 import cloudinary
 import cloudinary.uploader
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.key_pool import KeyPool
+from common.providers import base_url
+from common.tracing import current_span, span
+from common.transport import READ_TIMEOUT, get_session
+
 # Tải các biến môi trường từ file .env
 load_dotenv()
 
 # --- Cấu hình ---
-D_ID_API_KEY = os.getenv("D_ID_API_KEY")
-D_ID_TALK_URL = "https://api.d-id.com/talks"
+# Nhiều key (D_ID_API_KEYS=key1,key2) để chia tải; D_ID_KEY_RPM giới hạn mỗi key
+did_keys = KeyPool.from_env("d_id", "D_ID_API_KEY")
+D_ID_TALK_URL = f"{base_url('d_id')}/talks"
 STORYBOARD_FILE = "storyboard.json"
 OUTPUT_FILE = "did_videos.json"
 # 🆕 Thư mục để lưu video tải về
 VIDEO_OUTPUT_DIR = "videos"
 
+session = get_session()
+
 # Cấu hình Cloudinary
 cloudinary.config(
   cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME"),
   api_key = os.getenv("CLOUDINARY_API_KEY"),
   api_secret = os.getenv("CLOUDINARY_API_SECRET"),
+  upload_prefix = base_url("cloudinary"),
   secure = True
 )
 
@@ -35,16 +45,19 @@ def upload_media_to_cloudinary(local_path, resource_type):
         return None
     try:
         print(f"☁️  Đang tải file {resource_type} lên Cloudinary: {local_path}...")
-        response = cloudinary.uploader.upload(local_path, resource_type=resource_type)
+        current_span().set(bytes=os.path.getsize(local_path))
+        response = cloudinary.uploader.upload(local_path, resource_type=resource_type, timeout=READ_TIMEOUT)
         public_url = response.get('secure_url')
         if public_url:
             print(f"✅ Upload thành công ({resource_type}): {public_url}")
             return public_url
         else:
             print(f"❌ Lỗi: Không nhận được URL từ Cloudinary cho {resource_type}.")
+            current_span().fail("Không nhận được URL")
             return None
     except Exception as e:
         print(f"❌ Lỗi khi tải file {resource_type} lên Cloudinary: {e}")
+        current_span().fail(e)
         return None
 
 # ✅ HÀM MỚI: Tự động tải video về máy
@@ -54,7 +67,8 @@ def download_video_from_url(video_url, save_path):
     """
     try:
         print(f"⬇️  Đang tải video từ: {video_url}...")
-        res = requests.get(video_url, stream=True)
+        res = session.get(video_url, stream=True)
+        current_span().record_response(res)
         res.raise_for_status()
         
         # Tạo thư mục nếu nó chưa tồn tại
@@ -63,35 +77,41 @@ def download_video_from_url(video_url, save_path):
         with open(save_path, 'wb') as f:
             for chunk in res.iter_content(chunk_size=8192):
                 f.write(chunk)
+        current_span().set(bytes=os.path.getsize(save_path))
         print(f"✅ Video đã được lưu tại: {save_path}")
         return save_path
     except Exception as e:
         print(f"❌ Lỗi khi tải video: {e}")
+        current_span().fail(e)
         return None
 
+def did_authorization(api_key):
+    api_key_with_colon = api_key + ":"
+    encoded_key = base64.b64encode(api_key_with_colon.encode('utf-8')).decode('utf-8')
+    return f"Basic {encoded_key}"
+
 def generate_did_video(photo_url, audio_url):
     """
     Gửi yêu cầu tạo video đến D-ID API.
     """
-    api_key_with_colon = D_ID_API_KEY + ":"
-    encoded_key = base64.b64encode(api_key_with_colon.encode('utf-8')).decode('utf-8')
-    headers = {
-        "accept": "application/json", "content-type": "application/json",
-        "authorization": f"Basic {encoded_key}"
-    }
+    headers = {"accept": "application/json", "content-type": "application/json"}
     payload = {
         "source_url": photo_url,
         "script": { "type": "audio", "audio_url": audio_url },
         "config": { "fluent": "false", "result_format": "mp4" }
     }
     try:
-        res = requests.post(D_ID_TALK_URL, json=payload, headers=headers)
+        api_key, res = did_keys.send(lambda key: session.post(
+            D_ID_TALK_URL, json=payload, headers=dict(headers, authorization=did_authorization(key))))
+        current_span().record_response(res)
         res.raise_for_status()
         talk_id = res.json().get("id")
+        did_keys.remember(talk_id, api_key)  # Hỏi trạng thái bằng đúng key đã tạo talk
         print(f"✅ Talk đã được gửi! ID: {talk_id}")
         return talk_id
     except Exception as e:
         print(f"❌ Lỗi khi gọi API tạo talk: {e}")
+        current_span().fail(e)
         if hasattr(e, "response") and e.response is not None:
             print(f"📄 Chi tiết lỗi từ server: {e.response.text}")
         return None
@@ -100,13 +120,12 @@ def get_talk_status(talk_id):
     """
     Kiểm tra trạng thái và lấy URL video.
     """
-    api_key_with_colon = D_ID_API_KEY + ":"
-    encoded_key = base64.b64encode(api_key_with_colon.encode('utf-8')).decode('utf-8')
-    headers = { "accept": "application/json", "authorization": f"Basic {encoded_key}" }
+    headers = { "accept": "application/json", "authorization": did_authorization(did_keys.key_for(talk_id)) }
     url = f"{D_ID_TALK_URL}/{talk_id}"
     for attempt in range(30):
         try:
-            res = requests.get(url, headers=headers)
+            res = session.get(url, headers=headers)
+            current_span().add("polls")
             res.raise_for_status()
             data = res.json()
             status = data.get("status")
@@ -116,21 +135,25 @@ def get_talk_status(talk_id):
                 return data.get("result_url")
             elif status == "error":
                 print(f"❌ D-ID trả về lỗi: {data}")
+                current_span().fail(f"D-ID trả về lỗi: {data}")
                 return None
             else:
                 print(f"⏳ Trạng thái: {status}. Chờ thêm 10s... (Lần {attempt + 1}/30)")
         except Exception as e:
             print(f"⚠️ Lỗi khi kiểm tra status: {e}")
+            current_span().fail(e)
             return None
         time.sleep(10)
     print("❌ Quá thời gian chờ video.")
+    current_span().fail("Quá thời gian chờ video")
     return None
 
 def process_storyboard(local_photo_path, limit=5):
     """
     Quy trình chính: Tải ảnh, sau đó xử lý từng slide và tải video kết quả.
     """
-    public_photo_url = upload_media_to_cloudinary(local_photo_path, resource_type="image")
+    with span("cloudinary_upload", provider="cloudinary", kind="image"):
+        public_photo_url = upload_media_to_cloudinary(local_photo_path, resource_type="image")
     if not public_photo_url:
         print("❌ Dừng chương trình vì không thể tải ảnh đại diện lên.")
         return
@@ -144,33 +167,38 @@ def process_storyboard(local_photo_path, limit=5):
     video_results = []
     for slide in slides[:limit]:
         slide_num = slide.get('slide_number', 'N/A')
-        print(f"\n{'='*10} 🎬 Slide {slide_num} {'='*10}")
-        local_audio_path = slide.get("audio_path")
-        if not local_audio_path or not os.path.exists(local_audio_path):
-            print(f"⚠️ Bỏ qua slide vì không tìm thấy file audio: '{local_audio_path}'")
-            continue
+        with span("slide_avatar", slide=slide_num):
+            print(f"\n{'='*10} 🎬 Slide {slide_num} {'='*10}")
+            local_audio_path = slide.get("audio_path")
+            if not local_audio_path or not os.path.exists(local_audio_path):
+                print(f"⚠️ Bỏ qua slide vì không tìm thấy file audio: '{local_audio_path}'")
+                continue
 
-        public_audio_url = upload_media_to_cloudinary(local_audio_path, resource_type="video")
-        if not public_audio_url: continue
+            with span("cloudinary_upload", provider="cloudinary", kind="audio"):
+                public_audio_url = upload_media_to_cloudinary(local_audio_path, resource_type="video")
+            if not public_audio_url: continue
 
-        talk_id = generate_did_video(public_photo_url, public_audio_url)
-        if not talk_id: continue
-        
-        time.sleep(5)
-        video_url = get_talk_status(talk_id)
-
-        if video_url:
-            # ✅ CẬP NHẬT: Tải video về máy
-            # Video sẽ được lưu vào thư mục "videos" với tên slide_1.mp4, slide_2.mp4...
-            local_video_path = download_video_from_url(video_url, os.path.join(VIDEO_OUTPUT_DIR, f"slide_{slide_num}.mp4"))
-            
-            # Lưu cả 2 đường link vào file kết quả
-            video_results.append({
-                "slide_number": slide_num,
-                "title": slide.get("title"),
-                "video_url_online": video_url,
-                "local_video_path": local_video_path
-            })
+            with span("did_submit", provider="d_id"):
+                talk_id = generate_did_video(public_photo_url, public_audio_url)
+            if not talk_id: continue
+
+            time.sleep(5)
+            with span("did_render", provider="d_id"):
+                video_url = get_talk_status(talk_id)
+
+            if video_url:
+                # ✅ CẬP NHẬT: Tải video về máy
+                # Video sẽ được lưu vào thư mục "videos" với tên slide_1.mp4, slide_2.mp4...
+                with span("video_download", provider="d_id"):
+                    local_video_path = download_video_from_url(video_url, os.path.join(VIDEO_OUTPUT_DIR, f"slide_{slide_num}.mp4"))
+
+                # Lưu cả 2 đường link vào file kết quả
+                video_results.append({
+                    "slide_number": slide_num,
+                    "title": slide.get("title"),
+                    "video_url_online": video_url,
+                    "local_video_path": local_video_path
+                })
     
     with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
         json.dump(video_results, f, ensure_ascii=False, indent=2)
@@ -179,7 +207,7 @@ def process_storyboard(local_photo_path, limit=5):
 if __name__ == "__main__":
     local_photo_path_for_avatar = "C:/Users/Admin/Downloads/Test_BaiGiangSo/Hinh-anh-trai-dep-Viet-Nam.jpg"
     
-    if not all([D_ID_API_KEY, os.getenv("CLOUDINARY_CLOUD_NAME"), os.getenv("CLOUDINARY_API_KEY"), os.getenv("CLOUDINARY_API_SECRET")]):
+    if not all([did_keys, os.getenv("CLOUDINARY_CLOUD_NAME"), os.getenv("CLOUDINARY_API_KEY"), os.getenv("CLOUDINARY_API_SECRET")]):
         print("❌ Lỗi: Vui lòng thiết lập đầy đủ D_ID_API_KEY và các biến CLOUDINARY trong file .env")
     else:
         process_storyboard(local_photo_path_for_avatar, limit=5)
\ No newline at end of file
@@ -1,32 +1,46 @@
 import os
 import json
 import time
-import requests
 import glob
+import re
+import sys
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.key_pool import KeyPool
+from common.providers import base_url
+from common.tracing import current_span, span
+from common.transport import get_session
+
 load_dotenv()
 
 class HeyGenTalkingPhotoClient:
     """Client tạo video từ 1 ảnh sử dụng HeyGen Talking Photo API (cập nhật 2025)."""
 
     def __init__(self):
-        self.api_key = os.getenv("HEYGEN_API_KEY")
-        if not self.api_key:
+        # Nhiều key (HEYGEN_API_KEYS=key1,key2) để chia tải; HEYGEN_KEY_RPM giới hạn mỗi key.
+        # Ảnh, audio và video thuộc về tài khoản đã upload/tạo, nên một slide dùng một key từ đầu tới cuối.
+        self.keys = KeyPool.from_env("heygen", "HEYGEN_API_KEY")
+        if not self.keys:
             raise ValueError("❌ Thiếu HEYGEN_API_KEY trong file .env")
 
-        self.base_url = "https://api.heygen.com"
-        self.upload_url = "https://upload.heygen.com"  # Endpoint upload mới
-        self.headers = {
-            "X-Api-Key": self.api_key,
+        self.base_url = base_url("heygen")
+        self.upload_url = base_url("heygen_upload")  # Endpoint upload mới
+        self.session = get_session()
+
+    def _headers(self, api_key):
+        return {
+            "X-Api-Key": api_key,
             "Content-Type": "application/json"
         }
 
-    def upload_local_file(self, file_path, file_type="audio"):
+    def upload_local_file(self, file_path, file_type="audio", api_key=None):
         """
         Upload file local (audio hoặc image) lên HeyGen.
         file_type: "audio", "image", hoặc "talking_photo"
+        api_key: key của tài khoản sẽ dùng file này (mặc định lấy từ pool)
         """
+        api_key = api_key or self.keys.acquire()
         if not os.path.exists(file_path):
             raise Exception(f"❌ File không tồn tại: {file_path}")
 
@@ -44,28 +58,33 @@ class HeyGenTalkingPhotoClient:
 
         # Upload file
         upload_headers = {
-            "X-Api-Key": self.api_key,
+            "X-Api-Key": api_key,
             "Content-Type": content_type
         }
 
         with open(file_path, 'rb') as f:
-            upload_response = requests.post(
+            upload_response = self.session.post(
                 f"{self.upload_url}/{endpoint}",
                 headers=upload_headers,
                 data=f.read()
             )
+        current_span().record_response(upload_response)
+        self.keys.record(api_key, upload_response)
+        current_span().set(bytes=os.path.getsize(file_path))
 
         if upload_response.status_code == 200:
             response_data = upload_response.json()
             asset_id = response_data['data'].get('talking_photo_id') or response_data['data'].get('id')
             print(f"✅ Upload thành công: {asset_id}")
+            self.keys.remember(asset_id, api_key)
             return asset_id
         else:
             raise Exception(f"❌ Lỗi upload {file_type}: {upload_response.text}")
 
 
-    def create_video_with_talking_photo(self, talking_photo_id, audio_asset_id):
-        """Tạo video với talking_photo_id và audio_asset_id."""
+    def create_video_with_talking_photo(self, talking_photo_id, audio_asset_id, api_key=None):
+        """Tạo video với talking_photo_id và audio_asset_id (cùng tài khoản với api_key)."""
+        api_key = api_key or self.keys.key_for(talking_photo_id)
         print("\n🎬 BƯỚC 2: Tạo video với Talking Photo...")
 
         voice_payload = {
@@ -94,10 +113,13 @@ class HeyGenTalkingPhotoClient:
             print(f"   Thử resolution: {dimension['width']}x{dimension['height']}")
 
             url = f"{self.base_url}/v2/video/generate"
-            response = requests.post(url, headers=self.headers, json=payload)
+            response = self.session.post(url, headers=self._headers(api_key), json=payload)
+            current_span().record_response(response)
+            self.keys.record(api_key, response)
 
             if response.status_code == 200:
                 video_id = response.json()['data']['video_id']
+                self.keys.remember(video_id, api_key)
                 print(f"✅ Video đang được tạo: {video_id}")
                 return video_id
             else:
@@ -118,7 +140,8 @@ class HeyGenTalkingPhotoClient:
 
         while time.time() - start_time < max_wait:
             url = f"{self.base_url}/v1/video_status.get?video_id={video_id}"
-            response = requests.get(url, headers={"X-Api-Key": self.api_key})
+            response = self.session.get(url, headers={"X-Api-Key": self.keys.key_for(video_id)})
+            current_span().add("polls")
 
             if response.status_code == 200:
                 data = response.json()['data']
@@ -151,7 +174,8 @@ class HeyGenTalkingPhotoClient:
 
             print(f"   Đang download: {filename}")
 
-            response = requests.get(video_url, stream=True)
+            response = self.session.get(video_url, stream=True)
+            current_span().record_response(response)
             response.raise_for_status()
 
             total_size = int(response.headers.get('content-length', 0))
@@ -166,12 +190,14 @@ class HeyGenTalkingPhotoClient:
                             progress = (downloaded_size / total_size) * 100
                             print(f"\r   Progress: {progress:.1f}%", end="", flush=True)
 
+            current_span().set(bytes=downloaded_size)
             print(f"\n✅ Download thành công: {filename}")
             print(f"📁 File size: {downloaded_size / (1024*1024):.2f} MB")
             return filename
 
         except Exception as e:
             print(f"\n❌ Lỗi download: {e}")
+            current_span().fail(e)
             print("💡 Bạn có thể download thủ công từ URL:")
             print(f"   {video_url}")
             return None
@@ -185,8 +211,8 @@ class HeyGenTalkingPhotoClient:
             os.makedirs(output_folder)
             print(f"📁 Đã tạo thư mục: {output_folder}")
 
-        print("\n📸 BƯỚC 1: Upload ảnh talking photo...")
-        talking_photo_id = self.upload_local_file(photo_path, "talking_photo")
+        # Ảnh talking photo upload một lần cho mỗi key (tài khoản), lúc key đó được dùng lần đầu
+        talking_photo_ids = {}
 
         audio_files = []
         for ext in ['*.mp3', '*.wav', '*.m4a', '*.aac']:
@@ -200,41 +226,56 @@ class HeyGenTalkingPhotoClient:
         results = []
 
         for i, audio_file in enumerate(audio_files, 1):
-            try:
-                print(f"\n🎵 [{i}/{len(audio_files)}] Xử lý: {os.path.basename(audio_file)}")
-
-                print("   📤 Upload audio...")
-                audio_asset_id = self.upload_local_file(audio_file, "audio")
-
-                print("   🎬 Tạo video...")
-                video_id = self.create_video_with_talking_photo(talking_photo_id, audio_asset_id)
-
-                print("   ⏳ Chờ render...")
-                video_url = self.wait_and_get_video_url(video_id)
-
-                filename = f"video_{i:03d}_{os.path.splitext(os.path.basename(audio_file))[0]}.mp4"
-                output_path = os.path.join(output_folder, filename)
-
-                print("   📥 Download video...")
-                downloaded_file = self.download_video(video_url, output_path)
-
-                results.append({
-                    'audio_file': audio_file,
-                    'video_id': video_id,
-                    'video_url': video_url,
-                    'local_file': downloaded_file,
-                    'status': 'success'
-                })
-                print(f"   ✅ Hoàn thành: {filename}")
-
-            except Exception as e:
-                print(f"   ❌ Lỗi: {e}")
-                results.append({
-                    'audio_file': audio_file,
-                    'status': 'failed',
-                    'error': str(e)
-                })
-                continue
+            # Tên file audio dạng slide_<số>.mp3 (generate_audio_from_ausync.py) cho biết số slide
+            match = re.search(r"slide_(\d+)", os.path.basename(audio_file))
+            slide_num = int(match.group(1)) if match else i
+            with span("slide_avatar", slide=slide_num) as slide_span:
+                try:
+                    print(f"\n🎵 [{i}/{len(audio_files)}] Xử lý: {os.path.basename(audio_file)}")
+
+                    api_key = self.keys.acquire()
+                    if api_key not in talking_photo_ids:
+                        print("\n📸 BƯỚC 1: Upload ảnh talking photo...")
+                        with span("heygen_upload", provider="heygen", kind="talking_photo"):
+                            talking_photo_ids[api_key] = self.upload_local_file(photo_path, "talking_photo", api_key)
+
+                    print("   📤 Upload audio...")
+                    with span("heygen_upload", provider="heygen", kind="audio"):
+                        audio_asset_id = self.upload_local_file(audio_file, "audio", api_key)
+
+                    print("   🎬 Tạo video...")
+                    with span("heygen_submit", provider="heygen"):
+                        video_id = self.create_video_with_talking_photo(talking_photo_ids[api_key], audio_asset_id, api_key)
+
+                    print("   ⏳ Chờ render...")
+                    with span("heygen_render", provider="heygen"):
+                        video_url = self.wait_and_get_video_url(video_id)
+
+                    filename = f"video_{i:03d}_{os.path.splitext(os.path.basename(audio_file))[0]}.mp4"
+                    output_path = os.path.join(output_folder, filename)
+
+                    print("   📥 Download video...")
+                    with span("video_download", provider="heygen"):
+                        downloaded_file = self.download_video(video_url, output_path)
+
+                    results.append({
+                        'audio_file': audio_file,
+                        'video_id': video_id,
+                        'video_url': video_url,
+                        'local_file': downloaded_file,
+                        'status': 'success'
+                    })
+                    print(f"   ✅ Hoàn thành: {filename}")
+
+                except Exception as e:
+                    print(f"   ❌ Lỗi: {e}")
+                    slide_span.fail(e)
+                    results.append({
+                        'audio_file': audio_file,
+                        'status': 'failed',
+                        'error': str(e)
+                    })
+                    continue
 
         print(f"\n📊 TỔNG KẾT:")
         print("=" * 60)
@@ -1,12 +1,16 @@
 import json
-import time
 import requests
 import os
 import re  # Thêm để trim lặp
+import sys
 from docx import Document
 from dotenv import load_dotenv
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.key_pool import KeyPool
+from common.providers import base_url
+from common.tracing import current_span, span
+from common.transport import get_session
 
 # === CONFIG ===
 load_dotenv()
@@ -14,18 +18,15 @@ load_dotenv()
 WORD_PATH = "bai_giang_30_slide_day_du.docx"
 OUTPUT_JSON = "slides_with_text.json"
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
+# Nhiều key (GEMINI_API_KEYS=key1,key2) để chia tải; GEMINI_KEY_RPM giới hạn mỗi key
+gemini_keys = KeyPool.from_env("gemini", "GEMINI_API_KEY")
+if not gemini_keys:
     raise ValueError("Lỗi: Vui lòng thiết lập biến môi trường GEMINI_API_KEY trong file .env")
 
-GEMINI_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={GEMINI_API_KEY}"
-MAX_RETRIES = 3
-RETRY_DELAY = 1  # Backoff factor cho retry tự động
+GEMINI_URL = f"{base_url('gemini')}/v1beta/models/gemini-2.5-flash:generateContent"
 
-# Tạo session với retry
-session = requests.Session()
-retries = Retry(total=MAX_RETRIES, backoff_factor=RETRY_DELAY, status_forcelist=[429, 500, 502, 503, 504])
-session.mount('https://', HTTPAdapter(max_retries=retries))
+# Session dùng chung (giữ kết nối, timeout và retry thống nhất, xem common/transport.py)
+session = get_session()
 
 # === 1. TÁCH SLIDE TỪ WORD ===
 def extract_slide_contents(doc_path):
@@ -85,7 +86,8 @@ def generate_lecture(text, max_length=2000, is_first_slide=False):
     body = {"contents": [{"parts": [{"text": prompt}]}]}
 
     try:
-        res = session.post(GEMINI_URL, headers=headers, json=body, timeout=90)
+        _, res = gemini_keys.send(lambda key: session.post(GEMINI_URL, params={"key": key}, headers=headers, json=body))
+        current_span().record_response(res)
         res.raise_for_status()
         data = res.json()
         generated_text = data["candidates"][0]["content"]["parts"][0]["text"].strip()
@@ -105,21 +107,16 @@ def generate_lecture(text, max_length=2000, is_first_slide=False):
         return generated_text
     except requests.exceptions.RequestException as e:
         print(f"❌ Lỗi khi gọi Gemini (sau khi đã thử lại): {e}.")
+        current_span().fail(e)
         return text
     except (KeyError, IndexError):
         print("❌ Cấu trúc phản hồi từ API không hợp lệ. Trả về văn bản gốc.")
+        current_span().fail("Cấu trúc phản hồi không hợp lệ")
         return text
 
 # === 3. QUY TRÌNH CHÍNH ===
-def main():
-    """Quy trình chính: đọc file, xử lý từng slide và lưu kết quả."""
-    print("📘 Đang đọc file Word...")
-    slides_data = extract_slide_contents(WORD_PATH)
-    
-    if slides_data is None:
-        print("🛑 Dừng chương trình do không đọc được file Word.")
-        return
-
+def generate_lectures(slides_data):
+    """Tạo lời giảng cho từng slide đã tách từ Word, trả về danh sách slide cho file JSON."""
     result = []
     total_slides = len(slides_data)
 
@@ -127,7 +124,8 @@ def main():
         print(f"🧠 Xử lý slide {idx}/{total_slides}: {slide['title']}")
         original = slide["content"]
         is_first = (idx == 1)  # Chỉ cho phép chào ở Slide 1
-        generated = generate_lecture(original, is_first_slide=is_first)
+        with span("gemini_lecture", provider="gemini", slide=idx, chars=len(original)):
+            generated = generate_lecture(original, is_first_slide=is_first)
         result.append({
             "slide_number": idx,
             "title": slide["title"],
@@ -135,12 +133,24 @@ def main():
             "generated_lecture": generated,
             "audio_path": ""  # thêm sau
         })
-        time.sleep(10)  # Tăng delay để tránh rate limit
+    return result
+
+
+def main():
+    """Quy trình chính: đọc file, xử lý từng slide và lưu kết quả."""
+    print("📘 Đang đọc file Word...")
+    slides_data = extract_slide_contents(WORD_PATH)
+    
+    if slides_data is None:
+        print("🛑 Dừng chương trình do không đọc được file Word.")
+        return
+
+    result = generate_lectures(slides_data)
 
     with open(OUTPUT_JSON, "w", encoding="utf-8") as f:
         json.dump(result, f, ensure_ascii=False, indent=2)
         
-    print(f"\n✅ Hoàn tất! {total_slides} slides đã được xử lý. Kết quả lưu tại: {OUTPUT_JSON}")
+    print(f"\n✅ Hoàn tất! {len(result)} slides đã được xử lý. Kết quả lưu tại: {OUTPUT_JSON}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
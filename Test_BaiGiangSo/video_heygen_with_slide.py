@@ -1,6 +1,10 @@
 import os
+import sys
 from moviepy.editor import VideoFileClip, ImageClip, CompositeVideoClip
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.tracing import current_span, span
+
 # --- Cấu hình ---
 
 # Thư mục chứa các video avatar đã tạo (ví dụ: video_001_slide_1.mp4, video_002_slide_2.mp4)
@@ -64,11 +68,13 @@ def merge_avatar_and_slide(slide_image_path, avatar_video_path, output_path):
         # 5. Ghi file video cuối cùng
         # codec="libx264" và audio_codec="aac" là các lựa chọn phổ biến, tương thích cao
         final_clip.write_videofile(output_path, codec="libx264", audio_codec="aac")
+        current_span().set(bytes=os.path.getsize(output_path), video_seconds=round(final_clip.duration, 2))
         
         print(f"✅ Hoàn thành: {output_path}")
 
     except Exception as e:
         print(f"❌ Lỗi khi xử lý file {os.path.basename(avatar_video_path)}: {e}")
+        current_span().fail(e)
 
 def process_all_videos():
     """
@@ -116,7 +122,8 @@ def process_all_videos():
         avatar_video_path = os.path.join(AVATAR_VIDEOS_DIR, video_filename)
         output_video_path = os.path.join(FINAL_VIDEOS_DIR, f"final_{video_filename}")
         
-        merge_avatar_and_slide(slide_image_path, avatar_video_path, output_video_path)
+        with span("composite", slide=int(slide_number)):
+            merge_avatar_and_slide(slide_image_path, avatar_video_path, output_video_path)
 
 if __name__ == "__main__":
     process_all_videos()
\ No newline at end of file
@@ -0,0 +1,159 @@
+"""
+Ghép audio theo luồng: các đoạn được ghi lần lượt vào một bộ mã hóa, bộ nhớ không tăng theo độ dài bài giảng.
+
+- Thay cho `combined += segment` của pydub: cách đó giữ toàn bộ PCM của bài giảng trong RAM
+  và chép lại cả bộ đệm sau mỗi lần nối (bậc hai theo số đoạn).
+- Đầu ra MP3 (hoặc định dạng khác): PCM s16le được đẩy qua stdin của một tiến trình ffmpeg
+  (cùng ffmpeg mà pydub dùng, FFMPEG_BINARY để đổi đường dẫn).
+- Đầu ra WAV: ghi thẳng bằng module wave, không cần ffmpeg.
+- Đầu vào: PCM đã đúng định dạng (write_pcm), file WAV cùng định dạng (đọc từng khối bằng wave),
+  file khác (MP3, WAV khác tần số...) được ffmpeg giải mã/chuyển đổi từng khối.
+- File đích được ghi qua tên tạm và chỉ đổi tên khi close() thành công.
+"""
+import os
+import shutil
+import subprocess
+import wave
+
+FFMPEG = os.getenv("FFMPEG_BINARY", "ffmpeg")
+BLOCK_FRAMES = 64 * 1024  # Số frame đọc mỗi lần (≈ 2,7 giây ở 24 kHz)
+SAMPLE_WIDTH = 2  # PCM 16 bit
+
+
+def wav_format(path, default=(24000, 2)):
+    """(tần số, số kênh) của file WAV PCM 16 bit, để file ghép giữ đúng định dạng của các đoạn."""
+    try:
+        with wave.open(path, "rb") as source:
+            if source.getsampwidth() == SAMPLE_WIDTH:
+                return source.getframerate(), source.getnchannels()
+    except (OSError, wave.Error, EOFError):
+        pass
+    return default
+
+
+class StreamingEncoder:
+    def __init__(self, output_path, frame_rate=24000, channels=2, bitrate="128k", format=None):
+        self.output_path = output_path
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.format = format or os.path.splitext(output_path)[1].lstrip(".").lower() or "mp3"
+        self.frames = 0
+        self._tmp_path = f"{output_path}.part"
+        self._wav = None
+        self._proc = None
+        if self.format == "wav":
+            self._wav = wave.open(self._tmp_path, "wb")
+            self._wav.setnchannels(channels)
+            self._wav.setsampwidth(SAMPLE_WIDTH)
+            self._wav.setframerate(frame_rate)
+        else:
+            self._proc = subprocess.Popen(
+                [FFMPEG, "-hide_banner", "-loglevel", "error", "-y",
+                 "-f", "s16le", "-ar", str(frame_rate), "-ac", str(channels), "-i", "pipe:0",
+                 "-b:a", bitrate, "-f", self.format, self._tmp_path],
+                stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    @property
+    def frame_bytes(self):
+        return self.channels * SAMPLE_WIDTH
+
+    @property
+    def duration(self):
+        """Số giây audio đã ghi."""
+        return self.frames / self.frame_rate
+
+    def write_pcm(self, data):
+        """Ghi PCM s16le đúng tần số/số kênh của encoder."""
+        if self._wav:
+            self._wav.writeframesraw(data)
+        else:
+            try:
+                self._proc.stdin.write(data)
+            except BrokenPipeError:
+                raise RuntimeError(f"ffmpeg dừng giữa chừng: {self._stderr()}")
+        self.frames += len(data) // self.frame_bytes
+
+    def write_silence(self, milliseconds):
+        frames = self.frame_rate * milliseconds // 1000
+        block = b"\0" * (min(frames, BLOCK_FRAMES) * self.frame_bytes)
+        while frames > 0:
+            count = min(frames, BLOCK_FRAMES)
+            self.write_pcm(block[:count * self.frame_bytes])
+            frames -= count
+
+    def write_file(self, path):
+        """Ghi một file audio vào cuối, từng khối; trả về số giây đã ghi."""
+        start = self.frames
+        if not self._write_matching_wav(path):
+            self._write_decoded(path)
+        return (self.frames - start) / self.frame_rate
+
+    def _write_matching_wav(self, path):
+        try:
+            source = wave.open(path, "rb")
+        except (wave.Error, EOFError):
+            return False  # Không phải WAV PCM: để ffmpeg giải mã
+        with source:
+            if (source.getnchannels(), source.getsampwidth(), source.getframerate()) != \
+                    (self.channels, SAMPLE_WIDTH, self.frame_rate):
+                return False
+            while True:
+                block = source.readframes(BLOCK_FRAMES)
+                if not block:
+                    return True
+                self.write_pcm(block)
+
+    def _write_decoded(self, path):
+        # Kiểm tra giải mã được trước khi ghi, để file hỏng không để lại nửa đoạn trong kết quả
+        decoder = subprocess.Popen(
+            [FFMPEG, "-hide_banner", "-loglevel", "error", "-i", path,
+             "-f", "s16le", "-ar", str(self.frame_rate), "-ac", str(self.channels), "pipe:1"],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        with decoder:
+            first = decoder.stdout.read(BLOCK_FRAMES * self.frame_bytes)
+            if not first:
+                decoder.wait()
+                raise ValueError(f"Không giải mã được {path}: {decoder.stderr.read().decode(errors='replace')[-300:]}")
+            self.write_pcm(first)
+            for block in iter(lambda: decoder.stdout.read(BLOCK_FRAMES * self.frame_bytes), b""):
+                self.write_pcm(block)
+
+    def _stderr(self):
+        return self._proc.stderr.read().decode(errors="replace")[-500:] if self._proc else ""
+
+    def close(self):
+        """Kết thúc mã hóa và đưa file vào đúng tên; trả về số giây audio."""
+        if self._wav:
+            self._wav.close()
+        else:
+            self._proc.stdin.close()
+            if self._proc.wait() != 0:
+                error = self._stderr()
+                self._remove_tmp()
+                raise RuntimeError(f"ffmpeg lỗi khi mã hóa {self.output_path}: {error}")
+            self._proc.stderr.close()
+        shutil.move(self._tmp_path, self.output_path)
+        return self.duration
+
+    def abort(self):
+        if self._wav:
+            self._wav.close()
+        elif self._proc.poll() is None:
+            self._proc.kill()
+            self._proc.wait()
+        self._remove_tmp()
+
+    def _remove_tmp(self):
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
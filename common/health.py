@@ -0,0 +1,133 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+
+class HealthMonitor:
+    """
+    Theo dõi tình trạng một nhà cung cấp (AusyncLab, ...) thay cho việc gọi API kiểm tra mỗi lần.
+    - Kết quả kiểm tra được cache trong ttl giây; mỗi request thật thành công cũng làm mới cache,
+      nên khi server khỏe sẽ không tốn thêm round trip nào.
+    - Sau failure_threshold lỗi liên tiếp, mạch mở (OPEN): mọi request bị từ chối ngay.
+    - Sau reset_timeout giây, mạch nửa mở (HALF_OPEN): cho một lần kiểm tra thử,
+      thành công thì đóng lại, thất bại thì mở tiếp.
+    - state_file (tùy chọn) giúp nhiều lần chạy script dùng chung kết quả kiểm tra.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, probe, ttl=60, failure_threshold=3, reset_timeout=30, state_file=None):
+        self.name = name
+        self.probe = probe
+        self.ttl = ttl
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state_file = state_file
+        self.state = self.CLOSED
+        self.failures = 0
+        self.last_ok = 0.0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+        self._load()
+
+    def is_available(self):
+        """True nếu nên gửi request tới nhà cung cấp; chỉ gọi probe khi cache đã hết hạn."""
+        with self._lock:
+            now = time.time()
+            if self.state == self.OPEN:
+                if now - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                logging.info(f"[{self.name}] Mạch nửa mở, thử kiểm tra lại")
+            elif self.state == self.CLOSED and now - self.last_ok < self.ttl:
+                return True
+        return self._run_probe()
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logging.info(f"[{self.name}] Mạch đóng lại, server hoạt động bình thường")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.last_ok = time.time()
+        self._save()
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logging.warning(f"[{self.name}] Mạch mở sau {self.failures} lỗi liên tiếp")
+                self.state = self.OPEN
+                self.opened_at = time.time()
+            self.last_ok = 0.0
+        self._save()
+
+    def snapshot(self):
+        with self._lock:
+            return {"state": self.state, "failures": self.failures, "last_ok": self.last_ok}
+
+    def _run_probe(self):
+        # Chỉ một luồng gọi probe, các luồng khác chờ rồi dùng kết quả
+        with self._probe_lock:
+            with self._lock:
+                if self.state == self.CLOSED and time.time() - self.last_ok < self.ttl:
+                    return True
+                if self.state == self.OPEN:
+                    return False  # Luồng khác vừa kiểm tra thất bại
+            try:
+                ok = bool(self.probe())
+            except Exception as e:
+                logging.error(f"[{self.name}] Kiểm tra server lỗi: {e}")
+                ok = False
+            if ok:
+                self.record_success()
+            else:
+                self.record_failure()
+            return ok
+
+    def _load(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.state = data.get("state", self.CLOSED)
+            self.failures = data.get("failures", 0)
+            self.last_ok = data.get("last_ok", 0.0)
+            self.opened_at = data.get("opened_at", 0.0)
+        except (OSError, ValueError):
+            pass
+
+    def _save(self):
+        if not self.state_file:
+            return
+        with self._lock:
+            data = {"state": self.state, "failures": self.failures,
+                    "last_ok": self.last_ok, "opened_at": self.opened_at}
+        tmp_path = f"{self.state_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.state_file)
+        except OSError:
+            pass
+
+
+def is_provider_failure(error):
+    """Lỗi do phía server/mạng (timeout, mất kết nối, 5xx), không tính lỗi 4xx do request sai."""
+    response = getattr(error, "response", None)
+    if response is not None:
+        return response.status_code >= 500
+    return True
+
+
+def shared_state_file(name):
+    """Đường dẫn file trạng thái dùng chung giữa các lần chạy script trên cùng máy."""
+    return os.path.join(tempfile.gettempdir(), f"baigiangso_health_{name}.json")
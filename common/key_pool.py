@@ -0,0 +1,180 @@
+"""
+Chia request cho nhiều API key của cùng một nhà cung cấp.
+
+- Khai báo nhiều key bằng <BIẾN>S (vd AUSYNC_API_KEYS=key1,key2) hoặc dấu phẩy trong <BIẾN>.
+- <TÊN>_KEY_RPM (vd AUSYNC_KEY_RPM=60): số request tối đa mỗi key trong 60 giây, 0 = không giới hạn.
+- Mỗi lần acquire() chọn key đang rảnh nhất; key nhận 429 bị tạm rút khỏi vòng quay
+  tới hết Retry-After (hoặc `cooldown` giây), hết key thì chờ key sớm nhất được dùng lại.
+- Việc đã tạo bằng key nào (audio_id, talk_id, video_id, ảnh đã upload) phải hỏi lại bằng
+  đúng key đó: send() trả về cả key đã dùng, remember()/key_for() giữ liên kết id → key.
+- Chỉ request tạo việc đi qua acquire(); hỏi trạng thái và tải file dùng lại key của việc đó.
+- Ngoài giới hạn trong process, acquire()/record() còn đi qua RateLimiter (common/rate_limiter.py)
+  để mọi process trên máy chia chung hạn mức của từng key.
+"""
+import hashlib
+import os
+import threading
+import time
+import zlib
+from collections import deque
+
+from common.rate_limiter import RateLimiter
+
+RATE_WINDOW = 60.0
+
+
+def fingerprint(key):
+    """Mã băm ngắn của key, để lưu xuống đĩa thay cho key thật."""
+    return hashlib.sha256(key.encode()).hexdigest()[:12]
+
+
+class _KeyState:
+    def __init__(self, key):
+        self.key = key
+        self.label = f"…{key[-4:]}" if len(key) > 8 else f"#{zlib.crc32(key.encode()) % 10000:04d}"
+        self.recent = deque()  # Thời điểm các request trong cửa sổ RATE_WINDOW
+        self.cooling_until = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+
+    def ready_at(self, now, rpm):
+        while self.recent and self.recent[0] <= now - RATE_WINDOW:
+            self.recent.popleft()
+        ready = self.cooling_until
+        if rpm and len(self.recent) >= rpm:
+            ready = max(ready, self.recent[0] + RATE_WINDOW)
+        return ready
+
+
+class KeyPool:
+    def __init__(self, name, keys, rpm=0, cooldown=60.0, limiter=None):
+        self.name = name
+        self.rpm = rpm
+        self.cooldown = cooldown
+        self.limiter = limiter
+        self._states = {}
+        for key in keys:
+            self._states.setdefault(key, _KeyState(key))
+        self._order = list(self._states.values())
+        self._turn = 0
+        self._owners = {}
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_env(cls, name, env_var, default=None, cooldown=60.0):
+        raw = os.getenv(f"{env_var}S") or os.getenv(env_var) or ""
+        keys = [key.strip() for key in raw.split(",") if key.strip()]
+        if not keys and default is not None:
+            keys = [default]
+        rpm = int(os.getenv(f"{name.upper()}_KEY_RPM", "0"))
+        return cls(name, keys, rpm=rpm, cooldown=cooldown, limiter=RateLimiter.from_env(name))
+
+    def __len__(self):
+        return len(self._order)
+
+    def acquire(self, timeout=None):
+        """Lấy một key còn hạn mức; chờ nếu mọi key đang bị giới hạn (trong process lẫn giữa các process)."""
+        if not self._order:
+            raise ValueError(f"Chưa cấu hình API key cho {self.name}")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                best = None
+                earliest = None
+                count = len(self._order)
+                for offset in range(count):
+                    state = self._order[(self._turn + offset) % count]
+                    ready = state.ready_at(now, self.rpm)
+                    if ready <= now:
+                        if best is None or len(state.recent) < len(best.recent):
+                            best = state
+                    elif earliest is None or ready < earliest:
+                        earliest = ready
+                if best is not None:
+                    self._turn = (self._order.index(best) + 1) % count
+                    best.recent.append(now)
+                    best.requests += 1
+                    key = best.key
+                    break
+                wait = earliest - now
+                if deadline is not None:
+                    if now >= deadline:
+                        raise TimeoutError(f"Mọi API key của {self.name} đang bị giới hạn")
+                    wait = min(wait, deadline - now)
+                self._cond.wait(wait)
+        if self.limiter:
+            self.limiter.acquire(key)
+        return key
+
+    def record(self, key, response=None, error=None):
+        """Ghi kết quả một request; 429 đưa key vào thời gian nghỉ."""
+        if self.limiter:
+            self.limiter.record(key, response, error)
+        with self._cond:
+            state = self._states.get(key)
+            if state is None:
+                return
+            if response is not None and response.status_code == 429:
+                state.throttled += 1
+                retry_after = response.headers.get("Retry-After", "")
+                pause = float(retry_after) if retry_after.replace(".", "", 1).isdigit() else self.cooldown
+                state.cooling_until = max(state.cooling_until, time.monotonic() + pause)
+            elif error is not None or (response is not None and response.status_code >= 500):
+                state.errors += 1
+            self._cond.notify_all()
+
+    def send(self, request_fn, attempts=None):
+        """
+        Gọi request_fn(key) -> requests.Response, đổi sang key khác khi nhận 429.
+        Trả về (key, response) của lần cuối.
+        """
+        attempts = attempts or len(self._order) + 1
+        for _ in range(attempts):
+            key = self.acquire()
+            try:
+                response = request_fn(key)
+            except Exception as e:
+                self.record(key, error=e)
+                raise
+            self.record(key, response)
+            if response.status_code != 429:
+                break
+        return key, response
+
+    def remember(self, resource_id, key):
+        with self._cond:
+            self._owners[str(resource_id)] = key
+
+    def key_for(self, resource_id, forget=False):
+        """Key đã tạo resource_id; không biết thì lấy key đầu tiên (chỉ có một key)."""
+        with self._cond:
+            if forget:
+                key = self._owners.pop(str(resource_id), None)
+            else:
+                key = self._owners.get(str(resource_id))
+        if key is None and self._order:
+            key = self._order[0].key
+        return key
+
+    def find(self, key_ref):
+        """Key trong pool có fingerprint bằng key_ref, hoặc None (key đã bị gỡ khỏi cấu hình)."""
+        for state in self._order:
+            if fingerprint(state.key) == key_ref:
+                return state.key
+        return None
+
+    def stats(self):
+        now = time.monotonic()
+        with self._cond:
+            return {
+                state.label: {
+                    "requests": state.requests,
+                    "throttled": state.throttled,
+                    "errors": state.errors,
+                    "in_window": len(state.recent),
+                    "cooling_seconds": round(max(0.0, state.ready_at(now, self.rpm) - now), 1),
+                }
+                for state in self._order
+            }
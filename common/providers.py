@@ -0,0 +1,22 @@
+"""
+Địa chỉ gốc của các API bên ngoài.
+Đặt biến môi trường <TÊN>_BASE_URL (vd AUSYNC_BASE_URL=http://127.0.0.1:8765) để trỏ
+script sang tools/provider_sim.py khi đo hiệu năng mà không tốn quota thật.
+"""
+import os
+
+DEFAULT_BASE_URLS = {
+    "ausync": "https://api.ausynclab.org",
+    "fpt": "https://api.fpt.ai",
+    "gemini": "https://generativelanguage.googleapis.com",
+    "d_id": "https://api.d-id.com",
+    "heygen": "https://api.heygen.com",
+    "heygen_upload": "https://upload.heygen.com",
+    "cloudinary": "https://api.cloudinary.com",
+}
+
+
+def base_url(provider):
+    """Đọc lúc gọi (không phải lúc import) để giá trị trong .env nạp sau vẫn có hiệu lực."""
+    value = os.getenv(f"{provider.upper()}_BASE_URL") or DEFAULT_BASE_URLS[provider]
+    return value.rstrip("/")
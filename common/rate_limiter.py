@@ -0,0 +1,181 @@
+"""
+Giới hạn tốc độ gửi request theo nhà cung cấp và API key, dùng chung giữa các process.
+
+- Mỗi (nhà cung cấp, key) có một token bucket: nạp `rate` token/giây, chứa tối đa `burst` token.
+- Trạng thái nằm trong SQLite (RATE_LIMIT_DB, mặc định baigiangso_rate_limits.sqlite trong thư mục tạm),
+  nên web app và nhiều lần chạy CLI trên cùng máy cùng tiêu một hạn mức thay vì tranh nhau.
+- Tự điều chỉnh kiểu AIMD: request thành công tăng rate thêm `increase`, gặp 429 thì rate giảm
+  một nửa và bucket bị khóa tới hết Retry-After (không có thì `penalty` giây).
+- <TÊN>_RPM (vd GEMINI_RPM=10) đặt tốc độ khởi đầu theo request/phút, 0 = không giới hạn;
+  rate tự tăng tới tối đa gấp 4 lần và giảm tới tối thiểu 1/20 giá trị này.
+- DB chỉ lưu mã băm của key, không lưu key.
+"""
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+# Request/phút khởi đầu, xấp xỉ độ trễ cố định mà các script từng dùng
+DEFAULT_RPM = {"ausync": 60, "fpt": 20, "gemini": 10, "d_id": 30, "heygen": 30}
+MAX_WAIT_STEP = 5.0  # Ngủ từng đoạn ngắn để thấy ngay thay đổi từ process khác
+RETRY_429_REASON = "too many 429 error responses"  # urllib3 ResponseError.SPECIFIC_ERROR với mã 429
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    bucket TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    rate REAL NOT NULL,
+    blocked_until REAL NOT NULL DEFAULT 0,
+    successes INTEGER NOT NULL DEFAULT 0,
+    throttled INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+
+def db_path():
+    return os.getenv("RATE_LIMIT_DB") or os.path.join(tempfile.gettempdir(), "baigiangso_rate_limits.sqlite")
+
+
+def _retry_after(response, default):
+    value = response.headers.get("Retry-After", "") if response is not None else ""
+    return float(value) if value.replace(".", "", 1).isdigit() else default
+
+
+def _was_throttled(response, error):
+    """
+    429 trả về (kể cả response lấy từ HTTPError của raise_for_status), 429 mà urllib3 đã âm thầm thử lại,
+    hoặc RetryError khi urllib3 hết lượt thử lại vì 429 (lỗi này không có response).
+    """
+    if response is not None:
+        if response.status_code == 429:
+            return True
+        retries = getattr(getattr(response, "raw", None), "retries", None)
+        return any(entry.status == 429 for entry in getattr(retries, "history", None) or ())
+    # RetryError bọc MaxRetryError, lý do là ResponseError của urllib3 với đúng câu này
+    max_retry = error.args[0] if error is not None and error.args else None
+    return str(getattr(max_retry, "reason", "")) == RETRY_429_REASON
+
+
+class RateLimiter:
+    def __init__(self, name, rpm, burst=None, increase=None, penalty=30.0, path=None):
+        self.name = name
+        self.rate = rpm / 60.0
+        self.max_rate = self.rate * 4
+        self.min_rate = self.rate / 20
+        self.burst = burst or max(1.0, rpm / 10.0)
+        self.increase = increase if increase is not None else self.rate / 10
+        self.penalty = penalty
+        self.path = path
+        self._local = threading.local()
+
+    @classmethod
+    def from_env(cls, name, **kwargs):
+        rpm = float(os.getenv(f"{name.upper()}_RPM", DEFAULT_RPM.get(name, 0)))
+        return cls(name, rpm, **kwargs)
+
+    def __bool__(self):
+        return self.rate > 0
+
+    def _connect(self):
+        path = self.path or db_path()
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.path != path:
+            conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+            self._local.conn, self._local.path = conn, path
+        return conn
+
+    def _bucket(self, key):
+        digest = hashlib.sha256(key.encode()).hexdigest()[:12] if key else "-"
+        return f"{self.name}:{digest}"
+
+    def _update(self, key, change):
+        """Đọc-sửa-ghi một bucket trong transaction ghi; change(row, now) trả về (row mới, kết quả)."""
+        conn = self._connect()
+        bucket = self._bucket(key)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            found = conn.execute(
+                "SELECT tokens, updated, rate, blocked_until, successes, throttled FROM buckets WHERE bucket = ?",
+                (bucket,)).fetchone()
+            row = dict(zip(("tokens", "updated", "rate", "blocked_until", "successes", "throttled"),
+                           found or (self.burst, now, self.rate, 0.0, 0, 0)))
+            row["tokens"] = min(self.burst, row["tokens"] + max(0.0, now - row["updated"]) * row["rate"])
+            row["updated"] = now
+            row, result = change(row, now)
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (bucket, row["tokens"], row["updated"], row["rate"], row["blocked_until"],
+                 row["successes"], row["throttled"]))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+    def acquire(self, key=""):
+        """Chờ tới khi bucket của key có token rồi lấy một token; trả về số giây đã chờ."""
+        if not self:
+            return 0.0
+
+        def take(row, now):
+            if now < row["blocked_until"]:
+                return row, row["blocked_until"] - now
+            if row["tokens"] >= 1:
+                row["tokens"] -= 1
+                return row, 0.0
+            return row, (1 - row["tokens"]) / row["rate"]
+
+        waited = 0.0
+        while True:
+            wait = self._update(key, take)
+            if wait <= 0:
+                return waited
+            wait = min(wait, MAX_WAIT_STEP)
+            time.sleep(wait)
+            waited += wait
+
+    def record(self, key="", response=None, error=None):
+        """Điều chỉnh rate theo kết quả request: tăng cộng khi thành công, giảm nhân khi bị 429."""
+        if not self:
+            return
+        if response is None:
+            response = getattr(error, "response", None)  # HTTPError mang response (và Retry-After) của nó
+        throttled = _was_throttled(response, error)
+        if not throttled and (response is None or response.status_code >= 400):
+            return  # Lỗi khác không nói gì về hạn mức
+
+        def adjust(row, now):
+            if throttled:
+                row["throttled"] += 1
+                row["rate"] = max(self.min_rate, row["rate"] / 2)
+                row["tokens"] = 0.0
+                row["blocked_until"] = max(row["blocked_until"], now + _retry_after(response, self.penalty))
+            else:
+                row["successes"] += 1
+                row["rate"] = min(self.max_rate, row["rate"] + self.increase)
+            return row, None
+
+        self._update(key, adjust)
+
+    def stats(self):
+        """Trạng thái các bucket của nhà cung cấp này (mọi process cùng ghi)."""
+        rows = self._connect().execute(
+            "SELECT bucket, tokens, rate, blocked_until, successes, throttled FROM buckets WHERE bucket LIKE ?",
+            (f"{self.name}:%",)).fetchall()
+        now = time.time()
+        return {
+            bucket.split(":", 1)[1]: {
+                "rpm": round(rate * 60, 1),
+                "tokens": round(tokens, 2),
+                "blocked_seconds": round(max(0.0, blocked_until - now), 1),
+                "successes": successes,
+                "throttled": throttled,
+            }
+            for bucket, tokens, rate, blocked_until, successes, throttled in rows
+        }
@@ -0,0 +1,116 @@
+"""
+Trạng thái từng đoạn audio của bước tạo audio, lưu trong SQLite để chạy lại tiếp đúng chỗ dừng.
+
+- Mỗi đoạn (slide, thứ tự đoạn) lưu: mã băm nội dung, audio_id, key đã tạo (dạng mã băm),
+  audio_url, file tạm đã tải, trạng thái và lỗi gần nhất.
+- Trạng thái: submitted (đã có audio_id) → rendered (đã có URL) → done (đã tải file).
+  Chạy lại thì đoạn done được dùng luôn, đoạn đã có audio_id chỉ hỏi lại trạng thái, không gửi TTS lại.
+- Mỗi slide gộp xong lưu audio_path/duration, nên process bị ngắt vẫn không phải gộp lại slide đó.
+- Mã băm nội dung do nơi gọi tính (văn bản + giọng, model, tốc độ); đổi bất kỳ thứ nào
+  thì trạng thái cũ bị bỏ qua.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    slide TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    status TEXT NOT NULL,
+    audio_id TEXT,
+    key_ref TEXT,
+    audio_url TEXT,
+    path TEXT,
+    error TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (slide, idx)
+);
+CREATE TABLE IF NOT EXISTS slides (
+    slide TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    audio_path TEXT NOT NULL,
+    duration REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+SCHEMA_VERSION = 2  # Khác phiên bản thì bỏ trạng thái cũ (chỉ mất khả năng tiếp tục, không mất audio)
+_FIELDS = ("status", "audio_id", "key_ref", "audio_url", "path", "error")
+
+
+class SegmentState:
+    """Trạng thái một đoạn; update() ghi ngay xuống DB (store=None: chỉ giữ trong bộ nhớ)."""
+
+    def __init__(self, store, slide, idx, content_hash, row=None):
+        self.store = store
+        self.slide = str(slide)
+        self.idx = idx
+        self.content_hash = content_hash
+        row = row if row and row["content_hash"] == content_hash else {}
+        self.status = row.get("status", "pending")
+        self.audio_id = row.get("audio_id")
+        self.key_ref = row.get("key_ref")
+        self.audio_url = row.get("audio_url")
+        self.path = row.get("path")
+        self.error = row.get("error")
+
+    def update(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+        if self.store:
+            self.store._save_segment(self)
+
+
+class SegmentStore:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                self._conn.executescript("DROP TABLE IF EXISTS segments; DROP TABLE IF EXISTS slides;")
+                self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self._conn.executescript(_SCHEMA)
+
+    def segment(self, slide, idx, content_hash):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM segments WHERE slide = ? AND idx = ?", (str(slide), idx)).fetchone()
+        return SegmentState(self, slide, idx, content_hash, dict(row) if row else None)
+
+    def _save_segment(self, state):
+        values = [getattr(state, name) for name in _FIELDS]
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO segments (slide, idx, content_hash, status, audio_id, key_ref, audio_url, path,"
+                " error, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [state.slide, state.idx, state.content_hash, *values, time.time()])
+
+    def finish_slide(self, slide, content_hash, audio_path, duration):
+        """Lưu kết quả gộp của slide và bỏ trạng thái các đoạn (file tạm đã xóa)."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO slides VALUES (?, ?, ?, ?, ?)",
+                (str(slide), content_hash, audio_path, duration, time.time()))
+            self._conn.execute("DELETE FROM segments WHERE slide = ?", (str(slide),))
+
+    def finished_slide(self, slide, content_hash):
+        """(audio_path, duration) nếu slide đã gộp xong với đúng nội dung này và file còn trên đĩa."""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM slides WHERE slide = ?", (str(slide),)).fetchone()
+        if row and row["content_hash"] == content_hash and os.path.exists(row["audio_path"]):
+            return row["audio_path"], row["duration"]
+        return None
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM segments GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
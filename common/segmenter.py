@@ -0,0 +1,198 @@
+"""
+Chia văn bản tiếng Việt thành các đoạn gửi cho API TTS, dùng chung cho mọi nhà cung cấp.
+
+- Văn bản được chuẩn hóa Unicode NFC trước khi đếm: chữ có dấu dạng tổ hợp (gõ từ Word/macOS)
+  tốn gấp đôi ký tự so với dạng dựng sẵn và làm vượt giới hạn ký tự của nhà cung cấp.
+- Câu kết thúc ở . ? ! … (kèm dấu ngoặc/nháy đóng) hoặc xuống dòng; dấu chấm sau chữ viết tắt
+  (TP., ThS., v.v., chữ cái đầu tên) hay trước chữ thường không tính là hết câu.
+- Câu được chia tiếp thành vế ở , ; : và gạch ngang; chỉ vế dài hơn giới hạn mới bị cắt giữa các từ,
+  từ dài hơn giới hạn bị cắt cứng.
+- split_text gom các vế thành ít đoạn nhất có thể (gom tham lam theo thứ tự là tối ưu về số đoạn),
+  sau đó cân bằng độ dài: tìm giới hạn nhỏ nhất vẫn giữ nguyên số đoạn, để các đoạn render song song
+  xong gần cùng lúc. Thời gian tuyến tính theo độ dài văn bản.
+- split_stable gom nguyên câu nhưng ranh giới đoạn chỉ phụ thuộc nội dung từng câu (mã băm câu),
+  không cân bằng toàn cục: sửa một câu chỉ đổi O(1) đoạn, các đoạn khác giữ nguyên khóa cache.
+- Dòng trống (ngắt đoạn văn) trở thành PARAGRAPH_BREAK, không bao giờ được gửi lên API;
+  pipeline sẽ chèn khoảng lặng tạo tại chỗ. Luồng không chèn khoảng lặng thì truyền
+  keep_paragraphs=False để gom qua ranh giới đoạn văn (ít request hơn nhiều với bài giảng nhiều đoạn ngắn).
+- Mọi đoạn đều có độ dài <= max_length, không bao giờ chỉ chứa khoảng trắng, và không mất ký tự nào
+  ngoài khoảng trắng (được gộp thành một dấu cách).
+"""
+import hashlib
+import re
+import unicodedata
+
+PARAGRAPH_BREAK = ""  # Đánh dấu ngắt đoạn văn, thay bằng khoảng lặng khi ghép audio
+STABLE_TARGET = 0.6  # split_stable: độ dài kỳ vọng của một đoạn, tính theo max_length
+
+SENTENCE_END = re.compile(r"[.?!…]+[\"'”’»)\]]*$")
+CLAUSE_END = re.compile(r"[,;:]+[\"'”’»)\]]*$")
+DASHES = {"-", "–", "—"}
+# Chữ viết tắt hay gặp trong bài giảng (viết thường, bỏ dấu chấm cuối)
+ABBREVIATIONS = {
+    "tp", "q", "p", "tx", "tt", "ts", "ths", "pgs", "gs", "bs", "ks", "cn", "th.s", "pgs.ts", "gs.ts",
+    "v.v", "vd", "tr", "st", "mr", "mrs", "dr", "no",
+}
+
+
+def is_paragraph_break(chunk):
+    return chunk == PARAGRAPH_BREAK
+
+
+def _paragraphs(text):
+    """Tách văn bản thành các đoạn văn; mỗi đoạn văn là list các dòng không rỗng."""
+    paragraph = []
+    for line in text.split("\n"):
+        if line.strip():
+            paragraph.append(line)
+        elif paragraph:
+            yield paragraph
+            paragraph = []
+    if paragraph:
+        yield paragraph
+
+
+def _ends_sentence(word, next_word):
+    if not SENTENCE_END.search(word):
+        return False
+    if not word.rstrip("\"'”’»)]").endswith("."):
+        return True  # ? ! … luôn kết thúc câu
+    stem = word.rstrip("\"'”’»)]").rstrip(".").lower()
+    if stem in ABBREVIATIONS or (len(stem) == 1 and stem.isalpha()):
+        return False
+    return next_word is None or not next_word[0].islower()
+
+
+def _sentences(lines):
+    """Sinh các câu của một đoạn văn; mỗi câu là list các vế (chuỗi)."""
+    for line in lines:
+        words = line.split()
+        sentence, clause = [], []
+        for i, word in enumerate(words):
+            clause.append(word)
+            next_word = words[i + 1] if i + 1 < len(words) else None
+            if _ends_sentence(word, next_word):
+                sentence.append(" ".join(clause))
+                yield sentence
+                sentence, clause = [], []
+            elif CLAUSE_END.search(word) or word in DASHES:
+                sentence.append(" ".join(clause))
+                clause = []
+        if clause:
+            sentence.append(" ".join(clause))
+        if sentence:
+            yield sentence
+
+
+def _fit(clause, max_length):
+    """Vế <= max_length giữ nguyên; dài hơn thì cắt giữa các từ, từ quá dài thì cắt cứng."""
+    if len(clause) <= max_length:
+        return [clause]
+    pieces, current = [], ""
+    for word in clause.split(" "):
+        while len(word) > max_length:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(word[:max_length])
+            word = word[max_length:]
+        if not word:
+            continue
+        if current and len(current) + 1 + len(word) > max_length:
+            pieces.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _greedy(lengths, cap):
+    """Chỉ số bắt đầu của từng đoạn khi gom tham lam các mẩu (nối bằng một dấu cách) với giới hạn cap."""
+    starts = [0]
+    size = lengths[0]
+    for i in range(1, len(lengths)):
+        if size + 1 + lengths[i] > cap:
+            starts.append(i)
+            size = lengths[i]
+        else:
+            size += 1 + lengths[i]
+    return starts
+
+
+def _pack(units, max_length):
+    """Gom các mẩu (đều <= max_length) thành ít đoạn nhất, rồi cân bằng độ dài các đoạn."""
+    if not units:
+        return []
+    lengths = [len(unit) for unit in units]
+    count = len(_greedy(lengths, max_length))
+    low, high = max(lengths), max_length
+    while low < high:  # Giới hạn nhỏ nhất mà gom tham lam vẫn ra đúng `count` đoạn
+        mid = (low + high) // 2
+        if len(_greedy(lengths, mid)) <= count:
+            high = mid
+        else:
+            low = mid + 1
+    starts = _greedy(lengths, low) + [len(units)]
+    return [" ".join(units[starts[i]:starts[i + 1]]) for i in range(len(starts) - 1)]
+
+
+def split_text(text, max_length=500, keep_paragraphs=True):
+    """
+    Chia văn bản thành list các đoạn <= max_length ký tự, ít đoạn nhất và dài xấp xỉ nhau.
+    keep_paragraphs=True: các đoạn văn cách nhau bởi dòng trống được ngăn bằng PARAGRAPH_BREAK
+    (không có ngắt ở đầu, cuối hay hai ngắt liền nhau); False: không có PARAGRAPH_BREAK.
+    """
+    text = unicodedata.normalize("NFC", text or "")
+    paragraphs = list(_paragraphs(text))
+    if not keep_paragraphs:
+        paragraphs = [[line for lines in paragraphs for line in lines]] if paragraphs else []
+    chunks = []
+    for lines in paragraphs:
+        units = [piece for sentence in _sentences(lines) for clause in sentence for piece in _fit(clause, max_length)]
+        if chunks:
+            chunks.append(PARAGRAPH_BREAK)
+        chunks.extend(_pack(units, max_length))
+    return chunks
+
+
+def split_sentences(text, max_length=500):
+    """
+    Chia văn bản thành từng câu (không có PARAGRAPH_BREAK), dùng khi mỗi câu được cache riêng.
+    Câu dài hơn max_length được chia ở ranh giới vế thành các phần dài xấp xỉ nhau.
+    """
+    text = unicodedata.normalize("NFC", text or "")
+    segments = []
+    for lines in _paragraphs(text):
+        for sentence in _sentences(lines):
+            units = [piece for clause in sentence for piece in _fit(clause, max_length)]
+            segments.extend(_pack(units, max_length))
+    return segments
+
+
+def _content_boundary(sentence, target_length):
+    """Có kết thúc đoạn sau câu này không: chỉ phụ thuộc nội dung câu, xác suất ~ độ dài câu / target_length."""
+    digest = hashlib.blake2b(sentence.encode("utf-8"), digest_size=4).digest()
+    return int.from_bytes(digest, "big") % 10000 < 10000 * len(sentence) / target_length
+
+
+def split_stable(text, max_length=500):
+    """
+    Gom nguyên câu thành các đoạn <= max_length, ranh giới đặt theo nội dung từng câu
+    (content-defined chunking) thay vì cân bằng cả văn bản như split_text.
+    Sửa một câu chỉ đổi đoạn chứa nó (và hiếm khi đoạn kế tiếp khi phải cắt vì quá dài),
+    nên cache theo đoạn vẫn trúng với phần còn lại của bài giảng.
+    """
+    chunks, current = [], ""
+    for sentence in split_sentences(text, max_length):
+        if current and len(current) + 1 + len(sentence) > max_length:
+            chunks.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+        if _content_boundary(sentence, max_length * STABLE_TARGET):
+            chunks.append(current)
+            current = ""
+    if current:
+        chunks.append(current)
+    return chunks
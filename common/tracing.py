@@ -0,0 +1,255 @@
+"""
+Ghi span (tên bước, nhà cung cấp, slide, đoạn, số byte, số lần thử lại, thời gian) ra file JSONL.
+
+- Bật bằng biến môi trường TRACE_FILE=trace.jsonl; không đặt thì span() không ghi gì.
+- TRACE_ID (tùy chọn) gộp nhiều script chạy nối tiếp vào cùng một trace.
+- Span con tự nhận slide/job/chunk của span cha, nên chỉ cần gắn slide ở vòng lặp ngoài.
+
+Xem báo cáo: python -m common.tracing report trace.jsonl [--trace ID] [--width 60]
+"""
+import argparse
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+INHERITED_ATTRS = ("slide", "job", "chunk")
+
+_current = contextvars.ContextVar("trace_span", default=None)
+_write_lock = threading.Lock()
+_file = None
+_file_path = None
+_PROCESS_TRACE_ID = uuid.uuid4().hex[:16]  # Mặc định mọi span của một lần chạy thuộc cùng trace
+
+
+class Span:
+    def __init__(self, name, attrs, parent):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else (os.getenv("TRACE_ID") or _PROCESS_TRACE_ID)
+        self.attrs = {key: parent.attrs[key] for key in INHERITED_ATTRS if parent and key in parent.attrs}
+        self.attrs.update(attrs)
+        self.status = "ok"
+        self.error = None
+        self.start = time.time()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, key, amount=1):
+        self.attrs[key] = self.attrs.get(key, 0) + amount
+
+    def fail(self, error):
+        """Đánh dấu lỗi cho các hàm báo lỗi bằng giá trị trả về thay vì ném exception."""
+        self.status = "error"
+        self.error = str(error)[:500]
+
+    def record_response(self, response):
+        """Gắn mã HTTP, số byte và số lần urllib3 đã thử lại từ một requests.Response."""
+        self.attrs["http_status"] = response.status_code
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit():
+            self.add("bytes", int(length))
+        retries = getattr(getattr(response, "raw", None), "retries", None)
+        history = getattr(retries, "history", None)
+        if history:
+            self.add("retries", len(history))
+
+    def to_dict(self, end):
+        record = {
+            "trace": self.trace_id, "span": self.span_id, "parent": self.parent_id,
+            "name": self.name, "start": round(self.start, 6), "duration": round(end - self.start, 6),
+            "status": self.status, "pid": os.getpid(), "thread": threading.current_thread().name,
+        }
+        if self.error:
+            record["error"] = self.error
+        for key, value in self.attrs.items():
+            record.setdefault(key, value)  # Thuộc tính không được ghi đè các trường chuẩn
+        return record
+
+
+class _NoopSpan:
+    def set(self, **attrs): pass
+    def add(self, key, amount=1): pass
+    def fail(self, error): pass
+    def record_response(self, response): pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def enabled():
+    return bool(os.getenv("TRACE_FILE"))
+
+
+@contextmanager
+def span(name, **attrs):
+    """Đo một bước; exception được ghi vào span rồi ném tiếp."""
+    if not enabled():
+        yield NOOP_SPAN
+        return
+    current = Span(name, attrs, _current.get())
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.fail(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current.reset(token)
+        _write(current.to_dict(time.time()))
+
+
+def current_span():
+    return _current.get() or NOOP_SPAN
+
+
+def _write(record):
+    global _file, _file_path
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    path = os.getenv("TRACE_FILE")
+    with _write_lock:
+        if _file is None or _file_path != path:
+            if _file:
+                _file.close()
+            _file = open(path, "a", encoding="utf-8")
+            _file_path = path
+        _file.write(line)  # Mỗi dòng ghi một lần với O_APPEND nên nhiều process ghi chung được
+        _file.flush()
+
+
+# === Báo cáo ===
+
+def load_spans(path, trace_id=None):
+    spans = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if trace_id is None or record.get("trace") == trace_id:
+                record["end"] = record["start"] + record["duration"]
+                spans.append(record)
+    return spans
+
+
+def category(record):
+    """Nhóm để cộng dồn trên đường găng: nhà cung cấp nếu có, không thì tên bước."""
+    return record.get("provider") or record["name"]
+
+
+def critical_path(spans):
+    """
+    Trả về danh sách (category, giây) nằm trên đường găng.
+    Từ cuối span cha đi ngược về đầu: mỗi lần chọn span con kết thúc muộn nhất trước con trỏ,
+    khoảng trống giữa các span con tính cho chính span cha (chờ, sleep, xử lý nội bộ).
+    Các span gốc (không có cha trong file) được coi là con của một gốc ảo.
+    """
+    ids = {s["span"] for s in spans}
+    children = {}
+    for s in spans:
+        parent = s.get("parent") if s.get("parent") in ids else None
+        children.setdefault(parent, []).append(s)
+    for kids in children.values():
+        kids.sort(key=lambda s: s["end"], reverse=True)
+
+    segments = []
+
+    def walk(span_id, label, start, end):
+        cursor = end
+        for child in children.get(span_id, []):
+            if child["end"] <= cursor + 1e-6 and child["start"] >= start - 1e-6:
+                if cursor - child["end"] > 0:
+                    segments.append((label, cursor - child["end"]))
+                walk(child["span"], category(child), child["start"], child["end"])
+                cursor = child["start"]
+        if cursor - start > 0:
+            segments.append((label, cursor - start))
+
+    if spans:
+        walk(None, "(ngoài span)", min(s["start"] for s in spans), max(s["end"] for s in spans))
+    return segments
+
+
+def print_waterfall(spans, width=60):
+    origin = min(s["start"] for s in spans)
+    total = max(s["end"] for s in spans) - origin or 1.0
+    scale = width / total
+    by_slide = {}
+    for s in spans:
+        if s.get("slide") is not None:
+            by_slide.setdefault(s["slide"], []).append(s)
+    print(f"Tổng thời gian: {total:.1f}s, mỗi ký tự ≈ {total / width:.2f}s\n")
+    for slide in sorted(by_slide, key=lambda v: (str(type(v)), v)):
+        rows = sorted(by_slide[slide], key=lambda s: s["start"])
+        slide_start = min(s["start"] for s in rows) - origin
+        slide_end = max(s["end"] for s in rows) - origin
+        print(f"── Slide {slide}: {slide_start:.1f}s → {slide_end:.1f}s ({slide_end - slide_start:.1f}s)")
+        for s in rows:
+            offset = int((s["start"] - origin) * scale)
+            length = max(1, int(s["duration"] * scale))
+            bar = " " * offset + ("█" if s["status"] == "ok" else "▒") * length
+            label = s["name"] + (f"#{s['chunk']}" if s.get("chunk") is not None else "")
+            extra = []
+            if s.get("bytes"):
+                extra.append(f"{s['bytes'] / 1024:.0f}KB")
+            if s.get("retries"):
+                extra.append(f"{s['retries']} retry")
+            if s.get("polls"):
+                extra.append(f"{s['polls']} poll")
+            print(f"  {label[:22]:<22} {bar:<{width}} {s['duration']:>7.2f}s {' '.join(extra)}")
+        print()
+
+
+def print_summary(spans):
+    segments = critical_path(spans)
+    on_path = {}
+    for label, seconds in segments:
+        on_path[label] = on_path.get(label, 0.0) + seconds
+    busy = {}
+    for s in spans:
+        busy[category(s)] = busy.get(category(s), 0.0) + s["duration"]
+    total = sum(on_path.values()) or 1.0
+    print("Đường găng (bước quyết định tổng thời gian):")
+    print(f"  {'Nhóm':<24} {'Trên đường găng':>16} {'%':>6} {'Tổng thời gian span':>20}")
+    for label, seconds in sorted(on_path.items(), key=lambda item: item[1], reverse=True):
+        print(f"  {label:<24} {seconds:>15.1f}s {seconds / total * 100:>5.1f}% {busy.get(label, 0.0):>19.1f}s")
+    errors = [s for s in spans if s["status"] != "ok"]
+    retries = sum(s.get("retries", 0) for s in spans)
+    print(f"\nSố span: {len(spans)}, lỗi: {len(errors)}, lần thử lại HTTP: {retries}")
+
+
+def report(path, trace_id=None, width=60):
+    spans = load_spans(path, trace_id)
+    if not spans:
+        print("Không có span nào.")
+        return
+    traces = sorted({s["trace"] for s in spans})
+    print(f"📈 {path}: {len(spans)} span, {len(traces)} trace\n")
+    print_waterfall(spans, width)
+    print_summary(spans)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Báo cáo trace JSONL")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report_parser = sub.add_parser("report", help="Waterfall theo slide và tóm tắt đường găng")
+    report_parser.add_argument("path")
+    report_parser.add_argument("--trace", help="Chỉ xem một trace")
+    report_parser.add_argument("--width", type=int, default=60)
+    args = parser.parse_args(argv)
+    if args.command == "report":
+        report(args.path, args.trace, args.width)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""
+Transport HTTP dùng chung cho mọi client gọi nhà cung cấp (AusyncLab, FPT, Gemini, D-ID, HeyGen).
+- Một session giữ kết nối (keep-alive) theo từng host, không bắt tay TCP/TLS lại mỗi request.
+- Timeout kết nối/đọc thống nhất: HTTP_CONNECT_TIMEOUT (mặc định 5s), HTTP_READ_TIMEOUT (90s).
+- Số kết nối giữ lại mỗi host: HTTP_POOL_MAXSIZE (mặc định 16), đủ cho số luồng song song của pipeline.
+- Retry của urllib3 (429/5xx, lỗi kết nối) bị giới hạn bởi ngân sách thử lại theo host:
+  trong cửa sổ `window` giây, số lần thử lại không vượt min_retries + ratio × số request,
+  nên khi nhà cung cấp sập, các luồng không nhân số request lên gấp (total + 1) lần.
+"""
+import os
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, ResponseError
+from urllib3.util.retry import Retry
+
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "90"))
+DEFAULT_TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "16"))
+POOL_HOSTS = 20  # Số host giữ pool cùng lúc (API + CDN trả file)
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class RetryBudget:
+    """Đếm request và lần thử lại theo host trong một cửa sổ thời gian trượt."""
+
+    def __init__(self, ratio=0.2, min_retries=10, window=10.0):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self.exhausted = 0
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, host, now):
+        requests_, retries = self._hosts.setdefault(host, (deque(), deque()))
+        for times in (requests_, retries):
+            while times and times[0] < now - self.window:
+                times.popleft()
+        return requests_, retries
+
+    def record_request(self, host):
+        now = time.monotonic()
+        with self._lock:
+            self._host(host, now)[0].append(now)
+
+    def try_retry(self, host):
+        """True nếu còn ngân sách (và trừ một lần), False nếu phải bỏ cuộc ngay."""
+        now = time.monotonic()
+        with self._lock:
+            requests_, retries = self._host(host, now)
+            if len(retries) >= self.min_retries + self.ratio * len(requests_):
+                self.exhausted += 1
+                return False
+            retries.append(now)
+            return True
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            hosts = {}
+            for host in list(self._hosts):
+                requests_, retries = self._host(host, now)
+                hosts[host] = {"requests": len(requests_), "retries": len(retries)}
+            return {"exhausted": self.exhausted, "hosts": hosts}
+
+
+class BudgetRetry(Retry):
+    """Retry của urllib3 có kiểm tra ngân sách trước mỗi lần thử lại."""
+
+    def __init__(self, *args, budget=None, on_retry=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.budget = budget
+        self.on_retry = on_retry
+
+    def new(self, **kwargs):
+        retry = super().new(**kwargs)
+        retry.budget = self.budget
+        retry.on_retry = self.on_retry
+        return retry
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        host = getattr(_pool, "host", None)
+        if self.budget is not None and not self.budget.try_retry(host):
+            raise MaxRetryError(_pool, url, error or ResponseError(f"hết ngân sách thử lại cho {host}"))
+        if self.on_retry:
+            self.on_retry()
+        return retry
+
+
+class BudgetAdapter(HTTPAdapter):
+    """HTTPAdapter ghi mỗi request gửi đi vào ngân sách thử lại của host."""
+
+    def __init__(self, budget, **kwargs):
+        self.budget = budget
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        self.budget.record_request(urlparse(request.url).hostname)
+        return super().send(request, **kwargs)
+
+
+class PooledSession(requests.Session):
+    """Session có timeout mặc định; truyền timeout=... khi một request cần giá trị khác."""
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def create_session(pool_maxsize=POOL_MAXSIZE, total_retries=5, backoff_factor=1,
+                   budget=None, on_retry=None, timeout=DEFAULT_TIMEOUT):
+    """Tạo session riêng (web app cần pool lớn hơn và đếm retry cho /metrics)."""
+    budget = budget or RetryBudget()
+    retries = BudgetRetry(total=total_retries, backoff_factor=backoff_factor,
+                          status_forcelist=RETRY_STATUS, budget=budget, on_retry=on_retry)
+    adapter = BudgetAdapter(budget, max_retries=retries, pool_connections=POOL_HOSTS, pool_maxsize=pool_maxsize)
+    session = PooledSession(timeout)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)  # Khi <PROVIDER>_BASE_URL trỏ tới provider_sim
+    session.retry_budget = budget
+    return session
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_session():
+    """Session dùng chung cho cả process, tạo lần đầu khi được gọi."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = create_session()
+        return _shared
@@ -0,0 +1,159 @@
+import hashlib
+import os
+import shutil
+import threading
+import unicodedata
+import uuid
+
+
+DEFAULT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def normalize_text(text):
+    """Chuẩn hóa văn bản trước khi băm: Unicode NFC và gộp khoảng trắng."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class SynthesisCache:
+    """
+    Cache audio đã tổng hợp, lưu trên đĩa và định danh theo nội dung.
+    - Khóa là SHA-256 của (văn bản đã chuẩn hóa, voice_id, model_name, speed, language).
+    - Giới hạn tổng dung lượng, khi vượt sẽ xóa các file ít được dùng gần đây nhất (theo mtime).
+    - Nhiều process có thể dùng chung một thư mục cache: ghi file qua tên tạm rồi os.replace.
+    """
+
+    def __init__(self, folder, max_bytes=2 * 1024 ** 3, extension=".wav"):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._entries())
+
+    @staticmethod
+    def make_key(text, voice_id, model_name, speed, language):
+        raw = "\x1f".join([normalize_text(text), str(voice_id), str(model_name), f"{float(speed):g}", str(language)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.folder, f"{key}{self.extension}")
+
+    def get(self, key):
+        """Trả về đường dẫn file audio trong cache, hoặc None nếu chưa có."""
+        path = self.path_for(key)
+        try:
+            os.utime(path)  # Đánh dấu vừa được dùng cho LRU
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def copy_to(self, key, dest_path):
+        """Chép audio trong cache ra dest_path. Trả về True nếu cache hit."""
+        path = self.get(key)
+        if not path:
+            return False
+        try:
+            shutil.copyfile(path, dest_path)
+            return True
+        except OSError:
+            return False  # File vừa bị process khác xóa
+
+    def put(self, key, src_path):
+        """Lưu một bản sao của src_path vào cache."""
+        return self._store(key, lambda tmp_path: shutil.copyfile(src_path, tmp_path))
+
+    def put_bytes(self, key, data):
+        """Lưu nội dung audio (bytes) vào cache."""
+        def write(tmp_path):
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+        return self._store(key, write)
+
+    def remove(self, key):
+        """Bỏ một mục khỏi cache (vd file hỏng, không giải mã được) để lần sau tạo lại."""
+        path = self.path_for(key)
+        with self._lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                return False
+            self._total_bytes = max(0, self._total_bytes - size)
+        return True
+
+    def _store(self, key, write):
+        path = self.path_for(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            write(tmp_path)
+            new_size = os.path.getsize(tmp_path)
+            with self._lock:
+                # Hai job cùng tạo một đoạn: file cũ bị ghi đè, không được cộng dung lượng hai lần
+                try:
+                    old_size = os.path.getsize(path)
+                except OSError:
+                    old_size = 0
+                os.replace(tmp_path, path)
+                self._total_bytes += new_size - old_size
+        except OSError:
+            try: os.remove(tmp_path)
+            except OSError: pass
+            return None
+        with self._lock:
+            over_budget = self._total_bytes > self.max_bytes
+        if over_budget:
+            self._evict()
+        return path
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.folder):
+            if not name.endswith(self.extension):
+                continue
+            try:
+                st = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                continue
+            entries.append((name, st.st_size, st.st_mtime))
+        return entries
+
+    def _evict(self):
+        """Xóa các file cũ nhất cho đến khi dưới 90% dung lượng cho phép."""
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda e: e[2])
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * 0.9
+            for name, size, _ in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(os.path.join(self.folder, name))
+                    total -= size
+                except OSError:
+                    pass
+            self._total_bytes = total
+
+
+def cache_from_env():
+    """
+    Tạo cache theo biến môi trường TTS_CACHE_DIR và TTS_CACHE_MAX_MB.
+    Mặc định là tts_cache ở thư mục gốc repo, để web app và script chạy từ thư mục khác nhau vẫn dùng chung.
+    """
+    folder = os.getenv("TTS_CACHE_DIR") or os.path.join(DEFAULT_ROOT, "tts_cache")
+    max_mb = int(os.getenv("TTS_CACHE_MAX_MB", "2048"))
+    return SynthesisCache(folder, max_bytes=max_mb * 1024 * 1024)
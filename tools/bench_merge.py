@@ -0,0 +1,144 @@
+"""
+Đo thời gian và bộ nhớ đỉnh khi ghép audio bài giảng theo độ dài bài giảng.
+
+Chạy: python tools/bench_merge.py [--minutes 5 15 30 60] [--segment-seconds 20] [--repeat 1]
+
+- Tạo các đoạn WAV giả (24 kHz stereo 16 bit như đầu ra của AusyncLab) bằng module wave.
+- Mỗi cách ghép chạy trong một process con riêng, process con tự báo thời gian và RSS đỉnh
+  (của chính nó cộng ffmpeg nó gọi), nên các lần đo không ảnh hưởng nhau.
+- Các cách ghép:
+  - legacy: nối bytes `data = data + đoạn` như `combined += segment` của pydub (bậc hai, giữ cả bài trong RAM);
+  - pydub: AudioSegment += rồi export WAV (chỉ khi cài pydub);
+  - stream-wav: common/audio_stream.StreamingEncoder ghi WAV, không cần ffmpeg;
+  - stream-mp3: StreamingEncoder qua ffmpeg (chỉ khi có ffmpeg).
+"""
+import argparse
+import importlib.util
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+from common.audio_stream import FFMPEG, StreamingEncoder
+
+FRAME_RATE = 24000
+CHANNELS = 2
+SAMPLE_WIDTH = 2
+
+
+def make_segment(path, seconds):
+    """Một đoạn WAV có tín hiệu (không phải toàn số 0) để encoder làm việc thật."""
+    frames = FRAME_RATE * seconds
+    pattern = bytes(range(256)) * (FRAME_RATE * CHANNELS * SAMPLE_WIDTH // 256)
+    with wave.open(path, "wb") as output:
+        output.setnchannels(CHANNELS)
+        output.setsampwidth(SAMPLE_WIDTH)
+        output.setframerate(FRAME_RATE)
+        for _ in range(frames // FRAME_RATE):
+            output.writeframes(pattern)
+
+
+def merge_legacy(paths, output_path):
+    data = b""
+    for path in paths:
+        with wave.open(path, "rb") as source:
+            data = data + source.readframes(source.getnframes())
+    with wave.open(output_path, "wb") as output:
+        output.setnchannels(CHANNELS)
+        output.setsampwidth(SAMPLE_WIDTH)
+        output.setframerate(FRAME_RATE)
+        output.writeframes(data)
+
+
+def merge_pydub(paths, output_path):
+    from pydub import AudioSegment
+    combined = AudioSegment.empty()
+    for path in paths:
+        combined += AudioSegment.from_wav(path)
+    combined.export(output_path, format="wav")
+
+
+def merge_stream(paths, output_path):
+    with StreamingEncoder(output_path, FRAME_RATE, CHANNELS) as encoder:
+        for path in paths:
+            encoder.write_file(path)
+
+
+VARIANTS = {
+    "legacy": (merge_legacy, "wav"),
+    "pydub": (merge_pydub, "wav"),
+    "stream-wav": (merge_stream, "wav"),
+    "stream-mp3": (merge_stream, "mp3"),
+}
+
+
+def child(variant, segment, count, workdir):
+    merge, extension = VARIANTS[variant]
+    output_path = os.path.join(workdir, f"{variant}.{extension}")
+    start = time.perf_counter()
+    merge([segment] * count, output_path)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss tính bằng KB trên Linux
+    rss_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                 resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    size = os.path.getsize(output_path)
+    os.remove(output_path)
+    print(json.dumps({"seconds": elapsed, "rss_mb": rss_kb / 1024, "bytes": size}))
+
+
+def available_variants():
+    variants = ["legacy"]
+    if importlib.util.find_spec("pydub"):
+        variants.append("pydub")
+    else:
+        print("⚠️ Không có pydub: bỏ qua cách pydub")
+    variants.append("stream-wav")
+    if shutil.which(FFMPEG):
+        variants.append("stream-mp3")
+    else:
+        print(f"⚠️ Không tìm thấy {FFMPEG}: bỏ qua stream-mp3")
+    return variants
+
+
+def run(minutes_list, segment_seconds, repeat):
+    variants = available_variants()
+    with tempfile.TemporaryDirectory() as workdir:
+        segment = os.path.join(workdir, "segment.wav")
+        make_segment(segment, segment_seconds)
+        print(f"\n{'Bài giảng':>10} {'Số đoạn':>8} {'Cách ghép':<11} {'Thời gian':>10} {'RSS đỉnh':>10} {'File':>9}")
+        for minutes in minutes_list:
+            count = max(1, minutes * 60 // segment_seconds)
+            for variant in variants:
+                best = None
+                for _ in range(repeat):
+                    result = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), "--child", variant, segment, str(count), workdir],
+                        capture_output=True, text=True)
+                    if result.returncode != 0:
+                        print(f"❌ {variant} {minutes} phút: {result.stderr.strip()[-300:]}")
+                        break
+                    measured = json.loads(result.stdout.strip().splitlines()[-1])
+                    if best is None or measured["seconds"] < best["seconds"]:
+                        best = measured
+                if best:
+                    print(f"{minutes:>6} phút {count:>8} {variant:<11} {best['seconds']:>9.2f}s "
+                          f"{best['rss_mb']:>7.1f} MB {best['bytes'] / 1e6:>6.1f} MB")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 6 and sys.argv[1] == "--child":
+        child(sys.argv[2], sys.argv[3], int(sys.argv[4]), sys.argv[5])
+        sys.exit(0)
+    parser = argparse.ArgumentParser(description="Benchmark ghép audio bài giảng")
+    parser.add_argument("--minutes", type=int, nargs="+", default=[5, 15, 30, 60])
+    parser.add_argument("--segment-seconds", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+    run(args.minutes, args.segment_seconds, args.repeat)
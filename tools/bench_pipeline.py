@@ -0,0 +1,303 @@
+"""
+Đo hiệu năng toàn bộ pipeline Word → lời giảng → audio → storyboard → video avatar
+trên giả lập nhà cung cấp (tools/provider_sim.py), không tốn quota API thật.
+
+Chạy: python tools/bench_pipeline.py [--lectures 2] [--slides 5] [--avatar did|heygen|none]
+                                     [--time-scale 0.1] [--sim-url http://127.0.0.1:8765]
+                                     [--docx bai_giang.docx] [--output ket_qua.json]
+                                     [--trace trace.jsonl] [--keys 3]
+
+- Gọi đúng các hàm của script trong Test_BaiGiangSo (generate_lectures, generate_audios_from_json,
+  generateStoryboard, process_storyboard / batch_create_videos), kể cả bộ giới hạn tốc độ
+  (common/rate_limiter.py, hạn mức co theo time_scale), nên kết quả phản ánh pipeline đang chạy thật.
+- Không có --sim-url thì tự khởi động giả lập trong process này.
+- Bước ghép video với slide (moviepy) không chạy vì video giả lập không có hình.
+- Báo cáo: số bài giảng/giờ, p50/p99 từng bước, số request theo nhà cung cấp và mã trạng thái.
+- --keys N cấp N key giả cho mỗi nhà cung cấp (đặt key_rpm trong --sim-config để thấy tác dụng).
+- --trace ghi span của mọi bước ra JSONL; xem bằng python -m common.tracing report trace.jsonl
+"""
+import argparse
+import functools
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+sys.path.insert(0, ROOT)
+import provider_sim
+from common.rate_limiter import DEFAULT_RPM
+
+PROVIDERS = ("ausync", "fpt", "gemini", "d_id", "heygen", "heygen_upload", "cloudinary")
+
+
+class StageTimer:
+    """Ghi thời gian từng lần gọi theo tên bước."""
+
+    def __init__(self):
+        self.samples = {}
+        self.failures = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds, ok=True):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+            if not ok:
+                self.failures[stage] = self.failures.get(stage, 0) + 1
+
+    def wrap(self, owner, name, stage):
+        """Thay owner.name bằng bản có đo thời gian; script gọi qua tên toàn cục nên vẫn đi qua bản này."""
+        original = getattr(owner, name)
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            ok = False
+            try:
+                result = original(*args, **kwargs)
+                ok = result not in (None, False)
+                return result
+            finally:
+                self.record(stage, time.perf_counter() - start, ok)
+
+        setattr(owner, name, timed)
+
+    def measure(self, stage):
+        timer = self
+
+        class _Measure:
+            def __enter__(self):
+                self.start = time.perf_counter()
+
+            def __exit__(self, exc_type, exc, tb):
+                timer.record(stage, time.perf_counter() - self.start, exc_type is None)
+
+        return _Measure()
+
+
+def percentile(values, pct):
+    """Phân vị theo nearest-rank."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def prepare_environment(sim_url, workdir, warm_cache, keys=1, time_scale=None):
+    """Trỏ mọi script sang giả lập và cô lập file trạng thái/cache trong workdir."""
+    for provider in PROVIDERS:
+        os.environ[f"{provider.upper()}_BASE_URL"] = sim_url
+    for key in ("AUSYNC_API_KEY", "GEMINI_API_KEY", "D_ID_API_KEY", "HEYGEN_API_KEY"):
+        os.environ[f"{key}S"] = ",".join(f"sim-{key.split('_')[0].lower()}-{n:04d}" for n in range(1, keys + 1))
+    for key in ("CLOUDINARY_API_KEY", "CLOUDINARY_API_SECRET"):
+        os.environ[key] = "sim"
+    os.environ["CLOUDINARY_CLOUD_NAME"] = "sim"
+    os.environ.setdefault("VOICE_ID", "311890")
+    # Hạn mức tốc độ riêng cho lần đo, nhanh lên theo time_scale giống độ trễ của giả lập
+    os.environ["RATE_LIMIT_DB"] = os.path.join(workdir, "rate_limits.sqlite")
+    for provider, rpm in DEFAULT_RPM.items():
+        os.environ.setdefault(f"{provider.upper()}_RPM", str(rpm / (time_scale or 1.0)))
+    if not warm_cache:
+        os.environ["TTS_CACHE_DIR"] = os.path.join(workdir, "tts_cache")
+    # File trạng thái health dùng chung nằm trong thư mục tạm: không ghi đè trạng thái thật
+    tempfile.tempdir = workdir
+    sys.path.insert(0, os.path.join(ROOT, "Test_BaiGiangSo"))
+
+
+def load_slides(docx_path, slides, rng):
+    if docx_path:
+        import generate_lectures_from_word as lectures
+        return lectures.extract_slide_contents(docx_path)
+    return [
+        {"title": f"Slide {i}: Phép cộng trong phạm vi {i + 4}",
+         "content": provider_sim.synthetic_lecture(rng, rng.randint(300, 900))}
+        for i in range(1, slides + 1)
+    ]
+
+
+def write_photo(path):
+    """Ảnh JPEG giả (chỉ cần header hợp lệ và dung lượng giống ảnh thật)."""
+    with open(path, "wb") as f:
+        f.write(b"\xff\xd8\xff\xe0\x00\x10JFIF\x00" + os.urandom(200 * 1024) + b"\xff\xd9")
+    return path
+
+
+def run_lecture(n, slides_data, avatar, timer, workdir):
+    """Chạy một bài giảng qua mọi bước, trong thư mục riêng vì các script ghi file tương đối."""
+    import generate_lectures_from_word as lectures
+    import generate_audio_from_ausync as audio
+    import generateStoryBoard as storyboard
+
+    lecture_dir = os.path.join(workdir, f"lecture_{n}")
+    os.makedirs(lecture_dir, exist_ok=True)
+    os.chdir(lecture_dir)
+    slides_json = "slides_with_text.json"
+    if os.getenv("TRACE_FILE"):
+        # Mỗi bài giảng một trace để waterfall theo slide không trộn các bài với nhau
+        os.environ["TRACE_ID"] = f"{os.path.basename(workdir)}-{n}"
+
+    with timer.measure("lecture_total"):
+        with timer.measure("lecture_text"):
+            result = lectures.generate_lectures(slides_data)
+            with open(slides_json, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+
+        with timer.measure("audio"):
+            audio.generate_audios_from_json(slides_json, "audios")
+
+        with timer.measure("storyboard"):
+            storyboard.generateStoryboard(slides_json, "storyboard.json", "storyboard.csv")
+
+        if avatar != "none":
+            photo = write_photo(os.path.join(lecture_dir, "avatar.jpg"))
+            with timer.measure("avatar"):
+                if avatar == "did":
+                    import generate_did_video as did
+                    did.process_storyboard(photo, limit=len(slides_data))
+                else:
+                    import generate_heygen_video as heygen
+                    heygen.HeyGenTalkingPhotoClient().batch_create_videos(photo, "audios", "videos")
+
+
+def instrument(timer, avatar):
+    import generate_lectures_from_word as lectures
+    import generate_audio_from_ausync as audio
+    import generateStoryBoard as storyboard
+
+    timer.wrap(lectures, "generate_lecture", "gemini_lecture")
+    timer.wrap(audio, "synthesize_segment", "tts_segment")
+    timer.wrap(audio, "merge_audio_files", "audio_merge")
+    timer.wrap(storyboard, "generate_storyboard_elements_with_ai", "gemini_storyboard")
+    if avatar == "did":
+        import generate_did_video as did
+        timer.wrap(did, "upload_media_to_cloudinary", "cloudinary_upload")
+        timer.wrap(did, "generate_did_video", "did_submit")
+        timer.wrap(did, "get_talk_status", "did_render")
+        timer.wrap(did, "download_video_from_url", "video_download")
+    elif avatar == "heygen":
+        import generate_heygen_video as heygen
+        client = heygen.HeyGenTalkingPhotoClient
+        timer.wrap(client, "upload_local_file", "heygen_upload")
+        timer.wrap(client, "create_video_with_talking_photo", "heygen_submit")
+        timer.wrap(client, "wait_and_get_video_url", "heygen_render")
+        timer.wrap(client, "download_video", "video_download")
+
+
+def fetch_json(url, data=None):
+    request = urllib.request.Request(url, data=data, method="POST" if data is not None else "GET")
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def print_report(report):
+    print("\n" + "=" * 72)
+    print(f"📊 {report['lectures']} bài giảng × {report['slides']} slide trong {report['elapsed']:.1f}s "
+          f"→ {report['lectures_per_hour']:.2f} bài giảng/giờ (time_scale={report['time_scale']})")
+    print("=" * 72)
+    print(f"{'Bước':<20} {'Số lần':>7} {'Lỗi':>5} {'p50 (s)':>9} {'p99 (s)':>9} {'Tổng (s)':>10}")
+    for stage, data in report["stages"].items():
+        print(f"{stage:<20} {data['count']:>7} {data['failures']:>5} {data['p50']:>9.2f} "
+              f"{data['p99']:>9.2f} {data['total']:>10.1f}")
+    print(f"\n{'Request':<36} {'Mã trạng thái':<30}")
+    for endpoint, by_status in sorted(report["requests"].items()):
+        statuses = ", ".join(f"{status}: {count}" for status, count in sorted(by_status.items()))
+        print(f"{endpoint:<36} {statuses:<30}")
+    print(f"Tổng số request: {report['total_requests']}")
+    if report.get("keys"):
+        print(f"\n{'API key':<36} {'Request tạo việc':>17} {'429 do hạn mức':>15}")
+        for label, counts in sorted(report["keys"].items()):
+            print(f"{label:<36} {counts['requests']:>17} {counts['throttled']:>15}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pipeline Word → video trên giả lập nhà cung cấp")
+    parser.add_argument("--lectures", type=int, default=1)
+    parser.add_argument("--slides", type=int, default=5, help="Số slide mỗi bài giảng (khi không dùng --docx)")
+    parser.add_argument("--docx", help="File Word thật để tách slide (cần python-docx)")
+    parser.add_argument("--avatar", choices=["did", "heygen", "none"], default="did")
+    parser.add_argument("--sim-url", help="Dùng giả lập đang chạy sẵn thay vì tự khởi động")
+    parser.add_argument("--sim-config", help="File JSON cấu hình giả lập (xem provider_sim.py)")
+    parser.add_argument("--time-scale", type=float, help="Nhân thời gian render/độ trễ của giả lập")
+    parser.add_argument("--warm-cache", action="store_true", help="Dùng cache TTS thật thay vì cache trống")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Ghi kết quả ra file JSON")
+    parser.add_argument("--keys", type=int, default=1, help="Số API key giả cho mỗi nhà cung cấp")
+    parser.add_argument("--trace", help="Ghi span từng bước ra file JSONL (common/tracing.py)")
+    args = parser.parse_args()
+    # Các bước chạy trong thư mục làm việc riêng nên đổi đường dẫn người dùng nhập thành tuyệt đối
+    args.output = os.path.abspath(args.output) if args.output else None
+    args.docx = os.path.abspath(args.docx) if args.docx else None
+    if args.trace:
+        os.environ["TRACE_FILE"] = os.path.abspath(args.trace)
+
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    if args.sim_url:
+        sim_url = args.sim_url.rstrip("/")
+        time_scale = args.time_scale
+    else:
+        config = provider_sim.load_config(args.sim_config, args.time_scale)
+        server = provider_sim.start_in_thread(config, seed=args.seed)
+        sim_url = server.sim.base_url
+        time_scale = config["time_scale"]
+        print(f"🧪 Đã khởi động giả lập tại {sim_url}")
+    fetch_json(f"{sim_url}/__sim/reset", data=b"")
+
+    prepare_environment(sim_url, workdir, args.warm_cache, args.keys, time_scale)
+    rng = random.Random(args.seed)
+    slides_data = load_slides(args.docx, args.slides, rng)
+    if not slides_data:
+        print("❌ Không có slide nào để chạy.")
+        return
+
+    timer = StageTimer()
+    instrument(timer, args.avatar)
+    print(f"📁 Thư mục làm việc: {workdir}")
+
+    start = time.perf_counter()
+    for n in range(1, args.lectures + 1):
+        print(f"\n{'#' * 20} 🎓 Bài giảng {n}/{args.lectures} {'#' * 20}")
+        run_lecture(n, slides_data, args.avatar, timer, workdir)
+    elapsed = time.perf_counter() - start
+
+    sim_stats = fetch_json(f"{sim_url}/__sim/stats")
+    requests_by_endpoint = sim_stats["requests"]
+    report = {
+        "lectures": args.lectures,
+        "slides": len(slides_data),
+        "avatar": args.avatar,
+        "keys_per_provider": args.keys,
+        "time_scale": time_scale,
+        "elapsed": elapsed,
+        "lectures_per_hour": args.lectures * 3600 / elapsed if elapsed else 0.0,
+        "stages": {
+            stage: {
+                "count": len(values),
+                "failures": timer.failures.get(stage, 0),
+                "p50": percentile(values, 50),
+                "p99": percentile(values, 99),
+                "total": sum(values),
+            }
+            for stage, values in timer.samples.items()
+        },
+        "requests": requests_by_endpoint,
+        "total_requests": sum(sum(s.values()) for s in requests_by_endpoint.values()),
+        "keys": sim_stats.get("keys", {}),
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 Đã lưu kết quả: {args.output}")
+    if args.trace:
+        print(f"🔎 Trace: python -m common.tracing report {os.environ['TRACE_FILE']} --trace {os.environ['TRACE_ID']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""
+Benchmark và kiểm tra tính chất của common/segmenter.py.
+
+Chạy: python tools/bench_segmenter.py [--corpus file.json|.txt|.docx ...] [--sizes-kb 100 1000 5000] [--cases 500]
+- Bước 1 kiểm tra ngẫu nhiên các tính chất: mọi đoạn <= max_length, không có đoạn chỉ chứa
+  khoảng trắng, không mất ký tự nào, không có ngắt đoạn thừa.
+- Bước 2 so sánh số request với bốn cách chia cũ trên bộ bài giảng của repo
+  (mặc định slides_with_text.json, input_text.txt và các file .docx), theo đúng giới hạn ký tự
+  của từng luồng: web app / AusyncLab 500, FPT 4000. Kèm số ký tự bị mất và độ lệch độ dài đoạn
+  (đoạn dài nhất / trung bình: càng gần 1 thì các đoạn render song song càng xong cùng lúc).
+- Bước 3 sửa từng câu (chèn một từ) và đếm số đoạn có nội dung mới, tức số đoạn phải render lại
+  vì trượt cache: split_stable (AUDIO_SEGMENT_MODE=packed) phải giữ con số này O(1) dù bài giảng dài bao nhiêu,
+  còn split_text cân bằng cả văn bản nên một câu có thể dời mọi ranh giới.
+- Bước 4 đo thời gian trên văn bản 100 KB - 5 MB; thời gian/MB gần như không đổi
+  nghĩa là thuật toán tuyến tính.
+"""
+import collections
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+import unicodedata
+import zipfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+from common.segmenter import PARAGRAPH_BREAK, split_sentences, split_stable, split_text
+
+MAX_CHAR_LIMIT = 500
+FPT_MAX_CHARS = 4000
+DEFAULT_CORPUS = [
+    os.path.join(ROOT, "Test_BaiGiangSo", "slides_with_text.json"),
+    os.path.join(ROOT, "Test_BaiGiangSo", "bai_giang_30_slide_day_du.docx"),
+    os.path.join(ROOT, "Test TTS", "input_text.txt"),
+    os.path.join(ROOT, "Test TTS", "bai_giang_dai.docx"),
+]
+
+WORDS = (
+    "các con ơi hôm nay chúng ta học phép cộng trong phạm vi mười một quả táo "
+    "thêm hai quả táo là ba quả táo nào mình cùng đếm nhé số bé số lớn hơn "
+    "bằng nhau phân số thập phân hình vuông hình tròn tam giác TP. ThS. v.v. 3.5"
+).split()
+
+
+# === Các cách chia cũ (giữ nguyên để so sánh) ===
+
+def legacy_app(text, max_length=MAX_CHAR_LIMIT, min_length=50):
+    """tts-web-app: gom tham lam theo từ, ngắt đoạn văn thành PARAGRAPH_BREAK."""
+    chunks = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        words = paragraph.split()
+        if not words:
+            continue
+        if chunks:
+            chunks.append(PARAGRAPH_BREAK)
+        current = ""
+        for word in words:
+            while len(word) > max_length:
+                if current:
+                    chunks.append(current)
+                    current = ""
+                chunks.append(word[:max_length])
+                word = word[max_length:]
+            if current and len(current) + 1 + len(word) > max_length:
+                chunks.append(current)
+                current = word
+            elif word:
+                current = f"{current} {word}" if current else word
+        if current:
+            chunks.append(current)
+    return chunks
+
+
+def legacy_ausync(text, max_length=MAX_CHAR_LIMIT):
+    """generate_audio_from_ausync.py: rfind theo dấu câu."""
+    if not text or not text.strip(): return []
+    text = text.strip()
+    if len(text) <= max_length: return [text]
+    parts = []
+    while len(text) > max_length:
+        cut_pos = -1
+        for delimiter in ['. ', '? ', '! ', ', ', ' ']:
+            pos = text.rfind(delimiter, 0, max_length)
+            if pos != -1:
+                cut_pos = pos + len(delimiter)
+                break
+        if cut_pos == -1: cut_pos = max_length
+        parts.append(text[:cut_pos].strip())
+        text = text[cut_pos:].strip()
+    if text: parts.append(text)
+    return [p for p in parts if p]
+
+
+def legacy_voice_clone(text, max_length=MAX_CHAR_LIMIT):
+    """asynce_voice_clone_400kytu.py: tách theo '. '."""
+    sentences = text.split(". ")
+    chunks = []
+    current_chunk = ""
+    for sentence in sentences:
+        sentence = sentence.strip() + ". " if sentence.strip() else ""
+        if len(current_chunk) + len(sentence) <= max_length:
+            current_chunk += sentence
+        else:
+            if current_chunk:
+                chunks.append(current_chunk.strip())
+            current_chunk = sentence
+    if current_chunk:
+        chunks.append(current_chunk.strip())
+    return chunks
+
+
+def legacy_fpt(text, max_length=FPT_MAX_CHARS):
+    """tts_docx_to_mp3.py: regex theo câu, làm mất câu cuối không có dấu chấm."""
+    text = re.sub(r'\s+', ' ', text).strip()
+    chunks = []
+    sentences = re.findall(r'.*?[.?!]', text)
+    current_chunk = ""
+    for sentence in sentences:
+        if len(current_chunk) + len(sentence) <= max_length:
+            current_chunk += sentence + " "
+        else:
+            chunks.append(current_chunk.strip())
+            current_chunk = sentence + " "
+    if current_chunk:
+        chunks.append(current_chunk.strip())
+    return chunks
+
+
+# (tên luồng, cách chia cũ, giới hạn, giữ ngắt đoạn văn, tiền xử lý văn bản giống script)
+PATHS = [
+    ("web app", legacy_app, MAX_CHAR_LIMIT, True, lambda text: text),
+    ("ausync (gom đoạn)", legacy_ausync, MAX_CHAR_LIMIT, False, str.strip),
+    ("voice clone", legacy_voice_clone, MAX_CHAR_LIMIT, False, str.strip),
+    ("fpt", legacy_fpt, FPT_MAX_CHARS, False, lambda text: re.sub(r'\s+', ' ', text).strip()),
+]
+
+
+# === Kiểm tra tính chất ===
+
+def _visible(text):
+    return "".join(unicodedata.normalize("NFC", text).split())
+
+
+def random_text(rng, target_chars, long_word_rate=0.001):
+    """Sinh văn bản tiếng Việt giả có câu, dòng mới, dòng trống, chữ tổ hợp (NFD) và vài từ rất dài."""
+    parts = []
+    size = 0
+    while size < target_chars:
+        roll = rng.random()
+        if roll < long_word_rate:
+            word = "x" * rng.randint(MAX_CHAR_LIMIT, MAX_CHAR_LIMIT * 3)
+        else:
+            word = rng.choice(WORDS)
+            if rng.random() < 0.1:
+                word += rng.choice([".", ",", "?", "!", "…", ";", ":", ".)", "!\""])
+            if rng.random() < 0.05:
+                word = unicodedata.normalize("NFD", word)
+        sep = rng.choices([" ", "  ", "\n", "\n\n", "\n \n\n", "\t", " – "], weights=[85, 3, 5, 4, 2, 1, 1])[0]
+        parts.append(word)
+        parts.append(sep)
+        size += len(word) + len(sep)
+    return "".join(parts)
+
+
+def check_properties(text, chunks, max_length, breaks=True):
+    for i, chunk in enumerate(chunks):
+        assert len(chunk) <= max_length, f"đoạn {i} dài {len(chunk)} > {max_length}"
+        if chunk == PARAGRAPH_BREAK:
+            assert breaks, f"ngắt đoạn không mong đợi ở vị trí {i}"
+            assert 0 < i < len(chunks) - 1, f"ngắt đoạn thừa ở vị trí {i}"
+            assert chunks[i - 1] != PARAGRAPH_BREAK, f"hai ngắt đoạn liền nhau ở vị trí {i}"
+        else:
+            assert chunk.strip(), f"đoạn {i} chỉ có khoảng trắng"
+    # Không mất hay thêm ký tự nào ngoài khoảng trắng (so sau khi chuẩn hóa NFC)
+    actual = "".join(_visible(chunk) for chunk in chunks)
+    assert actual == _visible(text), "nội dung sau khi chia không khớp văn bản gốc"
+
+
+def run_property_checks(cases, seed):
+    rng = random.Random(seed)
+    for case in range(cases):
+        max_length = rng.choice([20, 50, 120, MAX_CHAR_LIMIT])
+        text = random_text(rng, rng.randint(0, 3000), long_word_rate=0.01)
+        try:
+            check_properties(text, split_text(text, max_length), max_length)
+            check_properties(text, split_text(text, max_length, keep_paragraphs=False), max_length, breaks=False)
+            check_properties(text, split_sentences(text, max_length), max_length, breaks=False)
+            check_properties(text, split_stable(text, max_length), max_length, breaks=False)
+        except AssertionError as e:
+            raise AssertionError(f"case {case} (max={max_length}): {e}\n{text!r}")
+    # Các trường hợp biên
+    for text in ["", " ", "\n\n\n", "a", "\n\na\n\n", "x" * (MAX_CHAR_LIMIT * 2 + 1), "Hết câu không chấm"]:
+        check_properties(text, split_text(text, MAX_CHAR_LIMIT), MAX_CHAR_LIMIT)
+        check_properties(text, split_sentences(text, MAX_CHAR_LIMIT), MAX_CHAR_LIMIT, breaks=False)
+        check_properties(text, split_stable(text, MAX_CHAR_LIMIT), MAX_CHAR_LIMIT, breaks=False)
+    print(f"✅ {cases} trường hợp ngẫu nhiên + biên: đạt")
+
+
+# === So sánh trên bộ bài giảng ===
+
+def read_docx_text(path):
+    """Đọc đoạn văn trong .docx bằng zipfile (không cần python-docx)."""
+    with zipfile.ZipFile(path) as docx:
+        xml = docx.read("word/document.xml").decode("utf-8")
+    paragraphs = []
+    for paragraph in re.findall(r"<w:p[ >].*?</w:p>", xml, flags=re.S):
+        runs = re.findall(r"<w:t(?: [^>]*)?>(.*?)</w:t>", paragraph, flags=re.S)
+        text = "".join(runs).replace("&amp;", "&").replace("&lt;", "<").replace("&gt;", ">").replace("&quot;", '"')
+        if text.strip():
+            paragraphs.append(text)
+    return "\n\n".join(paragraphs)
+
+
+def load_corpus(paths):
+    """Danh sách (tên, văn bản): mỗi slide của file JSON là một văn bản riêng, như khi gửi TTS."""
+    texts = []
+    for path in paths:
+        if not os.path.exists(path):
+            print(f"⚠️ Bỏ qua {path}: không tồn tại")
+            continue
+        name = os.path.basename(path)
+        if path.endswith(".json"):
+            with open(path, "r", encoding="utf-8") as f:
+                for i, slide in enumerate(json.load(f), start=1):
+                    if slide.get("generated_lecture", "").strip():
+                        texts.append((f"{name}#{i}", slide["generated_lecture"]))
+        elif path.endswith(".docx"):
+            texts.append((name, read_docx_text(path)))
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                texts.append((name, f.read()))
+    return texts
+
+
+def measure(texts, splitter):
+    requests_, lost, ratios = 0, 0, []
+    for _, text in texts:
+        chunks = splitter(text)
+        # Độ lệch tính trong từng đoạn văn: các đoạn giữa hai PARAGRAPH_BREAK mới render cùng nhau
+        group = []
+        for chunk in chunks + [PARAGRAPH_BREAK]:
+            if chunk != PARAGRAPH_BREAK:
+                group.append(len(chunk))
+            elif len(group) > 1:
+                ratios.append(max(group) / (sum(group) / len(group)))
+                group = []
+            else:
+                group = []
+        chunks = [chunk for chunk in chunks if chunk != PARAGRAPH_BREAK]
+        requests_ += len(chunks)
+        lost += max(0, len(_visible(text)) - len("".join(_visible(chunk) for chunk in chunks)))
+    balance = sum(ratios) / len(ratios) if ratios else 1.0
+    return requests_, lost, balance
+
+
+def run_corpus(paths):
+    texts = load_corpus(paths)
+    if not texts:
+        return
+    chars = sum(len(text) for _, text in texts)
+    print(f"\n📚 Bộ bài giảng: {len(texts)} văn bản, {chars} ký tự")
+    print(f"{'Luồng':<20} {'Giới hạn':>8} {'Req cũ':>7} {'Req mới':>8} {'Giảm':>7} "
+          f"{'Mất ký tự cũ':>13} {'Lệch cũ':>8} {'Lệch mới':>9}")
+    for name, legacy, limit, keep_paragraphs, prepare in PATHS:
+        old_requests, old_lost, old_balance = measure(texts, lambda text: legacy(prepare(text), limit))
+        new_requests, new_lost, new_balance = measure(
+            texts, lambda text: split_text(prepare(text), limit, keep_paragraphs=keep_paragraphs))
+        assert new_lost == 0, f"{name}: segmenter làm mất {new_lost} ký tự"
+        saved = (old_requests - new_requests) / old_requests * 100 if old_requests else 0.0
+        print(f"{name:<20} {limit:>8} {old_requests:>7} {new_requests:>8} {saved:>6.1f}% "
+              f"{old_lost:>13} {old_balance:>8.2f} {new_balance:>9.2f}")
+    stable_requests, _, _ = measure(texts, lambda text: split_stable(text, MAX_CHAR_LIMIT))
+    print(f"{'ausync (ổn định)':<20} {MAX_CHAR_LIMIT:>8} {'':>7} {stable_requests:>8}   "
+          f"(AUDIO_SEGMENT_MODE=packed, mặc định: split_stable)")
+    sentence_requests, _, _ = measure(texts, lambda text: split_sentences(text, MAX_CHAR_LIMIT))
+    print(f"{'ausync (theo câu)':<20} {MAX_CHAR_LIMIT:>8} {'':>7} {sentence_requests:>8}   "
+          f"(AUDIO_SEGMENT_MODE=sentence)")
+    return texts
+
+
+def edit_costs(text, splitter, rng, samples):
+    """Số đoạn phải render lại (đoạn mới không có trong lần chia trước) khi chèn một từ vào một câu."""
+    sentences = split_sentences(text, MAX_CHAR_LIMIT)
+    before = collections.Counter(splitter("\n".join(sentences)))
+    costs = []
+    for i in rng.sample(range(len(sentences)), min(samples, len(sentences))):
+        words = sentences[i].split(" ")
+        words.insert(len(words) // 2, "rất")
+        edited = sentences[:i] + [" ".join(words)] + sentences[i + 1:]
+        costs.append(sum((collections.Counter(splitter("\n".join(edited))) - before).values()))
+    return costs
+
+
+def run_edit_stability(texts, seed, samples=50, sizes_kb=(5, 20, 80)):
+    rng = random.Random(seed)
+    cases = [("bộ bài giảng (từng slide)", [text for _, text in texts])]
+    cases += [(f"ngẫu nhiên {size} KB", [random_text(rng, size * 1024, long_word_rate=0)]) for size in sizes_kb]
+    splitters = [
+        ("ổn định", lambda text: split_stable(text, MAX_CHAR_LIMIT)),
+        ("cân bằng", lambda text: split_text(text, MAX_CHAR_LIMIT, keep_paragraphs=False)),
+    ]
+    print("\n✏️ Sửa một câu: số đoạn phải render lại (trung bình / tối đa)")
+    print(f"{'Văn bản':<26} {'Số đoạn':>8} " + " ".join(f"{name:>14}" for name, _ in splitters))
+    for label, case_texts in cases:
+        count = sum(len(split_stable(text, MAX_CHAR_LIMIT)) for text in case_texts)
+        cells = []
+        for name, splitter in splitters:
+            costs = [cost for text in case_texts for cost in edit_costs(text, splitter, rng, samples)]
+            mean = sum(costs) / len(costs) if costs else 0.0
+            cells.append(f"{mean:>8.2f} / {max(costs, default=0):>3}")
+            if name == "ổn định":
+                assert mean <= 2, f"{label}: sửa một câu làm render lại trung bình {mean:.2f} đoạn"
+        print(f"{label:<26} {count:>8} " + " ".join(f"{cell:>14}" for cell in cells))
+
+
+def run_benchmark(sizes_kb, seed, repeat=3):
+    rng = random.Random(seed)
+    print(f"\n{'Kích thước':>12} {'Số đoạn':>9} {'Ngắt đoạn':>10} {'Thời gian':>11} {'ms/MB':>9}")
+    for size_kb in sizes_kb:
+        text = random_text(rng, size_kb * 1024)
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            chunks = split_text(text, MAX_CHAR_LIMIT)
+            best = min(best, time.perf_counter() - start)
+        breaks = sum(1 for c in chunks if c == PARAGRAPH_BREAK)
+        mb = len(text) / (1024 * 1024)
+        print(f"{size_kb:>9} KB {len(chunks) - breaks:>9} {breaks:>10} {best * 1000:>9.1f}ms {best * 1000 / mb:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark common/segmenter.py")
+    parser.add_argument("--corpus", nargs="+", default=DEFAULT_CORPUS, help="File .json/.txt/.docx để so sánh")
+    parser.add_argument("--sizes-kb", type=int, nargs="+", default=[100, 500, 1000, 5000])
+    parser.add_argument("--cases", type=int, default=500, help="Số trường hợp kiểm tra ngẫu nhiên")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    run_property_checks(args.cases, args.seed)
+    texts = run_corpus(args.corpus) or []
+    run_edit_stability(texts, args.seed)
+    run_benchmark(args.sizes_kb, args.seed)
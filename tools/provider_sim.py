@@ -0,0 +1,598 @@
+"""
+Giả lập các API bên ngoài để đo hiệu năng pipeline mà không tốn quota.
+
+Chạy: python tools/provider_sim.py [--port 8765] [--config sim.json] [--time-scale 0.1]
+rồi trỏ script sang giả lập bằng biến môi trường:
+    AUSYNC_BASE_URL, FPT_BASE_URL, GEMINI_BASE_URL, D_ID_BASE_URL,
+    HEYGEN_BASE_URL, HEYGEN_UPLOAD_BASE_URL, CLOUDINARY_BASE_URL = http://127.0.0.1:8765
+
+Các endpoint giả lập (cùng đường dẫn với API thật, nên một cổng dùng cho tất cả):
+- AusyncLab: /api/v1/voices/list, /api/v1/voices/register, /api/v1/speech/text-to-speech
+  (có gọi callback_url khi render xong), /api/v1/speech/<id>
+- FPT: /hmi/tts/v5 (link async trả 404 cho tới khi render xong)
+- Gemini: /v1beta/models/<model>:generateContent
+- D-ID: /talks, /talks/<id>
+- Cloudinary: /v1_1/<cloud>/<resource_type>/upload
+- HeyGen: /v1/asset, /v1/talking_photo, /v2/video/generate, /v1/video_status.get
+- /__sim/stats (số request theo nhà cung cấp, endpoint, mã trạng thái), /__sim/reset
+
+Thời gian xử lý lấy theo phân phối log-normal: base + per_unit * khối lượng
+(ký tự với TTS/LLM, giây audio với avatar), nhân với time_scale. Lỗi 429 (kèm
+Retry-After) và 5xx được chèn ngẫu nhiên theo tỉ lệ cấu hình cho từng nhà cung cấp.
+key_rpm (mặc định 0 = tắt) giới hạn số request tạo việc của mỗi API key trong 60 giây
+(nhân time_scale), vượt thì trả 429, để đo hiệu quả của nhiều key (common/key_pool.py).
+Audio trả về là WAV/MP3 hợp lệ (sóng sin nhỏ / khung MP3 im lặng) có độ dài tương ứng
+số ký tự; video chỉ là file MP4 rỗng (ftyp + free) có dung lượng như video thật.
+"""
+import argparse
+import array
+import copy
+import io
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+import urllib.request
+import uuid
+import wave
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+CHARS_PER_SECOND = 15  # Tốc độ đọc tiếng Việt ước lượng, dùng để tính độ dài audio
+AUDIO_FRAME_RATE = 24000
+MP3_BITRATE = 128000
+VIDEO_BITRATE = 1_000_000
+
+DEFAULT_CONFIG = {
+    "time_scale": 1.0,
+    "providers": {
+        # latency: thời gian trả lời một request; render: thời gian xử lý nền
+        "ausync": {"latency": {"base": 0.15, "sigma": 0.3},
+                   "render": {"base": 3.0, "per_unit": 0.02, "sigma": 0.35},
+                   "error_429": 0.02, "error_5xx": 0.01, "retry_after": 2},
+        "fpt": {"latency": {"base": 0.2, "sigma": 0.3},
+                "render": {"base": 2.0, "per_unit": 0.004, "sigma": 0.3},
+                "error_429": 0.02, "error_5xx": 0.01, "retry_after": 5},
+        "gemini": {"latency": {"base": 1.5, "per_unit": 0.0005, "sigma": 0.4},
+                   "error_429": 0.05, "error_5xx": 0.01, "retry_after": 10},
+        "d_id": {"latency": {"base": 0.3, "sigma": 0.3},
+                 "render": {"base": 20.0, "per_unit": 1.5, "sigma": 0.4},
+                 "error_429": 0.02, "error_5xx": 0.01, "retry_after": 10},
+        "cloudinary": {"latency": {"base": 0.4, "per_unit": 0.0000005, "sigma": 0.3},
+                       "error_429": 0.0, "error_5xx": 0.005, "retry_after": 5},
+        "heygen": {"latency": {"base": 0.3, "sigma": 0.3},
+                   "render": {"base": 30.0, "per_unit": 2.0, "sigma": 0.4},
+                   "error_429": 0.02, "error_5xx": 0.01, "retry_after": 10},
+        "files": {"latency": {"base": 0.05, "per_unit": 0.00000002, "sigma": 0.2},
+                  "error_429": 0.0, "error_5xx": 0.0},
+    },
+}
+
+
+def load_config(path=None, time_scale=None):
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            custom = json.load(f)
+        config["time_scale"] = custom.get("time_scale", config["time_scale"])
+        for name, values in custom.get("providers", {}).items():
+            config["providers"].setdefault(name, {}).update(values)
+    if time_scale is not None:
+        config["time_scale"] = time_scale
+    return config
+
+
+# === Dữ liệu giả ===
+
+def synthetic_wav(seconds):
+    """WAV mono 16 bit, sóng sin 220 Hz biên độ nhỏ."""
+    period = [int(800 * math.sin(2 * math.pi * 220 * n / AUDIO_FRAME_RATE)) for n in range(AUDIO_FRAME_RATE // 220 * 10)]
+    total = max(1, int(seconds * AUDIO_FRAME_RATE))
+    samples = array.array("h", period * (total // len(period) + 1))[:total]
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(AUDIO_FRAME_RATE)
+        w.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+# Khung MPEG-1 Layer III, 128 kbps, 44.1 kHz, không CRC: 417 byte, 1152 mẫu; phần dữ liệu
+# toàn 0 được giải mã thành im lặng
+_MP3_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+_MP3_FRAME_SECONDS = 1152 / 44100
+
+
+def synthetic_mp3(seconds):
+    return _MP3_FRAME * max(1, int(seconds / _MP3_FRAME_SECONDS))
+
+
+def synthetic_mp4(seconds):
+    """File MP4 chỉ có hộp ftyp và free, dung lượng tương ứng VIDEO_BITRATE."""
+    ftyp = b"\x00\x00\x00\x18ftypisom\x00\x00\x02\x00isomiso2"
+    size = max(16, int(seconds * VIDEO_BITRATE / 8))
+    free = size.to_bytes(4, "big") + b"free" + b"\x00" * (size - 8)
+    return ftyp + free
+
+
+def speech_seconds(chars):
+    return max(1.0, chars / CHARS_PER_SECOND)
+
+
+def media_seconds(data):
+    """Ước lượng độ dài audio đã upload theo dung lượng (MP3 128 kbps hoặc WAV 24 kHz)."""
+    if data[:4] == b"RIFF":
+        return max(1.0, (len(data) - 44) / (AUDIO_FRAME_RATE * 2))
+    return max(1.0, len(data) * 8 / MP3_BITRATE)
+
+
+LECTURE_SENTENCES = [
+    "Các con hãy nhìn lên bảng nhé.",
+    "Cô có ba quả táo, cô thêm hai quả nữa thì được năm quả táo.",
+    "Mình cùng đếm trên ngón tay nào: một, hai, ba, bốn, năm.",
+    "Số năm lớn hơn số ba vì năm quả táo nhiều hơn ba quả táo.",
+    "Khi gộp hai nhóm đồ vật lại với nhau, ta làm phép cộng.",
+    "Con nào giỏi nói cho cô biết hai cộng ba bằng mấy?",
+    "Chúng ta vừa học xong phép cộng trong phạm vi mười, các con giỏi lắm!",
+]
+
+
+def synthetic_lecture(rng, target_chars=320):
+    parts = []
+    while sum(len(p) + 1 for p in parts) < target_chars:
+        parts.append(rng.choice(LECTURE_SENTENCES))
+    return " ".join(parts)
+
+
+# === Trạng thái giả lập ===
+
+class Simulator:
+    def __init__(self, config, seed=None):
+        self.config = config
+        self.rng = random.Random(seed)
+        self.base_url = ""
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._jobs = {}  # id -> {"ready_at", "kind", "payload"...}
+        self._files = {}  # đường dẫn /files/... -> (content_type, bytes hoặc hàm tạo bytes)
+        self._stats = {}
+        self._key_requests = {}  # (provider, key) -> thời điểm các request gần đây
+        self._key_stats = {}
+
+    # --- Thời gian và lỗi ---
+
+    def _sample(self, spec, units=0):
+        if not spec:
+            return 0.0
+        median = spec.get("base", 0.0) + spec.get("per_unit", 0.0) * units
+        with self._lock:
+            jitter = self.rng.lognormvariate(0, spec.get("sigma", 0.0)) if spec.get("sigma") else 1.0
+        return median * jitter * self.config["time_scale"]
+
+    def latency(self, provider, units=0):
+        return self._sample(self.config["providers"][provider].get("latency"), units)
+
+    def render_time(self, provider, units=0):
+        return self._sample(self.config["providers"][provider].get("render"), units)
+
+    def injected_error(self, provider):
+        """Trả về (status, headers) nếu request này bị chèn lỗi, ngược lại None."""
+        spec = self.config["providers"][provider]
+        with self._lock:
+            roll = self.rng.random()
+        if roll < spec.get("error_429", 0):
+            retry_after = max(1, round(spec.get("retry_after", 1) * self.config["time_scale"]))
+            return 429, {"Retry-After": str(retry_after)}
+        if roll < spec.get("error_429", 0) + spec.get("error_5xx", 0):
+            return 503, {}
+        return None
+
+    def key_limited(self, provider, key):
+        """Ghi một request tạo việc của key; trả về số giây phải chờ nếu key đã hết hạn mức, ngược lại 0."""
+        label = f"{provider} …{key[-4:]}" if key else f"{provider} (không key)"
+        with self._lock:
+            by_key = self._key_stats.setdefault(label, {"requests": 0, "throttled": 0})
+            by_key["requests"] += 1
+            rpm = self.config["providers"][provider].get("key_rpm", 0)
+            if not rpm:
+                return 0
+            window = 60.0 * self.config["time_scale"]
+            now = time.time()
+            recent = self._key_requests.setdefault((provider, key), deque())
+            while recent and recent[0] <= now - window:
+                recent.popleft()
+            if len(recent) >= rpm:
+                by_key["throttled"] += 1
+                return max(1, math.ceil(recent[0] + window - now))
+            recent.append(now)
+            return 0
+
+    def count(self, provider, endpoint, status):
+        key = f"{provider} {endpoint}"
+        with self._lock:
+            by_status = self._stats.setdefault(key, {})
+            by_status[str(status)] = by_status.get(str(status), 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {"requests": copy.deepcopy(self._stats), "keys": copy.deepcopy(self._key_stats)}
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+            self._key_stats = {}
+            self._key_requests = {}
+
+    # --- Việc xử lý nền ---
+
+    def new_id(self):
+        return next(self._ids)
+
+    def add_job(self, job_id, render_seconds, **data):
+        with self._lock:
+            self._jobs[str(job_id)] = dict(data, ready_at=time.time() + render_seconds)
+
+    def get_job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(str(job_id))
+        if job is None:
+            return None, False
+        return job, time.time() >= job["ready_at"]
+
+    def add_file(self, path, content_type, data):
+        with self._lock:
+            self._files[path] = (content_type, data)
+        return f"{self.base_url}{path}"
+
+    def get_file(self, path):
+        with self._lock:
+            entry = self._files.get(path)
+        if entry is None:
+            return None, None
+        content_type, data = entry
+        if callable(data):
+            data = data()
+        return content_type, data
+
+    def schedule_callback(self, url, payload, delay):
+        def send():
+            body = json.dumps(payload).encode("utf-8")
+            req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+            try:
+                urllib.request.urlopen(req, timeout=10).close()
+            except Exception as e:
+                print(f"⚠️ Gửi callback thất bại ({url}): {e}")
+        timer = threading.Timer(delay, send)
+        timer.daemon = True
+        timer.start()
+
+
+# === Xử lý HTTP ===
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Giữ kết nối như API thật
+    sim = None  # Gán trong make_server
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    # --- Tiện ích ---
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _json_body(self, raw):
+        try:
+            return json.loads(raw or b"{}")
+        except ValueError:
+            return {}
+
+    def _send(self, status, body=b"", content_type="application/json", headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _reply(self, provider, endpoint, status, body=b"", content_type="application/json", headers=None):
+        self.sim.count(provider, endpoint, status)
+        self._send(status, body, content_type, headers)
+
+    def _routes(self):
+        return [
+            ("GET", r"/__sim/stats", self.sim_stats),
+            ("POST", r"/__sim/reset", self.sim_reset),
+            ("GET", r"/files/(?P<path>.+)", self.serve_file),
+            ("GET", r"/api/v1/voices/list", self.ausync_voices),
+            ("POST", r"/api/v1/voices/register", self.ausync_register),
+            ("POST", r"/api/v1/speech/text-to-speech", self.ausync_tts),
+            ("GET", r"/api/v1/speech/(?P<audio_id>\w+)", self.ausync_status),
+            ("POST", r"/hmi/tts/v5", self.fpt_tts),
+            ("GET", r"/fpt-async/(?P<request_id>\w+)", self.fpt_async),
+            ("POST", r"/v1beta/models/(?P<model>[^/:]+):generateContent", self.gemini_generate),
+            ("POST", r"/talks", self.did_create),
+            ("GET", r"/talks/(?P<talk_id>[\w-]+)", self.did_status),
+            ("POST", r"/v1_1/(?P<cloud>[^/]+)/(?P<resource_type>\w+)/upload", self.cloudinary_upload),
+            ("POST", r"/v1/(?P<kind>asset|talking_photo)", self.heygen_upload),
+            ("POST", r"/v2/video/generate", self.heygen_generate),
+            ("GET", r"/v1/video_status\.get", self.heygen_status),
+        ]
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        self.query = parse_qs(url.query)
+        for route_method, pattern, handler in self._routes():
+            match = re.fullmatch(pattern, url.path)
+            if route_method == method and match:
+                try:
+                    handler(**match.groupdict())
+                except Exception as e:
+                    self._send(500, {"error": str(e)})
+                return
+        self._send(404, {"error": f"Không có endpoint giả lập cho {method} {url.path}"})
+
+    def _api_key(self):
+        """Key của request theo cách từng nhà cung cấp nhận (header, query ?key= hoặc Basic auth)."""
+        return (self.headers.get("X-API-Key") or self.headers.get("api-key")
+                or (self.query.get("key") or [""])[0] or self.headers.get("Authorization") or "")
+
+    def _guard(self, provider, endpoint, units=0, limited=False):
+        """
+        Chờ độ trễ mạng giả lập; trả về True nếu đã trả lỗi (429 do hết hạn mức key hoặc lỗi chèn ngẫu nhiên).
+        limited=True với request tạo việc (gửi TTS, gọi LLM, tạo video) để tính vào key_rpm.
+        """
+        time.sleep(self.sim.latency(provider, units))
+        if limited:
+            retry_after = self.sim.key_limited(provider, self._api_key())
+            if retry_after:
+                self._reply(provider, endpoint, 429, {"error": "rate limited", "status": 429},
+                            headers={"Retry-After": str(retry_after)})
+                return True
+        error = self.sim.injected_error(provider)
+        if error:
+            status, headers = error
+            self._reply(provider, endpoint, status, {"error": "simulated", "status": status}, headers=headers)
+            return True
+        return False
+
+    # --- Giả lập nội bộ ---
+
+    def sim_stats(self):
+        self._send(200, self.sim.stats())
+
+    def sim_reset(self):
+        self._body()
+        self.sim.reset()
+        self._send(200, {"ok": True})
+
+    def serve_file(self, path):
+        content_type, data = self.sim.get_file(f"/files/{path}")
+        if data is None:
+            self._reply("files", "download", 404, {"error": "not found"})
+            return
+        time.sleep(self.sim.latency("files", len(data)))
+        self._reply("files", "download", 200, data, content_type=content_type)
+
+    # --- AusyncLab ---
+
+    def ausync_voices(self):
+        if self._guard("ausync", "voices/list"):
+            return
+        self._reply("ausync", "voices/list", 200, {"status": 200, "result": [{"id": 311890, "name": "sim"}]})
+
+    def ausync_register(self):
+        self._body()
+        if self._guard("ausync", "voices/register"):
+            return
+        self._reply("ausync", "voices/register", 200, {"status": 200, "result": {"id": self.sim.new_id()}})
+
+    def ausync_tts(self):
+        payload = self._json_body(self._body())
+        text = payload.get("text", "")
+        if self._guard("ausync", "text-to-speech", limited=True):
+            return
+        if not text:
+            self._reply("ausync", "text-to-speech", 422, {"detail": "text is required"})
+            return
+        audio_id = self.sim.new_id()
+        render = self.sim.render_time("ausync", len(text))
+        seconds = speech_seconds(len(text))
+        audio_url = self.sim.add_file(f"/files/ausync/{audio_id}.wav", "audio/wav",
+                                      lambda: synthetic_wav(seconds))
+        result = {"audio_id": audio_id, "state": "SUCCEED", "audio_url": audio_url,
+                  "audio_name": payload.get("audio_name")}
+        self.sim.add_job(audio_id, render, result=result)
+        if payload.get("callback_url"):
+            self.sim.schedule_callback(payload["callback_url"], {"status": 200, "result": result}, render)
+        self._reply("ausync", "text-to-speech", 200,
+                    {"status": 200, "result": {"audio_id": audio_id, "state": "PROCESSING"}})
+
+    def ausync_status(self, audio_id):
+        if self._guard("ausync", "speech/status"):
+            return
+        job, ready = self.sim.get_job(audio_id)
+        if job is None:
+            self._reply("ausync", "speech/status", 404, {"detail": "audio not found"})
+        elif ready:
+            self._reply("ausync", "speech/status", 200, {"status": 200, "result": job["result"]})
+        else:
+            self._reply("ausync", "speech/status", 200,
+                        {"status": 200, "result": {"audio_id": int(audio_id), "state": "PROCESSING"}})
+
+    # --- FPT ---
+
+    def fpt_tts(self):
+        text = self._body().decode("utf-8", errors="replace")
+        if self._guard("fpt", "tts/v5", limited=True):
+            return
+        request_id = uuid.uuid4().hex
+        render = self.sim.render_time("fpt", len(text))
+        self.sim.add_job(f"fpt-{request_id}", render)
+        seconds = speech_seconds(len(text))
+        path = f"/files/fpt/{request_id}.mp3"
+        self.sim.add_file(path, "audio/mpeg", lambda: synthetic_mp3(seconds))
+        self._reply("fpt", "tts/v5", 200, {"error": 0, "async": f"{self.sim.base_url}/fpt-async/{request_id}",
+                                           "request_id": request_id, "message": "simulated"})
+
+    def fpt_async(self, request_id):
+        job, ready = self.sim.get_job(f"fpt-{request_id}")
+        if job is None or not ready:
+            self._reply("fpt", "async", 404, {"error": "not ready"})
+            return
+        content_type, data = self.sim.get_file(f"/files/fpt/{request_id}.mp3")
+        self._reply("fpt", "async", 200, data, content_type=content_type)
+
+    # --- Gemini ---
+
+    def gemini_generate(self, model):
+        payload = self._json_body(self._body())
+        prompt = "".join(part.get("text", "") for content in payload.get("contents", [])
+                         for part in content.get("parts", []))
+        if self._guard("gemini", "generateContent", len(prompt), limited=True):
+            return
+        with self.sim._lock:
+            rng = random.Random(self.sim.rng.random())
+        if payload.get("generationConfig", {}).get("response_mime_type") == "application/json":
+            text = json.dumps({
+                "action": rng.choice(["cười tươi và chỉ vào màn hình", "giơ 2 ngón tay", "vẽ hình tròn lên bảng"]),
+                "graphics": rng.choice(["hiện chữ 'Phép cộng'", "icon quả táo bay vào", "số 5 được khoanh tròn"]),
+                "camera_angle": rng.choice(["cận cảnh biểu cảm", "trung cảnh thấy tay", "toàn cảnh"]),
+            }, ensure_ascii=False)
+        else:
+            text = synthetic_lecture(rng, rng.randint(250, 420))
+        self._reply("gemini", "generateContent", 200, {
+            "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP"}],
+            "modelVersion": model,
+        })
+
+    # --- D-ID ---
+
+    def did_create(self):
+        payload = self._json_body(self._body())
+        if self._guard("d_id", "talks", limited=True):
+            return
+        audio_url = payload.get("script", {}).get("audio_url", "")
+        _, audio = self.sim.get_file(urlparse(audio_url).path)
+        seconds = media_seconds(audio) if audio else 20.0
+        talk_id = f"tlk_{uuid.uuid4().hex[:12]}"
+        result_url = self.sim.add_file(f"/files/d_id/{talk_id}.mp4", "video/mp4", lambda: synthetic_mp4(seconds))
+        self.sim.add_job(talk_id, self.sim.render_time("d_id", seconds), result_url=result_url)
+        self._reply("d_id", "talks", 201, {"id": talk_id, "status": "created", "object": "talk"})
+
+    def did_status(self, talk_id):
+        if self._guard("d_id", "talks/status"):
+            return
+        job, ready = self.sim.get_job(talk_id)
+        if job is None:
+            self._reply("d_id", "talks/status", 404, {"kind": "NotFoundError"})
+        elif ready:
+            self._reply("d_id", "talks/status", 200, {"id": talk_id, "status": "done", "result_url": job["result_url"]})
+        else:
+            self._reply("d_id", "talks/status", 200, {"id": talk_id, "status": "started"})
+
+    # --- Cloudinary ---
+
+    def cloudinary_upload(self, cloud, resource_type):
+        raw = self._body()
+        if self._guard("cloudinary", f"{resource_type}/upload", len(raw)):
+            return
+        # Lấy nội dung file trong multipart để D-ID giả lập tính được độ dài audio
+        data = raw
+        match = re.search(rb"filename=\"[^\"]*\"\r\n(?:[^\r\n]+\r\n)*\r\n", raw)
+        if match:
+            boundary = raw.split(b"\r\n", 1)[0]
+            data = raw[match.end():].split(b"\r\n" + boundary, 1)[0]
+        public_id = uuid.uuid4().hex[:20]
+        url = self.sim.add_file(f"/files/cloudinary/{cloud}/{resource_type}/{public_id}",
+                                "application/octet-stream", data)
+        self._reply("cloudinary", f"{resource_type}/upload", 200, {
+            "public_id": public_id, "resource_type": resource_type, "bytes": len(data),
+            "url": url, "secure_url": url,
+        })
+
+    # --- HeyGen ---
+
+    def heygen_upload(self, kind):
+        data = self._body()
+        if self._guard("heygen", f"upload/{kind}", len(data)):
+            return
+        asset_id = uuid.uuid4().hex
+        self.sim.add_file(f"/files/heygen/{asset_id}", self.headers.get("Content-Type", ""), data)
+        body = {"id": asset_id, "talking_photo_id": asset_id} if kind == "talking_photo" else {"id": asset_id}
+        self._reply("heygen", f"upload/{kind}", 200, {"code": 100, "data": body, "message": "Success"})
+
+    def heygen_generate(self):
+        payload = self._json_body(self._body())
+        if self._guard("heygen", "video/generate", limited=True):
+            return
+        voice = (payload.get("video_inputs") or [{}])[0].get("voice", {})
+        _, audio = self.sim.get_file(f"/files/heygen/{voice.get('audio_asset_id')}")
+        seconds = media_seconds(audio) if audio else 20.0
+        video_id = uuid.uuid4().hex
+        video_url = self.sim.add_file(f"/files/heygen/{video_id}.mp4", "video/mp4", lambda: synthetic_mp4(seconds))
+        self.sim.add_job(video_id, self.sim.render_time("heygen", seconds), video_url=video_url)
+        self._reply("heygen", "video/generate", 200, {"error": None, "data": {"video_id": video_id}})
+
+    def heygen_status(self):
+        if self._guard("heygen", "video_status"):
+            return
+        video_id = (self.query.get("video_id") or [""])[0]
+        job, ready = self.sim.get_job(video_id)
+        if job is None:
+            self._reply("heygen", "video_status", 404, {"code": 40001, "message": "video not found"})
+        elif ready:
+            self._reply("heygen", "video_status", 200,
+                        {"code": 100, "data": {"status": "completed", "video_url": job["video_url"]}})
+        else:
+            self._reply("heygen", "video_status", 200, {"code": 100, "data": {"status": "processing"}})
+
+
+def make_server(config, host="127.0.0.1", port=8765, seed=None):
+    """Tạo server giả lập (port=0 để chọn cổng trống); gọi serve_forever() trong luồng riêng."""
+    sim = Simulator(config, seed=seed)
+    handler = type("SimHandler", (Handler,), {"sim": sim})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    sim.base_url = f"http://{host}:{server.server_address[1]}"
+    server.sim = sim
+    return server
+
+
+def start_in_thread(config, host="127.0.0.1", port=0, seed=None):
+    server = make_server(config, host, port, seed)
+    thread = threading.Thread(target=server.serve_forever, name="provider-sim", daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Giả lập API AusyncLab, FPT, Gemini, D-ID, Cloudinary, HeyGen")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--config", help="File JSON ghi đè cấu hình mặc định (time_scale, providers)")
+    parser.add_argument("--time-scale", type=float, help="Nhân mọi thời gian giả lập (vd 0.1 để chạy nhanh gấp 10)")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    server = make_server(load_config(args.config, args.time_scale), args.host, args.port, args.seed)
+    print(f"🧪 Giả lập nhà cung cấp đang chạy tại {server.sim.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Dừng giả lập.")
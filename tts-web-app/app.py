@@ -1,14 +1,39 @@
-from flask import Flask, request, render_template, send_from_directory, jsonify
+from flask import Flask, Response, request, render_template, send_from_directory, jsonify, redirect
+from werkzeug.utils import safe_join
 import requests
 import time
 import os
-import glob
+import hashlib
+import hmac
+import io
+import re
+import threading
+import shutil
+from contextlib import contextmanager
+from concurrent.futures import as_completed
 from pydub import AudioSegment
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 import logging
+import sys
+from callbacks import CallbackRegistry, parse_ausync_callback
+from download_store import DownloadStore
+from eta import LinearEstimator, parallel_makespan
+from jobs import JobQueue, QueueFullError
+from metrics import Registry
+from scheduler import ChunkScheduler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.audio_stream import StreamingEncoder
+from common.health import HealthMonitor, is_provider_failure
+from common.key_pool import KeyPool
+from common.providers import base_url
+from common.segmenter import is_paragraph_break, split_text
+from common.tracing import current_span, span
+from common.transport import create_session
+from common.tts_cache import cache_from_env
 
 app = Flask(__name__)
+# Đặt sau nginx/Apache có mod xsendfile thì để web server tự gửi file
+app.config['USE_X_SENDFILE'] = os.getenv("USE_X_SENDFILE") == "1"
 
 # Thiết lập logging
 logging.basicConfig(
@@ -18,293 +43,643 @@ logging.basicConfig(
 )
 
 # Cấu hình
-API_KEY = ""
+API_KEY = ""  # Dùng khi chưa đặt AUSYNC_API_KEY(S)
+# Nhiều key (AUSYNC_API_KEYS=key1,key2) chia tải gửi đoạn; AUSYNC_KEY_RPM giới hạn mỗi key
+ausync_keys = KeyPool.from_env("ausync", "AUSYNC_API_KEY", default=API_KEY)
 VOICE_ID = "311890"
-CALLBACK_URL = "https://webhook.site/your-unique-id"  # Thay bằng URL thực
+MODEL_NAME = "myna-2"
+LANGUAGE = "vi"
+SPEED = 1.0
+AUSYNC_API_URL = f"{base_url('ausync')}/api/v1"
+# Địa chỉ công khai của app (vd https://tts.truong.edu.vn); để trống thì không dùng callback, chỉ polling
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
+# Chuỗi bí mật trong URL callback, các process phải dùng chung một giá trị (bắt buộc khi có PUBLIC_BASE_URL:
+# mỗi process tự sinh một giá trị thì callback tới process khác bị 404 và đoạn âm thầm quay về polling)
+CALLBACK_SECRET = os.getenv("CALLBACK_SECRET", "")
+if PUBLIC_BASE_URL and not CALLBACK_SECRET:
+    raise RuntimeError("Đã đặt PUBLIC_BASE_URL nhưng thiếu CALLBACK_SECRET (chuỗi ngẫu nhiên dùng chung cho mọi process)")
+CALLBACK_URL = f"{PUBLIC_BASE_URL}/callbacks/ausync/{CALLBACK_SECRET}" if PUBLIC_BASE_URL else None
 MAX_CHAR_LIMIT = 500
-MIN_CHUNK_LENGTH = 50  # Độ dài tối thiểu để gộp chunk (mới thêm)
-UPLOAD_FOLDER = "Uploads"
+OUTPUT_FRAME_RATE = 24000
+OUTPUT_CHANNELS = 2
+OUTPUT_SAMPLE_WIDTH = 2  # 16 bit
+OUTPUT_BITRATE = "128k"
+PARAGRAPH_PAUSE_MS = 700  # Khoảng lặng chèn vào chỗ ngắt đoạn văn, tạo tại chỗ
 DOWNLOAD_FOLDER = "downloads"
+WORK_FOLDER = "work"  # Thư mục làm việc tạm, mỗi job một thư mục con
+JOB_FOLDER = "jobs"
+OUTPUT_MAX_AGE = int(os.getenv("OUTPUT_MAX_AGE", str(24 * 3600)))  # Giây giữ file kể từ lần tải gần nhất
+OUTPUT_MAX_BYTES = int(os.getenv("OUTPUT_MAX_MB", "5120")) * 1024 * 1024  # Dung lượng tối đa của downloads
+OUTPUT_SWEEP_INTERVAL = 60  # Giây giữa hai lần dọn thư mục downloads
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "4"))
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "20"))
+CHUNKS_PER_KEY = 8  # Số đoạn render đồng thời mặc định cho mỗi API key
+MAX_INFLIGHT_CHUNKS = int(os.getenv("MAX_INFLIGHT_CHUNKS", str(CHUNKS_PER_KEY * len(ausync_keys))))  # Của tất cả job
+JOB_AGING = float(os.getenv("JOB_AGING", "1.0"))  # Giây ước lượng được trừ cho mỗi giây job đã chờ
+POLL_INTERVAL = 5  # Giây giữa hai lần hỏi trạng thái một đoạn khi không có callback
+CALLBACK_POLL_INTERVAL = 30  # Khi có callback, chỉ polling dự phòng thưa hơn
+CHUNK_RENDER_TIMEOUT = 300  # Giây tối đa chờ một đoạn render xong
+CALLBACK_FOLDER = "callbacks"  # Callback nhận ở process khác được chuyển qua thư mục này
+STREAM_CHUNK_TIMEOUT = 600  # Giây tối đa chờ một đoạn khi đang phát trực tiếp
+HEALTH_TTL = 60  # Giây tin vào kết quả kiểm tra server gần nhất
+HEALTH_FAILURE_THRESHOLD = 3  # Số lỗi liên tiếp trước khi mở mạch
+HEALTH_RESET_TIMEOUT = 30  # Giây chờ trước khi thử lại khi mạch đang mở
+HEALTH_PROBE_TIMEOUT = 10
+CONTENT_HASH_LENGTH = 20  # Số ký tự hex của hash dùng trong tên file kết quả
+CONTENT_ADDRESSED_NAME = re.compile(r"^bai_giang_([0-9a-f]{%d})\.mp3$" % CONTENT_HASH_LENGTH)
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+QUEUE_RETRY_AFTER = 30  # Giây, gợi ý cho client khi trả về 429
+ETA_CHUNK_FILE = "eta_chunk.json"  # Mẫu thời gian gửi + render + tải một đoạn theo số ký tự
+ETA_MERGE_FILE = "eta_merge.json"  # Mẫu thời gian ghép và mã hóa MP3 theo tổng số ký tự
+
+# Đảm bảo thư mục làm việc tồn tại; downloads do download_store quản lý
+os.makedirs(WORK_FOLDER, exist_ok=True)
+
+# Kho file kết quả: dọn nền theo thời hạn và dung lượng, không dọn trong lúc xử lý request
+download_store = DownloadStore(
+    DOWNLOAD_FOLDER,
+    max_bytes=OUTPUT_MAX_BYTES,
+    ttl=OUTPUT_MAX_AGE,
+    pattern="bai_giang_*.mp3",
+    sweep_interval=OUTPUT_SWEEP_INTERVAL,
+)
+download_store.start()
+
+# Các luồng chờ callback hoàn thành từ AusyncLab
+callbacks = CallbackRegistry(shared_folder=CALLBACK_FOLDER)
+
+# Cache audio theo nội dung đoạn văn bản, dùng chung với generate_audio_from_ausync.py
+synthesis_cache = cache_from_env()
+
+# Ước lượng thời gian xử lý, học từ thời gian thực tế của các job đã chạy
+chunk_eta = LinearEstimator("chunk", default_intercept=10.0, default_per_char=0.05, state_file=ETA_CHUNK_FILE)
+merge_eta = LinearEstimator("merge", default_intercept=0.5, default_per_char=0.0005, state_file=ETA_MERGE_FILE)
+
+# Số liệu cho route /metrics
+metrics = Registry()
+STAGE_SECONDS = metrics.histogram(
+    "tts_stage_seconds", "Thời gian từng bước xử lý TTS", ["stage"])
+INFLIGHT_CHUNKS = metrics.gauge(
+    "tts_inflight_chunks", "Số đoạn đang được gửi/render/tải từ AusyncLab")
+QUEUE_DEPTH = metrics.gauge(
+    "tts_queue_depth", "Số job đang chờ trong hàng đợi", callback=lambda: job_queue.depth())
+CHUNK_QUEUE_DEPTH = metrics.gauge(
+    "tts_chunk_queue_depth", "Số đoạn đang chờ tới lượt gửi AusyncLab", callback=lambda: chunk_scheduler.depth())
+JOBS_TOTAL = metrics.counter(
+    "tts_jobs_total", "Số job đã xử lý theo kết quả", ["status"])
+CHUNKS_TOTAL = metrics.counter(
+    "tts_chunks_total", "Số đoạn đã xử lý theo nguồn audio", ["source"])
+POLLS_TOTAL = metrics.counter(
+    "tts_poll_requests_total", "Số lần hỏi trạng thái /speech/{id}", ["result"])
+CALLBACKS_TOTAL = metrics.counter(
+    "tts_callbacks_total", "Số callback nhận từ AusyncLab", ["matched"])
+HTTP_RETRIES_TOTAL = metrics.counter(
+    "tts_http_retries_total", "Số lần urllib3 tự gửi lại request lỗi")
+API_KEY_REQUESTS = metrics.counter(
+    "tts_api_key_requests_total", "Số request tạo audio theo API key", ["key"],
+    callback=lambda: {label: s["requests"] for label, s in ausync_keys.stats().items()})
+API_KEY_THROTTLED = metrics.counter(
+    "tts_api_key_throttled_total", "Số lần API key nhận 429", ["key"],
+    callback=lambda: {label: s["throttled"] for label, s in ausync_keys.stats().items()})
+API_KEY_COOLING = metrics.gauge(
+    "tts_api_key_cooling_seconds", "Giây còn lại trước khi API key được dùng lại", ["key"],
+    callback=lambda: {label: s["cooling_seconds"] for label, s in ausync_keys.stats().items()})
+HTTP_RETRY_BUDGET_EXHAUSTED = metrics.counter(
+    "tts_http_retry_budget_exhausted_total", "Số lần bỏ thử lại vì hết ngân sách retry",
+    callback=lambda: session.retry_budget.exhausted)
+CACHE_HITS = metrics.counter(
+    "tts_cache_hits_total", "Số lần lấy audio từ cache", callback=lambda: synthesis_cache.stats()["hits"])
+CACHE_MISSES = metrics.counter(
+    "tts_cache_misses_total", "Số lần cache không có audio", callback=lambda: synthesis_cache.stats()["misses"])
+CACHE_BYTES = metrics.gauge(
+    "tts_cache_bytes", "Dung lượng cache audio", callback=lambda: synthesis_cache.stats()["bytes"])
+DOWNLOAD_BYTES = metrics.gauge(
+    "tts_download_bytes", "Dung lượng thư mục downloads", callback=lambda: download_store.stats()["bytes"])
+DOWNLOAD_FILES = metrics.gauge(
+    "tts_download_files", "Số file kết quả trong downloads", callback=lambda: download_store.stats()["files"])
+DOWNLOAD_MAX_BYTES = metrics.gauge(
+    "tts_download_max_bytes", "Dung lượng tối đa cho phép của downloads", callback=lambda: download_store.max_bytes)
+DOWNLOAD_EVICTIONS = metrics.counter(
+    "tts_download_evictions_total", "Số file kết quả đã bị dọn", callback=lambda: download_store.stats()["evictions"])
+
+
+# Hàm đo một bước: ghi histogram cho /metrics và span cho trace (khi đặt TRACE_FILE)
+@contextmanager
+def stage(name, **attrs):
+    with STAGE_SECONDS.time(stage=name), span(name, **attrs) as current:
+        yield current
+
+
+# Session giữ kết nối tới AusyncLab, pool đủ cho mọi đoạn đang chạy (gửi + hỏi trạng thái + tải)
+session = create_session(pool_maxsize=MAX_INFLIGHT_CHUNKS * 2, backoff_factor=2, on_retry=HTTP_RETRIES_TOTAL.inc)
 
-# Đảm bảo thư mục uploads và downloads tồn tại
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
+# Hàm tạo header AusyncLab cho một key trong pool
+def ausync_headers(api_key):
+    return {
+        "X-API-Key": api_key,
+        "Content-Type": "application/json",
+        "accept": "application/json"
+    }
 
-# Tạo session với retry
-session = requests.Session()
-retries = Retry(total=5, backoff_factor=2, status_forcelist=[429, 500, 502, 503, 504])
-session.mount('https://', HTTPAdapter(max_retries=retries))
+# Hàm gọi thử API để kiểm tra server (chỉ chạy khi cache tình trạng hết hạn hoặc mạch nửa mở)
+def probe_ausync():
+    test_url = f"{AUSYNC_API_URL}/voices/list"
+    api_key = ausync_keys.acquire()
+    response = session.get(test_url, headers=ausync_headers(api_key), timeout=HEALTH_PROBE_TIMEOUT)
+    ausync_keys.record(api_key, response)
+    response.raise_for_status()
+    logging.info("Server check: OK")
+    return True
 
-# Hàm kiểm tra trạng thái server
+ausync_health = HealthMonitor("ausync", probe_ausync, ttl=HEALTH_TTL,
+                              failure_threshold=HEALTH_FAILURE_THRESHOLD, reset_timeout=HEALTH_RESET_TIMEOUT)
+
+# Hàm kiểm tra trạng thái server (dùng kết quả đã cache, mạch mở thì từ chối ngay)
 def check_server_status():
-    try:
-        test_url = "https://api.ausynclab.org/api/v1/voices/list"
-        headers = {"X-API-Key": API_KEY, "accept": "application/json"}
-        response = session.get(test_url, headers=headers, timeout=30)
-        response.raise_for_status()
-        logging.info("Server check: OK")
-        return True
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Server check failed: {e}")
-        return False
+    return ausync_health.is_available()
 
-# Hàm chia văn bản thành các chunk nhỏ hơn max_length
-def split_text(text, max_length=500, min_length=50):
-    chunks = []
-    current_chunk = ""
-    
-    # Tách văn bản thành các đoạn dựa trên ký tự xuống dòng
-    paragraphs = text.split('\n')
-    
-    for paragraph in paragraphs:
-        # Nếu là dòng trống, thêm chunk rỗng để giữ cấu trúc
-        if not paragraph.strip():
-            if current_chunk:
-                # Nếu chunk hiện tại đủ dài, thêm vào danh sách
-                if len(current_chunk.rstrip()) >= min_length:
-                    chunks.append(current_chunk.rstrip())
-                    current_chunk = ""
-                # Nếu chunk quá ngắn, giữ lại để gộp tiếp
-            # Chỉ thêm chunk rỗng nếu không có chunk rỗng trước đó
-            if chunks and chunks[-1] == "":
-                continue
-            chunks.append("")
-            continue
-        
-        # Nếu đoạn văn quá dài, chia nhỏ
-        words = paragraph.split()
-        for word in words:
-            # Xử lý từ quá dài
-            if len(word) > max_length:
-                # Nếu có chunk đang chờ, thêm vào trước
-                if current_chunk:
-                    if len(current_chunk.rstrip()) >= min_length:
-                        chunks.append(current_chunk.rstrip())
-                        current_chunk = ""
-                    else:
-                        # Gộp chunk ngắn với từ dài
-                        current_chunk = current_chunk.rstrip() + " "
-                # Chia nhỏ từ dài
-                while len(word) > max_length:
-                    chunks.append(word[:max_length])
-                    word = word[max_length:]
-                # Phần còn lại của từ (nếu có)
-                if word:
-                    current_chunk += word + " "
-                continue
-            
-            # Nếu thêm từ mới vượt quá max_length
-            if len(current_chunk) + len(word) + 1 > max_length:
-                if len(current_chunk.rstrip()) >= min_length:
-                    chunks.append(current_chunk.rstrip())
-                    current_chunk = word + " "
-                else:
-                    # Gộp với từ tiếp theo trong chunk mới
-                    current_chunk = current_chunk.rstrip() + " " + word + " "
-            else:
-                current_chunk += word + " "
-        
-        # Thêm dấu xuống dòng nếu không phải đoạn cuối
-        if current_chunk and paragraph != paragraphs[-1]:
-            current_chunk += "\n"
-    
-    # Thêm chunk cuối cùng nếu có
-    if current_chunk:
-        chunks.append(current_chunk.rstrip())
-    
-    # Hợp nhất các chunk ngắn (trừ chunk rỗng)
-    final_chunks = []
-    temp_chunk = ""
-    for chunk in chunks:
-        if chunk == "":
-            if temp_chunk:
-                final_chunks.append(temp_chunk.rstrip())
-                temp_chunk = ""
-            final_chunks.append("")
-            continue
-        if len(temp_chunk) + len(chunk) + 1 <= max_length:
-            temp_chunk += (chunk + "\n" if chunk else "")
-        else:
-            if temp_chunk:
-                final_chunks.append(temp_chunk.rstrip('\n'))
-            temp_chunk = chunk + "\n"
-    
-    # Thêm chunk cuối
-    if temp_chunk:
-        final_chunks.append(temp_chunk.rstrip('\n'))
-    
-    # Loại bỏ các dòng trống liên tiếp
-    result = []
-    for i, chunk in enumerate(final_chunks):
-        if chunk == "" and (i == 0 or final_chunks[i-1] == ""):
-            continue
-        result.append(chunk)
-    
-    return result
+# Hàm đưa audio về định dạng chung (stereo, 24 kHz, 16 bit), bỏ qua bước nào đã khớp
+def normalize_audio(audio):
+    if audio.channels != OUTPUT_CHANNELS:
+        audio = audio.set_channels(OUTPUT_CHANNELS)
+    if audio.frame_rate != OUTPUT_FRAME_RATE:
+        audio = audio.set_frame_rate(OUTPUT_FRAME_RATE)
+    if audio.sample_width != OUTPUT_SAMPLE_WIDTH:
+        audio = audio.set_sample_width(OUTPUT_SAMPLE_WIDTH)
+    return audio
 
-# Hàm ghép file audio
-def merge_audio_files(file_paths, output_file):
+# Hàm mã hóa PCM sang MP3 (dùng cho file cuối và cho các đoạn phát trực tiếp)
+def encode_mp3(audio, output):
+    audio.export(output, format="mp3", bitrate=OUTPUT_BITRATE)
+
+# Hàm ghi vào encoder các đoạn đã xong liền sau đoạn ghi cuối cùng, bỏ PCM của chúng khỏi bộ nhớ
+# (chỉ các đoạn xong sớm hơn thứ tự của mình phải chờ trong `ready`)
+def write_ready_segments(encoder, ready, next_index):
     try:
-        combined = AudioSegment.empty()
-        for file_path in file_paths:
-            audio = AudioSegment.from_file(file_path)
-            audio = audio.set_channels(2).set_frame_rate(24000)
-            combined += audio
-        combined.export(output_file, format="mp3", bitrate="128k")
-        for file_path in file_paths:
-            os.remove(file_path)
-            logging.info(f"Xóa file tạm: {file_path}")
-        return True
-    except Exception as e:
+        while next_index in ready:
+            encoder.write_pcm(ready.pop(next_index).raw_data)
+            next_index += 1
+    except (OSError, RuntimeError) as e:
         logging.error(f"Lỗi khi ghép file: {e}")
-        return False
+        raise TTSError('Lỗi khi ghép file MP3')
+    return next_index
+
+# Hàm tính SHA-256 của một file, đọc theo từng khối
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# ETag mạnh lấy từ hash nội dung; file đặt tên theo hash thì không cần đọc lại
+_etag_cache = {}
+_etag_lock = threading.Lock()
+
+def content_etag(path, filename):
+    match = CONTENT_ADDRESSED_NAME.match(filename)
+    if match:
+        return match.group(1)
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime_ns)
+    with _etag_lock:
+        etag = _etag_cache.get(key)
+    if etag is None:
+        etag = file_sha256(path)
+        with _etag_lock:
+            if len(_etag_cache) > 1024:
+                _etag_cache.clear()
+            _etag_cache[key] = etag
+    return etag
 
 # Route giao diện chính
 @app.route('/')
 def index():
     return render_template('index.html')
 
-# Route xử lý TTS
-@app.route('/tts', methods=['POST'])
-def tts():
+class TTSError(Exception):
+    """Lỗi nghiệp vụ khi xử lý một job TTS, thông điệp hiển thị cho người dùng."""
+
+
+# Hàm tạo audio cho một đoạn: lấy từ cache hoặc gọi API, trả về PCM đã chuẩn hóa
+def synthesize_chunk(job, i, chunk):
+    with span("chunk", chunk=i + 1, chars=len(chunk)) as chunk_span:
+        cache_key = synthesis_cache.make_key(chunk, VOICE_ID, MODEL_NAME, SPEED, LANGUAGE)
+        audio = None
+        cached_path = synthesis_cache.get(cache_key)
+        if cached_path:
+            try:
+                with stage("transcode"):
+                    audio = AudioSegment.from_wav(cached_path)
+                CHUNKS_TOTAL.inc(source="cache")
+                chunk_span.set(cache="hit")
+                logging.info(f"Đoạn {i+1} lấy từ cache")
+            except Exception as e:
+                logging.warning(f"Không đọc được cache đoạn {i+1}: {e}")
+        if audio is None:
+            if not check_server_status():
+                raise TTSError('Server AusyncLab đang gặp sự cố, vui lòng thử lại sau')
+            try:
+                start = time.perf_counter()
+                with INFLIGHT_CHUNKS.track_inprogress():
+                    wav_data = download_chunk_audio(job, i, chunk)
+                chunk_eta.record(len(chunk), time.perf_counter() - start)
+            except requests.exceptions.RequestException as e:
+                if is_provider_failure(e):
+                    ausync_health.record_failure()
+                raise
+            CHUNKS_TOTAL.inc(source="api")
+            chunk_span.set(cache="miss")
+            synthesis_cache.put_bytes(cache_key, wav_data)
+            with stage("transcode"):
+                audio = AudioSegment.from_wav(io.BytesIO(wav_data))
+
+        with stage("transcode"):
+            audio = normalize_audio(audio)
+        publish_stream_part(job, i, audio)
+        job.set_chunk_state(i, "done")
+        logging.info(f"Xong đoạn {i+1}: {len(audio) / 1000:.1f} giây")
+        return audio
+
+# Hàm tạo khoảng lặng cho chỗ ngắt đoạn văn, không gọi API
+def make_paragraph_pause(job, i):
+    silence = AudioSegment.silent(duration=PARAGRAPH_PAUSE_MS, frame_rate=OUTPUT_FRAME_RATE)
+    silence = normalize_audio(silence)
+    publish_stream_part(job, i, silence)
+    job.set_chunk_state(i, "done")
+    return silence
+
+# Hàm gửi đoạn audio cho người nghe trực tiếp (chỉ mã hóa riêng khi job bật phát dần)
+def publish_stream_part(job, i, audio):
+    if job.stream:
+        buffer = io.BytesIO()
+        with stage("stream_encode"):
+            encode_mp3(audio, buffer)
+        job.add_stream_part(i, buffer.getvalue())
+
+# Hàm gọi AusyncLab cho một đoạn, trả về nội dung file WAV
+def download_chunk_audio(job, i, chunk):
+    logging.info(f"Tạo audio cho đoạn {i+1} ({len(chunk)} ký tự)")
+    print(f"Tạo audio cho đoạn {i+1} ({len(chunk)} ký tự)...")
+    job.set_chunk_state(i, "submitting")
+    # Gửi yêu cầu TTS
+    tts_url = f"{AUSYNC_API_URL}/speech/text-to-speech"
+    data = {
+        "audio_name": f"bai_giang_toan_lop5_part_{i+1}",
+        "text": chunk,
+        "voice_id": VOICE_ID,
+        "speed": SPEED,
+        "model_name": MODEL_NAME,
+        "language": LANGUAGE,
+    }
+    if CALLBACK_URL:
+        data["callback_url"] = CALLBACK_URL
+    # Key nhận 429 được nghỉ và đoạn chuyển sang key khác; các bước sau dùng đúng key đã tạo audio
+    with stage("submit", provider="ausync") as submit_span:
+        api_key, res_tts = ausync_keys.send(lambda key: session.post(tts_url, json=data, headers=ausync_headers(key)))
+        submit_span.record_response(res_tts)
+        res_tts.raise_for_status()
+    headers = ausync_headers(api_key)
+
+    ausync_health.record_success()
+
+    audio_id = res_tts.json().get("result", {}).get("audio_id")
+    if not audio_id:
+        logging.error(f"Không tìm thấy audio_id cho đoạn {i+1}: {res_tts.json()}")
+        raise TTSError(f'Không tìm thấy audio_id cho đoạn {i+1}')
+
+    logging.info(f"Audio ID đoạn {i+1}: {audio_id}")
+    print(f"Audio ID đoạn {i+1}: {audio_id}")
+    job.set_chunk_state(i, "rendering")
+    callbacks.register(audio_id)
+    try:
+        with stage("render", provider="ausync"):
+            audio_url = wait_for_audio_url(i, audio_id, headers)
+    finally:
+        callbacks.discard(audio_id)
+
+    # Tải file audio ngay khi đoạn này xong, song song với các đoạn còn đang render
+    logging.info(f"Tải file đoạn {i+1}: {audio_url}")
+    job.set_chunk_state(i, "downloading")
+    buffer = io.BytesIO()
+    with stage("download", provider="ausync") as download_span, \
+            session.get(audio_url, stream=True) as response:
+        download_span.record_response(response)
+        response.raise_for_status()
+        for block in response.iter_content(chunk_size=64 * 1024):
+            buffer.write(block)
+        download_span.set(bytes=buffer.tell())
+    if buffer.tell() < 1000:
+        logging.error(f"File đoạn {i+1} quá nhỏ: {buffer.tell()} bytes")
+        raise TTSError(f'File đoạn {i+1} quá nhỏ, có thể bị lỗi')
+    return buffer.getvalue()
+
+# Hàm hỏi trạng thái một audio_id, trả về result hoặc None nếu lỗi mạng
+def poll_audio_status(i, audio_id, headers, attempt):
     try:
-        # Xóa file cũ trong thư mục downloads
-        for old_file in glob.glob(os.path.join(DOWNLOAD_FOLDER, "bai_giang_ausync_*.mp3")):
-            os.remove(old_file)
-            logging.info(f"Xóa file cũ: {old_file}")
+        audio_info_url = f"{AUSYNC_API_URL}/speech/{audio_id}"
+        res_info = session.get(audio_info_url, headers=headers)
+        res_info.raise_for_status()
+        result = res_info.json().get("result", {})
+        POLLS_TOTAL.inc(result="ready" if result.get("state") == "SUCCEED" else "not_ready")
+        current_span().add("polls")
+        return result
+    except requests.exceptions.RequestException as e:
+        POLLS_TOTAL.inc(result="error")
+        current_span().add("poll_errors")
+        logging.warning(f"Polling lỗi đoạn {i+1}, lần {attempt}: {e}")
+        return None
 
+# Hàm chờ audio_url: ưu tiên callback từ AusyncLab, polling chỉ là dự phòng
+def wait_for_audio_url(i, audio_id, headers):
+    deadline = time.time() + CHUNK_RENDER_TIMEOUT
+    attempt = 0
+    while time.time() < deadline:
+        attempt += 1
+        audio_data = None
+        if CALLBACK_URL:
+            audio_data = callbacks.wait(audio_id, timeout=min(CALLBACK_POLL_INTERVAL, deadline - time.time()))
+        if audio_data is None:
+            audio_data = poll_audio_status(i, audio_id, headers, attempt)
+        if audio_data:
+            state = audio_data.get("state")
+            if state == "SUCCEED" and audio_data.get("audio_url"):
+                logging.info(f"Audio URL đoạn {i+1}: {audio_data['audio_url']}")
+                return audio_data["audio_url"]
+            if state in ("FAILED", "ERROR"):
+                logging.error(f"AusyncLab báo lỗi đoạn {i+1}: {audio_data}")
+                raise TTSError(f'AusyncLab không tạo được audio cho đoạn {i+1}')
+        logging.info(f"Đoạn {i+1} chưa sẵn sàng (lần {attempt})")
+        if not CALLBACK_URL:
+            time.sleep(POLL_INTERVAL)
+    logging.error(f"Hết thời gian chờ cho đoạn {i+1}")
+    raise TTSError(f'Hết thời gian chờ cho đoạn {i+1}')
+
+# Hàm xử lý một job TTS (chạy trong worker nền)
+def run_tts_job(job):
+    # Mỗi job có thư mục làm việc riêng, không đụng tới file của job khác
+    workspace = os.path.join(WORK_FOLDER, job.id)
+    os.makedirs(workspace, exist_ok=True)
+    try:
         # Kiểm tra server trước
         if not check_server_status():
             logging.error("Không thể kết nối đến server AusyncLab")
-            return jsonify({'error': 'Không thể kết nối đến server AusyncLab'}), 500
-
-        text = request.form.get('text')
-        if 'textFile' in request.files:
-            file = request.files['textFile']
-            if file.filename:
-                file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-                file.save(file_path)
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    text = f.read().strip()
-                os.remove(file_path)
-
-        if not text:
-            logging.error("Văn bản rỗng")
-            return jsonify({'error': 'Văn bản rỗng'}), 400
+            raise TTSError('Không thể kết nối đến server AusyncLab')
 
-        text_chunks = split_text(text, max_length=MAX_CHAR_LIMIT, min_length=MIN_CHUNK_LENGTH)
-        logging.info(f"Chia thành {len(text_chunks)} đoạn")
+        with stage("split", chars=len(job.text)):
+            text_chunks = split_text(job.text, max_length=MAX_CHAR_LIMIT)
+        if not text_chunks:
+            raise TTSError('Văn bản rỗng')
+        job.set_chunks(text_chunks)
+        logging.info(f"Job {job.id}: chia thành {len(text_chunks)} đoạn")
         print(f"Chia thành {len(text_chunks)} đoạn")
-        audio_urls = []
-        output_files = []
 
+        # Kiểm tra độ dài trước khi gửi bất kỳ yêu cầu nào
         for i, chunk in enumerate(text_chunks):
             if len(chunk) > MAX_CHAR_LIMIT:
                 logging.error(f"Đoạn {i+1} vượt giới hạn 500 ký tự: {len(chunk)}")
-                return jsonify({'error': f'Đoạn {i+1} vượt giới hạn 500 ký tự ({len(chunk)} ký tự)'}), 400
-
-            logging.info(f"Tạo audio cho đoạn {i+1} ({len(chunk)} ký tự)")
-            print(f"Tạo audio cho đoạn {i+1} ({len(chunk)} ký tự)...")
-            # Gửi yêu cầu TTS
-            tts_url = "https://api.ausynclab.org/api/v1/speech/text-to-speech"
-            data = {
-                "audio_name": f"bai_giang_toan_lop5_part_{i+1}",
-                "text": chunk,
-                "voice_id": VOICE_ID,
-                "speed": 1.0,
-                "model_name": "myna-2",
-                "language": "vi",
-                "callback_url": CALLBACK_URL
-            }
-            headers = {
-                "X-API-Key": API_KEY,
-                "Content-Type": "application/json",
-                "accept": "application/json"
-            }
-            res_tts = session.post(tts_url, json=data, headers=headers, timeout=120)
-            res_tts.raise_for_status()
-
-            audio_id = res_tts.json().get("result", {}).get("audio_id")
-            if not audio_id:
-                logging.error(f"Không tìm thấy audio_id cho đoạn {i+1}: {res_tts.json()}")
-                return jsonify({'error': f'Không tìm thấy audio_id cho đoạn {i+1}'}), 500
-
-            logging.info(f"Audio ID đoạn {i+1}: {audio_id}")
-            print(f"Audio ID đoạn {i+1}: {audio_id}")
-            # Polling lấy audio_url
-            max_attempts = 60  # 300 giây
-            for attempt in range(max_attempts):
+                raise TTSError(f'Đoạn {i+1} vượt giới hạn 500 ký tự ({len(chunk)} ký tự)')
+
+        # Một encoder MP3 cho cả job: đoạn nào xong đúng thứ tự thì ghi ngay trong lúc các đoạn sau còn render,
+        # nên bộ nhớ không tăng theo độ dài bài giảng và lúc kết thúc chỉ còn phải đóng encoder
+        merged_output = os.path.join(workspace, "full.mp3")
+        try:
+            encoder = StreamingEncoder(merged_output, OUTPUT_FRAME_RATE, OUTPUT_CHANNELS, bitrate=OUTPUT_BITRATE)
+        except OSError as e:
+            logging.error(f"Không khởi động được ffmpeg: {e}")
+            raise TTSError('Lỗi khi ghép file MP3')
+
+        # Đưa tất cả các đoạn vào bộ lập lịch chung (tối đa MAX_INFLIGHT_CHUNKS đoạn của mọi job),
+        # job ngắn được ưu tiên nên chen được vào giữa một bài giảng dài đang render
+        ready = {}
+        next_index = 0
+        priority = job.priority_key(JOB_AGING)
+        futures = {}
+        try:
+            for i, chunk in enumerate(text_chunks):
+                if is_paragraph_break(chunk):
+                    ready[i] = make_paragraph_pause(job, i)
+                else:
+                    futures[chunk_scheduler.submit(priority, synthesize_chunk, job, i, chunk)] = i
+            for future in as_completed(futures):
+                ready[futures[future]] = future.result()
+                next_index = write_ready_segments(encoder, ready, next_index)
+
+            start = time.perf_counter()
+            with stage("merge", chunks=len(text_chunks)) as merge_span:
+                write_ready_segments(encoder, ready, next_index)
                 try:
-                    audio_info_url = f"https://api.ausynclab.org/api/v1/speech/{audio_id}"
-                    res_info = session.get(audio_info_url, headers=headers, timeout=150)
-                    res_info.raise_for_status()
-                    audio_data = res_info.json().get("result", {})
-                    if audio_data.get("state") == "SUCCEED" and audio_data.get("audio_url"):
-                        audio_urls.append(audio_data["audio_url"])
-                        logging.info(f"Audio URL đoạn {i+1}: {audio_data['audio_url']}")
-                        print(f"Audio URL đoạn {i+1}: {audio_data['audio_url']}")
-                        break
-                    logging.info(f"Đoạn {i+1} chưa sẵn sàng, thử lại {attempt + 1}/{max_attempts}")
-                    print(f"Đoạn {i+1} chưa sẵn sàng, thử lại {attempt + 1}/{max_attempts}...")
-                    time.sleep(5)
-                except requests.exceptions.RequestException as e:
-                    logging.warning(f"Polling lỗi đoạn {i+1}, thử lại {attempt + 1}/{max_attempts}: {e}")
-                    if attempt == max_attempts - 1:
-                        logging.error(f"Hết thời gian chờ cho đoạn {i+1}")
-                        return jsonify({'error': f'Hết thời gian chờ cho đoạn {i+1}'}), 500
-            else:
-                logging.error(f"Hết thời gian chờ cho đoạn {i+1}")
-                return jsonify({'error': f'Hết thời gian chờ cho đoạn {i+1}'}), 500
-
-        # Tải file audio
-        for i, audio_url in enumerate(audio_urls):
-            logging.info(f"Tải file đoạn {i+1}: {audio_url}")
-            print(f"Tải file đoạn {i+1}...")
-            response = session.get(audio_url, timeout=150)
-            response.raise_for_status()
-            wav_file = os.path.join(DOWNLOAD_FOLDER, f"bai_giang_ausync_part_{i+1}.wav")
-            with open(wav_file, "wb") as f:
-                f.write(response.content)
-            if os.path.getsize(wav_file) < 1000:
-                logging.error(f"File đoạn {i+1} quá nhỏ: {os.path.getsize(wav_file)} bytes")
-                return jsonify({'error': f'File đoạn {i+1} quá nhỏ, có thể bị lỗi'}), 500
-
-            # Chuyển WAV sang MP3
-            mp3_file = os.path.join(DOWNLOAD_FOLDER, f"bai_giang_ausync_part_{i+1}.mp3")
-            audio = AudioSegment.from_wav(wav_file)
-            audio = audio.set_channels(2).set_frame_rate(24000)
-            audio.export(mp3_file, format="mp3", bitrate="128k")
-            os.remove(wav_file)
-            output_files.append(mp3_file)
-            logging.info(f"Lưu MP3 đoạn {i+1}: {mp3_file}")
-            print(f"Lưu MP3 đoạn {i+1}: {mp3_file}")
-
-        # Ghép file MP3
-        final_output = os.path.join(DOWNLOAD_FOLDER, "bai_giang_ausync_full.mp3")
-        if len(output_files) > 1:
-            if not merge_audio_files(output_files, final_output):
-                logging.error("Lỗi khi ghép file MP3")
-                return jsonify({'error': 'Lỗi khi ghép file MP3'}), 500
-        else:
-            os.rename(output_files[0], final_output)
-
-        logging.info("Hoàn thành xử lý TTS")
-        return jsonify({'downloadUrl': '/downloads/bai_giang_ausync_full.mp3', 'type': 'audio'})
+                    encoder.close()
+                except (OSError, RuntimeError) as e:
+                    logging.error(f"Lỗi khi ghép file: {e}")
+                    raise TTSError('Lỗi khi ghép file MP3')
+                merge_span.set(bytes=os.path.getsize(merged_output))
+            merge_eta.record(sum(len(chunk) for chunk in text_chunks), time.perf_counter() - start)
+        finally:
+            # Job lỗi: dừng encoder, bỏ các đoạn chưa chạy và chờ các đoạn đang chạy trước khi xóa thư mục làm việc
+            encoder.abort()
+            for future in futures:
+                future.cancel()
+            for future in futures:
+                if not future.cancelled():
+                    future.exception()
+
+        # Chỉ đưa file vào downloads khi đã hoàn chỉnh (rename nguyên tử)
+        # Tên file theo hash nội dung nên có thể cache vĩnh viễn phía trình duyệt
+        digest = file_sha256(merged_output)
+        output_name = f"bai_giang_{digest[:CONTENT_HASH_LENGTH]}.mp3"
+        download_store.add(merged_output, output_name)
+
+        logging.info(f"Hoàn thành xử lý TTS: {output_name}")
+        return f'/downloads/{output_name}'
 
     except requests.exceptions.ReadTimeout:
         logging.error("Hết thời gian chờ khi kết nối đến AusyncLab")
-        return jsonify({'error': 'Hết thời gian chờ khi kết nối đến AusyncLab. Vui lòng thử lại.'}), 500
+        raise TTSError('Hết thời gian chờ khi kết nối đến AusyncLab. Vui lòng thử lại.')
     except requests.exceptions.RequestException as e:
         logging.error(f"Lỗi kết nối mạng: {e}")
-        return jsonify({'error': f'Lỗi kết nối mạng: {str(e)}'}), 500
+        raise TTSError(f'Lỗi kết nối mạng: {str(e)}')
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+# Hàm lập kế hoạch cho một văn bản: chia đoạn, kiểm tra cache và ước lượng thời gian xử lý
+def plan_text(text):
+    text_chunks = split_text(text, max_length=MAX_CHAR_LIMIT)
+    chunks = []
+    render_seconds = []
+    for i, chunk in enumerate(text_chunks):
+        if is_paragraph_break(chunk):
+            chunks.append({"index": i + 1, "chars": 0, "pause": True})
+            continue
+        cache_key = synthesis_cache.make_key(chunk, VOICE_ID, MODEL_NAME, SPEED, LANGUAGE)
+        cached = os.path.exists(synthesis_cache.path_for(cache_key))
+        chunks.append({"index": i + 1, "chars": len(chunk), "cached": cached})
+        if not cached:
+            render_seconds.append(chunk_eta.predict(len(chunk)))
+    total_chars = sum(c["chars"] for c in chunks)
+    # Các đoạn chạy song song tối đa MAX_INFLIGHT_CHUNKS, sau đó ghép một lần
+    estimated = parallel_makespan(render_seconds, MAX_INFLIGHT_CHUNKS) + merge_eta.predict(total_chars)
+    return {
+        "chunks": chunks,
+        "totalChunks": sum(1 for c in chunks if not c.get("pause")),
+        "cachedChunks": sum(1 for c in chunks if c.get("cached")),
+        "paragraphBreaks": sum(1 for c in chunks if c.get("pause")),
+        "totalChars": total_chars,
+        "estimatedSeconds": round(estimated, 1),
+    }
+
+# Hàm ước lượng thời gian chờ trong hàng đợi trước khi một job mới được xử lý
+# (chỉ tính các job sẽ được lấy ra trước nó theo thứ tự job ngắn trước)
+def estimate_queue_wait(estimated_seconds):
+    return round(job_queue.backlog_seconds(estimated_seconds) / TTS_WORKERS, 1)
+
+# Hàm bọc run_tts_job để ghi số liệu thời gian chờ, tổng thời gian và kết quả job
+def handle_tts_job(job):
+    STAGE_SECONDS.observe(time.time() - job.created_at, stage="queue_wait")
+    try:
+        with stage("job", job=job.id, chars=len(job.text)):
+            download_url = run_tts_job(job)
+    except Exception:
+        JOBS_TOTAL.inc(status="failed")
+        raise
+    JOBS_TOTAL.inc(status="done")
+    return download_url
+
+
+job_queue = JobQueue(handle_tts_job, num_workers=TTS_WORKERS, max_queued=MAX_QUEUED_JOBS,
+                     state_folder=JOB_FOLDER, aging=JOB_AGING)
+chunk_scheduler = ChunkScheduler(MAX_INFLIGHT_CHUNKS)
+
+# Route xử lý TTS: đưa job vào hàng đợi và trả về job ID ngay
+@app.route('/tts', methods=['POST'])
+def tts():
+    try:
+        text = request.form.get('text')
+        if 'textFile' in request.files:
+            file = request.files['textFile']
+            if file.filename:
+                # Đọc thẳng từ request, không ghi ra tên file dùng chung
+                text = file.read().decode('utf-8').strip()
+
+        if not text or not text.strip():
+            logging.error("Văn bản rỗng")
+            return jsonify({'error': 'Văn bản rỗng'}), 400
+
+        stream = request.form.get('stream') in ('1', 'true', 'on')
+        plan = plan_text(text)
+        if not plan['totalChunks']:
+            return jsonify({'error': 'Văn bản rỗng'}), 400
+        queue_wait = estimate_queue_wait(plan['estimatedSeconds'])
+        job = job_queue.submit(text, stream=stream, estimated_seconds=plan['estimatedSeconds'])
+        result = {
+            'jobId': job.id,
+            'statusUrl': f'/jobs/{job.id}',
+            'estimatedSeconds': plan['estimatedSeconds'],
+            'queueWaitSeconds': queue_wait,
+        }
+        if stream:
+            result['streamUrl'] = f'/jobs/{job.id}/stream'
+        return jsonify(result), 202
+
+    except QueueFullError:
+        logging.warning(f"Hàng đợi đầy ({job_queue.depth()} job), từ chối yêu cầu")
+        response = jsonify({'error': 'Hệ thống đang bận, vui lòng thử lại sau ít phút.'})
+        response.headers['Retry-After'] = str(QUEUE_RETRY_AFTER)
+        return response, 429
     except Exception as e:
         logging.error(f"Lỗi tổng quát: {e}")
         return jsonify({'error': f'Lỗi: {str(e)}'}), 500
 
+# Route lập kế hoạch (không gọi API): số đoạn, số ký tự mỗi đoạn và thời gian dự kiến
+@app.route('/plan', methods=['POST'])
+def plan():
+    try:
+        text = request.form.get('text')
+        if 'textFile' in request.files:
+            file = request.files['textFile']
+            if file.filename:
+                text = file.read().decode('utf-8').strip()
+
+        if not text or not text.strip():
+            return jsonify({'error': 'Văn bản rỗng'}), 400
+
+        result = plan_text(text)
+        queue_wait = estimate_queue_wait(result['estimatedSeconds'])
+        result['queueWaitSeconds'] = queue_wait
+        result['queuedJobs'] = job_queue.depth()
+        result['estimatedCompletionAt'] = time.time() + queue_wait + result['estimatedSeconds']
+        result['model'] = {'chunk': chunk_eta.snapshot(), 'merge': merge_eta.snapshot()}
+        return jsonify(result)
+    except Exception as e:
+        logging.error(f"Lỗi khi lập kế hoạch: {e}")
+        return jsonify({'error': f'Lỗi: {str(e)}'}), 500
+
+# Route xem trạng thái job
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    status = job_queue.get(job_id)
+    if status is None:
+        return jsonify({'error': 'Không tìm thấy job'}), 404
+    return jsonify(status)
+
+# Route phát audio dần: gửi từng đoạn MP3 theo thứ tự ngay khi đoạn đó xong
+# (một người đọc; đến muộn khi job đã xong thì chuyển sang file hoàn chỉnh)
+@app.route('/jobs/<job_id>/stream')
+def job_stream(job_id):
+    job = job_queue.get_job(job_id)
+    if job is None or not job.stream:
+        return jsonify({'error': 'Không tìm thấy job phát trực tiếp'}), 404
+    if not job.open_stream():
+        if job.status == 'done' and job.download_url:
+            return redirect(job.download_url)
+        return jsonify({'error': 'Luồng phát đã được mở, hãy tải file khi job hoàn thành'}), 409
+    response = Response(job.iter_stream(timeout=STREAM_CHUNK_TIMEOUT), mimetype='audio/mpeg')
+    response.call_on_close(job.close_stream)  # Kể cả khi client ngắt trước khi nhận đoạn đầu tiên
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no'  # Không để proxy gom cả response
+    return response
+
+# Route nhận callback từ AusyncLab khi một audio render xong
+@app.route('/callbacks/ausync/<token>', methods=['POST'])
+def ausync_callback(token):
+    if not CALLBACK_SECRET or not hmac.compare_digest(token, CALLBACK_SECRET):
+        return jsonify({'error': 'Not found'}), 404
+    audio_id, result = parse_ausync_callback(request.get_json(silent=True))
+    if not audio_id:
+        logging.warning(f"Callback không có audio_id: {request.get_data(as_text=True)[:500]}")
+        return jsonify({'error': 'Thiếu audio_id'}), 400
+    waiting = callbacks.resolve(audio_id, result)
+    CALLBACKS_TOTAL.inc(matched="yes" if waiting else "no")
+    logging.info(f"Callback audio {audio_id}: {result.get('state')} (đang chờ: {waiting})")
+    return jsonify({'ok': True})
+
+# Route xuất số liệu theo định dạng Prometheus
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # Route tải file
 @app.route('/downloads/<filename>')
 def download_file(filename):
-    return send_from_directory(DOWNLOAD_FOLDER, filename)
+    path = safe_join(DOWNLOAD_FOLDER, filename)
+    if path is None or not os.path.isfile(path):
+        return jsonify({'error': 'Không tìm thấy file'}), 404
+    download_store.touch(path)  # File vừa được tải sẽ bị dọn sau cùng
+    immutable = CONTENT_ADDRESSED_NAME.match(filename) is not None
+    # conditional=True: hỗ trợ Range (206) và If-None-Match (304); Werkzeug dùng
+    # wsgi.file_wrapper (sendfile) của server nếu có, hoặc X-Sendfile khi bật USE_X_SENDFILE
+    response = send_from_directory(
+        DOWNLOAD_FOLDER, filename,
+        etag=content_etag(path, filename),
+        conditional=True,
+        max_age=IMMUTABLE_MAX_AGE if immutable else 0,
+    )
+    if immutable:
+        response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 if __name__ == '__main__':
     app.run(port=5000, debug=True)
\ No newline at end of file
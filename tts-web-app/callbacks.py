@@ -0,0 +1,111 @@
+import json
+import logging
+import os
+import threading
+import time
+
+
+class CallbackRegistry:
+    """
+    Nơi gặp nhau giữa callback của AusyncLab và các luồng đang chờ một audio_id.
+    - Callback tới trước khi register() (render quá nhanh) vẫn được giữ lại trong early_ttl giây.
+    - Callback rơi vào process khác được ghi ra shared_folder; luồng chờ kiểm tra file đó
+      mỗi giây, nên chạy nhiều process vẫn nhận được.
+    """
+
+    def __init__(self, shared_folder=None, early_ttl=600):
+        self.shared_folder = shared_folder
+        self.early_ttl = early_ttl
+        self._pending = {}
+        self._early = {}
+        self._lock = threading.Lock()
+        if shared_folder:
+            os.makedirs(shared_folder, exist_ok=True)
+
+    def register(self, audio_id):
+        audio_id = str(audio_id)
+        with self._lock:
+            entry = {"event": threading.Event(), "result": None}
+            early = self._early.pop(audio_id, None)
+            if early:
+                entry["result"] = early[1]
+                entry["event"].set()
+            self._pending[audio_id] = entry
+
+    def discard(self, audio_id):
+        audio_id = str(audio_id)
+        with self._lock:
+            self._pending.pop(audio_id, None)
+        path = self._shared_path(audio_id)
+        if path:
+            try: os.remove(path)
+            except OSError: pass
+
+    def resolve(self, audio_id, result):
+        """Ghi nhận kết quả từ callback. Trả về True nếu có luồng trong process này đang chờ."""
+        audio_id = str(audio_id)
+        with self._lock:
+            entry = self._pending.get(audio_id)
+            if entry:
+                entry["result"] = result
+                entry["event"].set()
+                return True
+            self._prune_early()
+            self._early[audio_id] = (time.time(), result)
+        path = self._shared_path(audio_id)
+        if path:
+            tmp_path = f"{path}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(result, f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logging.warning(f"Không ghi được callback {audio_id}: {e}")
+        return False
+
+    def wait(self, audio_id, timeout):
+        """Chờ callback cho audio_id tối đa timeout giây; trả về kết quả hoặc None."""
+        audio_id = str(audio_id)
+        with self._lock:
+            entry = self._pending.get(audio_id)
+        if not entry:
+            return None
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if entry["event"].wait(timeout=max(0, min(1.0, remaining))):
+                return entry["result"]
+            result = self._read_shared(audio_id)
+            if result is not None:
+                return result
+            if remaining <= 0:
+                return None
+
+    def _read_shared(self, audio_id):
+        path = self._shared_path(audio_id)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _shared_path(self, audio_id):
+        if not self.shared_folder or not audio_id.isalnum():
+            return None
+        return os.path.join(self.shared_folder, f"{audio_id}.json")
+
+    def _prune_early(self):
+        cutoff = time.time() - self.early_ttl
+        for audio_id in [k for k, (ts, _) in self._early.items() if ts < cutoff]:
+            del self._early[audio_id]
+
+
+def parse_ausync_callback(payload):
+    """Lấy (audio_id, result) từ body callback; body có thể bọc trong 'result' giống API /speech."""
+    if not isinstance(payload, dict):
+        return None, None
+    result = payload.get("result") if isinstance(payload.get("result"), dict) else payload
+    audio_id = result.get("audio_id") or result.get("id")
+    return audio_id, result
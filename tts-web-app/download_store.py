@@ -0,0 +1,122 @@
+import fnmatch
+import logging
+import os
+import threading
+import time
+
+
+class DownloadStore:
+    """
+    Quản lý thư mục file kết quả với giới hạn dung lượng và thời gian sống.
+    - atime của file được đặt lại mỗi lần tải (mtime giữ nguyên để ETag không đổi),
+      nên mọi process đều thấy lần tải gần nhất mà không cần file chỉ mục.
+    - Luồng dọn dẹp chạy nền: xóa file không ai tải quá ttl giây, rồi nếu vẫn vượt
+      max_bytes thì xóa file lâu chưa được tải nhất trước.
+    """
+
+    def __init__(self, folder, max_bytes, ttl, pattern="*.mp3", sweep_interval=60, touch_interval=60):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.pattern = pattern
+        self.sweep_interval = sweep_interval
+        self.touch_interval = touch_interval
+        self.evictions = 0
+        self._usage = {"bytes": 0, "files": 0}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        os.makedirs(folder, exist_ok=True)
+
+    def start(self):
+        self.sweep()
+        thread = threading.Thread(target=self._run, name="download-sweeper", daemon=True)
+        thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def add(self, src_path, name):
+        """Đưa file đã hoàn chỉnh vào kho (rename nguyên tử) và trả về đường dẫn mới."""
+        dest = os.path.join(self.folder, name)
+        try:
+            replaced = os.path.getsize(dest)  # Cùng nội dung đã có sẵn (tên theo hash)
+        except OSError:
+            replaced = None
+        os.replace(src_path, dest)
+        self._set_last_access(dest, time.time())
+        with self._lock:
+            if replaced is None:
+                self._usage["files"] += 1
+            else:
+                self._usage["bytes"] -= replaced
+            self._usage["bytes"] += os.path.getsize(dest)
+        return dest
+
+    def touch(self, path):
+        """Ghi nhận một lần tải; bỏ qua nếu vừa ghi nhận gần đây để đỡ tốn syscall."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        now = time.time()
+        if now - st.st_atime >= self.touch_interval:
+            self._set_last_access(path, now, st)
+
+    def sweep(self):
+        """Xóa file hết hạn rồi xóa theo LRU cho tới khi dưới max_bytes."""
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.folder):
+            if not fnmatch.fnmatch(name, self.pattern):
+                continue
+            path = os.path.join(self.folder, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_atime, st.st_size, path))
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        kept = len(entries)
+        evicted = 0
+        for last_access, size, path in entries:
+            expired = now - last_access > self.ttl
+            if not expired and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                kept -= 1
+                evicted += 1
+                reason = "hết hạn" if expired else "vượt dung lượng"
+                logging.info(f"Xóa file tải về ({reason}): {path}")
+            except OSError:
+                pass
+
+        with self._lock:
+            self._usage = {"bytes": total, "files": kept}
+            self.evictions += evicted
+
+    def stats(self):
+        with self._lock:
+            return {
+                "bytes": self._usage["bytes"],
+                "files": self._usage["files"],
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+    def _set_last_access(self, path, when, st=None):
+        try:
+            st = st or os.stat(path)
+            os.utime(path, ns=(int(when * 1e9), st.st_mtime_ns))
+        except OSError:
+            pass
+
+    def _run(self):
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error(f"Lỗi khi dọn thư mục tải về: {e}")
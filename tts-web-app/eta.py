@@ -0,0 +1,110 @@
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+
+class LinearEstimator:
+    """
+    Ước lượng thời gian theo số ký tự: giây = intercept + per_char * ký tự.
+    - Hệ số được khớp bình phương tối thiểu trên max_samples mẫu gần nhất,
+      nên tự điều chỉnh khi tốc độ của nhà cung cấp thay đổi.
+    - Khi chưa đủ min_samples mẫu thì dùng hệ số mặc định.
+    - state_file (tùy chọn) giữ mẫu qua các lần khởi động lại.
+    """
+
+    def __init__(self, name, default_intercept, default_per_char, max_samples=500,
+                 min_samples=5, state_file=None, save_interval=10):
+        self.name = name
+        self.default_intercept = default_intercept
+        self.default_per_char = default_per_char
+        self.min_samples = min_samples
+        self.state_file = state_file
+        self.save_interval = save_interval
+        self._samples = deque(maxlen=max_samples)
+        self._coef = None
+        self._last_save = 0.0
+        self._lock = threading.Lock()
+        self._load()
+
+    def record(self, chars, seconds):
+        with self._lock:
+            self._samples.append((chars, seconds))
+            self._coef = None
+            should_save = time.time() - self._last_save >= self.save_interval
+            if should_save:
+                self._last_save = time.time()
+        if should_save:
+            self._save()
+
+    def coefficients(self):
+        """Trả về (intercept, per_char), chỉ khớp lại khi có mẫu mới."""
+        with self._lock:
+            if self._coef is None:
+                self._coef = self._fit(list(self._samples))
+            return self._coef
+
+    def predict(self, chars):
+        intercept, per_char = self.coefficients()
+        return intercept + per_char * chars
+
+    def snapshot(self):
+        intercept, per_char = self.coefficients()
+        with self._lock:
+            samples = len(self._samples)
+        return {"intercept": round(intercept, 3), "perChar": round(per_char, 5), "samples": samples}
+
+    def _fit(self, samples):
+        if len(samples) < self.min_samples:
+            return self.default_intercept, self.default_per_char
+        n = len(samples)
+        mean_x = sum(x for x, _ in samples) / n
+        mean_y = sum(y for _, y in samples) / n
+        var_x = sum((x - mean_x) ** 2 for x, _ in samples)
+        if var_x == 0:
+            # Mọi mẫu cùng độ dài: chỉ biết tỉ lệ trung bình
+            return 0.0, mean_y / mean_x if mean_x else self.default_per_char
+        per_char = sum((x - mean_x) * (y - mean_y) for x, y in samples) / var_x
+        per_char = max(per_char, 0.0)
+        intercept = max(mean_y - per_char * mean_x, 0.0)
+        return intercept, per_char
+
+    def _load(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for chars, seconds in data.get("samples", []):
+                self._samples.append((chars, seconds))
+        except (OSError, ValueError, TypeError):
+            logging.warning(f"Không đọc được mẫu thời gian {self.name}: {self.state_file}")
+
+    def _save(self):
+        if not self.state_file:
+            return
+        with self._lock:
+            data = {"samples": list(self._samples)}
+        tmp_path = f"{self.state_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.state_file)
+        except OSError as e:
+            logging.warning(f"Không ghi được mẫu thời gian {self.name}: {e}")
+
+
+def parallel_makespan(durations, concurrency):
+    """
+    Thời gian xong toàn bộ khi chạy durations theo thứ tự trên concurrency luồng
+    (giống ThreadPoolExecutor: việc tiếp theo vào luồng rảnh sớm nhất).
+    """
+    if not durations:
+        return 0.0
+    slots = [0.0] * max(1, min(concurrency, len(durations)))
+    for duration in durations:
+        heapq.heapreplace(slots, slots[0] + duration)
+    return max(slots)
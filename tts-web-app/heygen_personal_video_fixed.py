@@ -2,6 +2,12 @@ import requests
 import json
 import time
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.transport import get_session
+
+session = get_session()
 
 # HeyGen API configuration
 API_KEY = ""
@@ -27,7 +33,7 @@ def upload_asset(file_path, content_type):
     
     try:
         with open(file_path, "rb") as file:
-            response = requests.post(url, headers=headers, data=file, timeout=60)
+            response = session.post(url, headers=headers, data=file)
             print(f"Mã trạng thái HTTP cho {file_path}: {response.status_code}")
             print(f"Nội dung phản hồi: {response.text}")
             response.raise_for_status()
@@ -55,7 +61,7 @@ def check_video_status(video_id):
     
     while True:
         try:
-            response = requests.get(url, headers=headers, timeout=30)
+            response = session.get(url, headers=headers)
             print(f"Mã trạng thái HTTP trạng thái video: {response.status_code}")
             print(f"Nội dung phản hồi: {response.text}")
             result = response.json()
@@ -132,7 +138,7 @@ headers = {
 }
 
 try:
-    response = requests.post(url, headers=headers, data=json.dumps(video_data), timeout=60)
+    response = session.post(url, headers=headers, data=json.dumps(video_data))
     print(f"Mã trạng thái HTTP tạo video: {response.status_code}")
     print(f"Nội dung phản hồi: {response.text}")
     result = response.json()
@@ -152,7 +158,7 @@ if result.get("code") == 100 or result.get("data", {}).get("video_id"):
     if video_url:
         print(f"✅ Video đã hoàn thành! URL: {video_url}")
         try:
-            video_response = requests.get(video_url, timeout=60)
+            video_response = session.get(video_url)
             with open("output_video.mp4", "wb") as f:
                 f.write(video_response.content)
             print("🎉 Video đã được tải về: output_video.mp4")
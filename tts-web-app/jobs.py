@@ -0,0 +1,303 @@
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+
+class QueueFullError(Exception):
+    """Hàng đợi job đã đầy, client cần thử lại sau."""
+
+
+class Job:
+    """Một yêu cầu TTS chạy nền, theo dõi tiến độ từng đoạn."""
+
+    def __init__(self, text, stream=False, estimated_seconds=None):
+        self.id = uuid.uuid4().hex
+        self.text = text
+        self.stream = stream  # Giữ audio từng đoạn để phát dần cho client
+        self.estimated_seconds = estimated_seconds  # Thời gian xử lý dự kiến (không tính chờ hàng đợi)
+        self.status = "queued"  # queued | running | done | failed
+        self.chunks = []
+        self.download_url = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._save_lock = threading.Lock()  # Các luồng của bộ lập lịch ghi trạng thái lần lượt
+        self._stream_parts = {}
+        self._stream_state = "waiting"  # waiting | reading | closed: chỉ một người đọc luồng phát dần
+        self._listener = None
+
+    def priority_key(self, aging):
+        """
+        Khóa ưu tiên kiểu job ngắn trước (nhỏ hơn chạy trước), có tính thời gian chờ.
+        estimate - aging * (now - created_at) = (estimate + aging * created_at) - aging * now,
+        phần trừ đi như nhau với mọi job nên khóa không đổi theo thời gian và dùng được cho heap.
+        Một job dài chỉ bị job ngắn đến sau vượt qua trong tối đa (chênh lệch ước lượng) / aging giây.
+        """
+        return (self.estimated_seconds or 0) + aging * self.created_at
+
+    def set_chunks(self, chunk_texts):
+        with self._cond:
+            self.chunks = [
+                {"index": i + 1, "chars": len(chunk), "state": "pending"}
+                for i, chunk in enumerate(chunk_texts)
+            ]
+            self._cond.notify_all()
+        self._changed()
+
+    def set_chunk_state(self, index, state):
+        """Cập nhật trạng thái đoạn thứ index (bắt đầu từ 0)."""
+        with self._lock:
+            self.chunks[index]["state"] = state
+        self._changed()
+
+    def set_status(self, status, download_url=None, error=None):
+        with self._cond:
+            self.status = status
+            if status == "running":
+                self.started_at = time.time()
+            if status in ("done", "failed"):
+                self.finished_at = time.time()
+                if self._stream_state == "waiting":
+                    # Chưa ai mở luồng: bỏ audio từng đoạn, người đến muộn tải file hoàn chỉnh
+                    self._stream_state = "closed"
+                    self._stream_parts.clear()
+            if download_url:
+                self.download_url = download_url
+            if error:
+                self.error = error
+            self._cond.notify_all()
+        self._changed()
+
+    def add_stream_part(self, index, data):
+        """Lưu audio MP3 của đoạn thứ index (bắt đầu từ 0) để phát dần, tới khi được gửi đi."""
+        with self._cond:
+            if self._stream_state == "closed":
+                return
+            self._stream_parts[index] = data
+            self._cond.notify_all()
+
+    def open_stream(self):
+        """Nhận quyền đọc luồng phát dần; False nếu luồng đã có người đọc hoặc đã đóng."""
+        with self._lock:
+            if self._stream_state != "waiting":
+                return False
+            self._stream_state = "reading"
+            return True
+
+    def iter_stream(self, timeout=300):
+        """
+        Trả về audio từng đoạn theo đúng thứ tự, ngay khi đoạn đó sẵn sàng (gọi sau open_stream).
+        Đoạn đã gửi được bỏ khỏi bộ nhớ; dừng khi đã gửi hết, job thất bại hoặc chờ một đoạn quá timeout giây.
+        """
+        index = 0
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(
+                        lambda: index in self._stream_parts
+                        or self.status == "failed"
+                        or (self.chunks and index >= len(self.chunks)),
+                        timeout=timeout,
+                    )
+                    data = self._stream_parts.pop(index, None)
+                if data is None:
+                    return
+                yield data
+                index += 1
+        finally:
+            self.close_stream()
+
+    def close_stream(self):
+        """Hết luồng hoặc client ngắt kết nối: bỏ các đoạn còn giữ và không nhận thêm đoạn nào."""
+        with self._lock:
+            self._stream_state = "closed"
+            self._stream_parts.clear()
+
+    def to_dict(self):
+        with self._lock:
+            done = sum(1 for c in self.chunks if c["state"] == "done")
+            return {
+                "jobId": self.id,
+                "status": self.status,
+                "chunks": [dict(c) for c in self.chunks],
+                "completedChunks": done,
+                "totalChunks": len(self.chunks),
+                "downloadUrl": self.download_url,
+                "streamUrl": f"/jobs/{self.id}/stream" if self.stream else None,
+                "error": self.error,
+                "estimatedSeconds": self.estimated_seconds,
+                "createdAt": self.created_at,
+                "startedAt": self.started_at,
+                "finishedAt": self.finished_at,
+            }
+
+    def _changed(self):
+        if self._listener:
+            self._listener(self)
+
+
+class JobQueue:
+    """
+    Hàng đợi job có giới hạn với một nhóm worker cố định.
+    - submit() trả về ngay, ném QueueFullError khi hàng đợi đầy.
+    - Job có thời gian dự kiến ngắn được lấy ra trước; aging (giây ước lượng được trừ
+      cho mỗi giây chờ) bảo đảm job dài không bị bỏ đói.
+    - Trạng thái job được ghi ra state_folder để mọi process cùng đọc được;
+      file của job đã không đổi quá job_ttl giây bị xóa (quét tối đa mỗi STATE_SWEEP_INTERVAL giây).
+    """
+
+    STATE_SWEEP_INTERVAL = 60
+
+    def __init__(self, handler, num_workers=2, max_queued=20, state_folder=None, job_ttl=3600, aging=1.0):
+        self.handler = handler
+        self.state_folder = state_folder
+        self.job_ttl = job_ttl
+        self.max_queued = max_queued
+        self.aging = aging
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._jobs = {}
+        self._jobs_lock = threading.Lock()
+        self._last_sweep = 0.0
+        if state_folder:
+            os.makedirs(state_folder, exist_ok=True)
+        for n in range(num_workers):
+            worker = threading.Thread(target=self._worker, name=f"tts-worker-{n + 1}", daemon=True)
+            worker.start()
+
+    def submit(self, text, stream=False, estimated_seconds=None):
+        self._prune()
+        job = Job(text, stream=stream, estimated_seconds=estimated_seconds)
+        job._listener = self.save
+        with self._jobs_lock:
+            self._jobs[job.id] = job
+        with self._cond:
+            full = len(self._heap) >= self.max_queued
+            if not full:
+                heapq.heappush(self._heap, (job.priority_key(self.aging), next(self._seq), job))
+                self._cond.notify()
+        if full:
+            with self._jobs_lock:
+                del self._jobs[job.id]
+            raise QueueFullError("Hàng đợi đang đầy")
+        self.save(job)
+        logging.info(f"Nhận job {job.id} ({len(text)} ký tự), hàng đợi: {self.depth()}")
+        return job
+
+    def get(self, job_id):
+        """Trả về trạng thái job dạng dict, đọc từ bộ nhớ hoặc từ file trạng thái."""
+        with self._jobs_lock:
+            job = self._jobs.get(job_id)
+        if job:
+            return job.to_dict()
+        if self.state_folder:
+            path = self._state_path(job_id)
+            if path and os.path.exists(path):
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        return json.load(f)
+                except (OSError, ValueError) as e:
+                    logging.warning(f"Không đọc được trạng thái job {job_id}: {e}")
+        return None
+
+    def get_job(self, job_id):
+        """Trả về đối tượng Job đang nằm trong bộ nhớ của process này."""
+        with self._jobs_lock:
+            return self._jobs.get(job_id)
+
+    def depth(self):
+        with self._cond:
+            return len(self._heap)
+
+    def backlog_seconds(self, estimated_seconds=None):
+        """
+        Tổng thời gian dự kiến của các job đang chờ (job chưa có ước lượng tính là 0).
+        Nếu truyền estimated_seconds thì chỉ tính các job sẽ chạy trước một job mới có ước lượng đó.
+        """
+        limit = None
+        if estimated_seconds is not None:
+            limit = estimated_seconds + self.aging * time.time()
+        with self._cond:
+            return sum(job.estimated_seconds or 0 for key, _, job in self._heap
+                       if limit is None or key <= limit)
+
+    def save(self, job):
+        if not self.state_folder:
+            return
+        path = self._state_path(job.id)
+        # Tên tạm riêng cho mỗi lần ghi, và ghi lần lượt theo job: bản chụp sau luôn được ghi sau
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with job._save_lock:
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(job.to_dict(), f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logging.warning(f"Không ghi được trạng thái job {job.id}: {e}")
+                try: os.remove(tmp_path)
+                except OSError: pass
+
+    def _prune(self):
+        """Bỏ các job đã xong quá job_ttl giây khỏi bộ nhớ, và xóa file trạng thái cũ hơn job_ttl."""
+        now = time.time()
+        cutoff = now - self.job_ttl
+        with self._jobs_lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at and job.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+            active = set(self._jobs)
+            sweep = self.state_folder and now - self._last_sweep >= self.STATE_SWEEP_INTERVAL
+            if sweep:
+                self._last_sweep = now
+        if sweep:
+            self._sweep_state_files(cutoff, active)
+
+    def _sweep_state_files(self, cutoff, active):
+        # Quét cả file của process khác (và file tạm bị bỏ dở): file nào không được ghi từ trước cutoff
+        # thì job đó đã xong từ lâu; job còn trong bộ nhớ của process này thì giữ
+        try:
+            names = os.listdir(self.state_folder)
+        except OSError:
+            return
+        for name in names:
+            if name.split(".", 1)[0] in active or not name.endswith((".json", ".tmp")):
+                continue
+            path = os.path.join(self.state_folder, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _state_path(self, job_id):
+        # Chỉ chấp nhận job_id dạng hex để tránh path traversal
+        if not job_id or any(c not in "0123456789abcdef" for c in job_id):
+            return None
+        return os.path.join(self.state_folder, f"{job_id}.json")
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, job = heapq.heappop(self._heap)
+            job.set_status("running")
+            try:
+                download_url = self.handler(job)
+                job.set_status("done", download_url=download_url)
+                logging.info(f"Job {job.id} hoàn thành: {download_url}")
+            except Exception as e:
+                logging.error(f"Job {job.id} thất bại: {e}")
+                job.set_status("failed", error=str(e))
+            finally:
+                job.text = None  # Giải phóng văn bản gốc khi job đã xong
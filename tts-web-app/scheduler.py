@@ -0,0 +1,54 @@
+import contextvars
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
+
+
+class ChunkScheduler:
+    """
+    Nhóm luồng dùng chung cho các đoạn của mọi job, thay cho một executor riêng mỗi job.
+    - Tổng số đoạn gửi tới nhà cung cấp cùng lúc không vượt num_workers.
+    - Đoạn có khóa ưu tiên nhỏ hơn chạy trước (khóa của job, xem Job.priority_key),
+      nên đoạn của câu ngắn chen lên trước phần còn lại của một bài giảng dài;
+      cùng khóa thì giữ thứ tự gửi vào để các đoạn của một job xong lần lượt.
+    - submit() trả về concurrent.futures.Future, hủy được khi job thất bại.
+    - Hàm chạy trong context (contextvars) của luồng gọi submit(), nên span trace của job
+      vẫn là cha của span từng đoạn dù chạy ở luồng khác.
+    """
+
+    def __init__(self, num_workers, name="chunk"):
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        for n in range(num_workers):
+            worker = threading.Thread(target=self._worker, name=f"{name}-{n + 1}", daemon=True)
+            worker.start()
+
+    def submit(self, priority, fn, *args):
+        future = Future()
+        with self._cond:
+            heapq.heappush(self._heap, (priority, next(self._seq), future, contextvars.copy_context(), fn, args))
+            self._cond.notify()
+        return future
+
+    def depth(self):
+        with self._cond:
+            return len(self._heap)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, future, ctx, fn, args = heapq.heappop(self._heap)
+            if not future.set_running_or_notify_cancel():
+                continue  # Job đã hủy đoạn này
+            try:
+                result = ctx.run(fn, *args)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            finally:
+                future = ctx = fn = args = result = None  # Không giữ audio/văn bản của đoạn đã xong